@@ -12,6 +12,8 @@ export default function Chatbox() {
   const [loading, setLoading] = useState(false);
   const [lastEntryId, setLastEntryId] = useState(null);
   const [showRating, setShowRating] = useState(false);
+  // Lets the server remember this conversation for follow-up questions
+  const [sessionId] = useState(() => Math.random().toString(36).slice(2) + Date.now().toString(36));
 
   const sendMessage = async () => {
     if (!input.trim()) return;
@@ -26,38 +28,71 @@ export default function Chatbox() {
     setLoading(true);
     setShowRating(false);
 
+    const replyId = Date.now() + 1;
+    const updateReply = (changes) =>
+      setMessages(prev => prev.map(msg => (msg.id === replyId ? { ...msg, ...changes } : msg)));
+    const addReply = (reply) => {
+      setMessages(prev => [...prev, { id: replyId, role: "assistant", ...reply }]);
+      setLoading(false);
+    };
+
     try {
-      const response = await fetch(`${API_BASE_URL}/chat/`, {
+      // Answers arrive as Server-Sent Events, so LLM answers show up as they are written
+      const response = await fetch(`${API_BASE_URL}/chat/stream/`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         credentials: "include",
-        body: JSON.stringify({ message: userMessage }),
+        body: JSON.stringify({ message: userMessage, session_id: sessionId }),
       });
 
-      const data = await response.json();
-
       if (!response.ok) {
-        setMessages(prev => [...prev, {
-          id: Date.now() + 1,
-          role: "assistant",
-          text: data.error || "Sorry, I couldn't process your request."
-        }]);
+        const data = await response.json().catch(() => ({}));
+        addReply({ text: data.error || "Sorry, I couldn't process your request." });
         return;
       }
 
-      // Add AI response
-      setMessages(prev => [...prev, {
-        id: Date.now() + 1,
-        role: "assistant",
-        text: data.response,
-        source: data.source,
-        entryId: data.entry_id
-      }]);
-
-      // Show rating option if response came from knowledge base (only for logged-in users)
-      if (data.source === "knowledge_base" && data.entry_id && user) {
-        setLastEntryId(data.entry_id);
-        setShowRating(true);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let text = "";
+
+      const handleEvent = (event, data) => {
+        if (event === "answer") {
+          // A KB or cached answer, sent whole
+          addReply({ text: data.response, source: data.source, entryId: data.entry_id });
+          // Show rating option if response came from knowledge base (only for logged-in users)
+          if (data.source === "knowledge_base" && data.entry_id && user) {
+            setLastEntryId(data.entry_id);
+            setShowRating(true);
+          }
+        } else if (event === "token") {
+          if (!text) addReply({ text: "", source: "llm" });
+          text += data.content;
+          updateReply({ text });
+        } else if (event === "done") {
+          updateReply({ entryId: data.entry_id });
+        } else if (event === "error") {
+          if (text) updateReply({ text: `${text}\n\n${data.error}` });
+          else addReply({ text: data.error });
+        }
+      };
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        // Events are separated by a blank line: "event: <name>\ndata: <json>\n\n"
+        const frames = buffer.split("\n\n");
+        buffer = frames.pop();
+        for (const frame of frames) {
+          let event = "message";
+          let data = "";
+          for (const line of frame.split("\n")) {
+            if (line.startsWith("event: ")) event = line.slice(7);
+            else if (line.startsWith("data: ")) data += line.slice(6);
+          }
+          if (data) handleEvent(event, JSON.parse(data));
+        }
       }
 
     } catch (error) {
@@ -1,3 +1,6 @@
 // API Configuration
 // Change this to match your backend URL
 export const API_BASE_URL = "http://localhost:8000/api";
+
+// Live bidding events (served by the same backend over WebSocket)
+export const BIDDING_WS_URL = API_BASE_URL.replace(/^http/, "ws").replace(/\/api\/?$/, "/ws/bidding/");
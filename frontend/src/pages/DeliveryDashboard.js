@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from "react";
 import { useParams, useNavigate } from "react-router-dom";
 import { API_BASE_URL } from "../config";
+import { subscribeToBidding } from "../realtime";
 import {
   AvailableOrdersTab,
   ActiveDeliveriesTab,
@@ -41,6 +42,15 @@ export default function DeliveryDashboard() {
     fetchDataForTab(activeTab);
   }, [activeTab]);
 
+  // Reload the bidding board when orders are placed, bid on or assigned
+  useEffect(() => {
+    if (activeTab !== "available") return undefined;
+    return subscribeToBidding(() => {
+      fetchAvailableOrders();
+      fetchMyBids();
+    });
+  }, [activeTab]);
+
   // Clear success messages after 5 seconds
   useEffect(() => {
     if (successMsg) {
@@ -5,18 +5,28 @@ import { API_BASE_URL } from "../config";
 export default function DiscussionBoard() {
   const [topics, setTopics] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [sort, setSort] = useState("newest");
+  const [nextCursor, setNextCursor] = useState(null);
+  const [query, setQuery] = useState("");
+  const [results, setResults] = useState(null); // null when not searching
+  const [searchPage, setSearchPage] = useState(1);
+  const [hasMoreResults, setHasMoreResults] = useState(false);
 
   useEffect(() => {
     loadTopics();
-  }, []);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [sort]);
 
-  const loadTopics = async () => {
+  const loadTopics = async (cursor = null) => {
     try {
-      const res = await fetch(`${API_BASE_URL}/discussion_board/`, {
+      const params = new URLSearchParams({ sort });
+      if (cursor) params.set("cursor", cursor);
+      const res = await fetch(`${API_BASE_URL}/discussion_board/?${params}`, {
         credentials: "include",
       });
       const data = await res.json();
-      setTopics(data.titles || []);
+      setTopics(prev => cursor ? [...prev, ...(data.titles || [])] : (data.titles || []));
+      setNextCursor(data.next_cursor || null);
     } catch (err) {
       console.log("Failed to load topics");
     } finally {
@@ -24,6 +34,25 @@ export default function DiscussionBoard() {
     }
   };
 
+  const runSearch = async (page = 1) => {
+    if (!query.trim()) {
+      setResults(null);
+      return;
+    }
+    try {
+      const params = new URLSearchParams({ q: query.trim(), page });
+      const res = await fetch(`${API_BASE_URL}/discussion_board/search/?${params}`, {
+        credentials: "include",
+      });
+      const data = await res.json();
+      setResults(prev => page > 1 ? [...(prev || []), ...(data.results || [])] : (data.results || []));
+      setSearchPage(page);
+      setHasMoreResults(!!data.has_more);
+    } catch (err) {
+      console.log("Search failed");
+    }
+  };
+
   const getTopicBadge = (topicType) => {
     switch (topicType) {
       case 'chef': return <span className="badge badge-primary">Chef</span>;
@@ -44,11 +73,63 @@ export default function DiscussionBoard() {
         </Link>
       </div>
 
-      <p className="mb-4 opacity-70">
-        Discuss chefs, dishes, and delivery experiences with other customers
-      </p>
+      <div className="flex justify-between items-center mb-4 gap-4">
+        <p className="opacity-70">
+          Discuss chefs, dishes, and delivery experiences with other customers
+        </p>
+        <select
+          className="select select-bordered select-sm"
+          value={sort}
+          onChange={(e) => setSort(e.target.value)}
+        >
+          <option value="newest">Newest</option>
+          <option value="activity">Recent activity</option>
+        </select>
+      </div>
+
+      <form
+        className="flex gap-2 mb-4"
+        onSubmit={(e) => { e.preventDefault(); runSearch(); }}
+      >
+        <input
+          type="search"
+          className="input input-bordered input-sm flex-1"
+          placeholder="Search topics and replies..."
+          value={query}
+          onChange={(e) => { setQuery(e.target.value); if (!e.target.value) setResults(null); }}
+        />
+        <button type="submit" className="btn btn-sm">Search</button>
+      </form>
 
-      {topics.length === 0 ? (
+      {results !== null ? (
+        <div className="flex flex-col gap-4">
+          {results.length === 0 && <p className="text-center opacity-70 py-4">No matches.</p>}
+          {results.map((hit) => (
+            <Link
+              key={`${hit.type}-${hit.post_id || hit.topic_id}`}
+              to={`/discussion/${hit.topic_id}`}
+              className="card bg-base-100 shadow-lg hover:shadow-xl transition-shadow"
+            >
+              <div className="card-body">
+                <div className="flex justify-between items-start">
+                  <h3 className="card-title text-lg">{hit.title}</h3>
+                  {getTopicBadge(hit.topic_type)}
+                </div>
+                {/* highlight is HTML-escaped by the server apart from its <mark> tags */}
+                <p className="text-sm" dangerouslySetInnerHTML={{ __html: hit.highlight }} />
+                <div className="text-sm opacity-70">
+                  {hit.type === "post" ? "Reply" : "Topic"} by {hit.author} • {hit.created_at}
+                </div>
+              </div>
+            </Link>
+          ))}
+          {hasMoreResults && (
+            <button className="btn btn-outline" onClick={() => runSearch(searchPage + 1)}>
+              More results
+            </button>
+          )}
+        </div>
+      ) : topics.length === 0 ? (
         <div className="card bg-base-100 shadow-lg p-8 text-center">
           <p className="opacity-70">No discussion topics yet.</p>
           <p className="text-sm mt-2">Be the first to start a discussion!</p>
@@ -74,6 +155,11 @@ export default function DiscussionBoard() {
               </div>
             </Link>
           ))}
+          {nextCursor && (
+            <button className="btn btn-outline" onClick={() => loadTopics(nextCursor)}>
+              Load more
+            </button>
+          )}
         </div>
       )}
     </div>
@@ -10,6 +10,8 @@ export default function DiscussionPost() {
 
   const [post, setPost] = useState(null);
   const [comments, setComments] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [latestCursor, setLatestCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [newComment, setNewComment] = useState("");
   const [submitting, setSubmitting] = useState(false);
@@ -33,14 +35,19 @@ export default function DiscussionPost() {
     loadPost();
   }, [id]);
 
-  const loadPost = async () => {
+  // First page of comments (oldest first), or the next page when given a cursor
+  const loadPost = async (cursor = null) => {
     try {
-      const res = await fetch(`${API_BASE_URL}/topic/?post_id=${id}`, {
+      const params = new URLSearchParams({ post_id: id });
+      if (cursor) params.set("cursor", cursor);
+      const res = await fetch(`${API_BASE_URL}/topic/?${params}`, {
         credentials: "include",
       });
       const data = await res.json();
-      setPost(data.post);
-      setComments(data.comments || []);
+      if (!cursor) setPost(data.post);
+      setComments(prev => cursor ? [...prev, ...(data.comments || [])] : (data.comments || []));
+      setNextCursor(data.next_cursor || null);
+      setLatestCursor(data.latest_cursor || null);
     } catch (error) {
       console.error("Failed to load post:", error);
     } finally {
@@ -48,6 +55,24 @@ export default function DiscussionPost() {
     }
   };
 
+  // Only the comments posted after the ones already shown
+  const loadNewComments = async () => {
+    if (!latestCursor) return loadPost();
+    try {
+      const params = new URLSearchParams({ post_id: id, since: latestCursor });
+      const res = await fetch(`${API_BASE_URL}/topic/?${params}`, {
+        credentials: "include",
+      });
+      const data = await res.json();
+      const seen = new Set(comments.map(c => c.id));
+      setComments(prev => [...prev, ...(data.comments || []).filter(c => !seen.has(c.id))]);
+      setNextCursor(data.next_cursor || null);
+      setLatestCursor(data.latest_cursor || latestCursor);
+    } catch (error) {
+      console.error("Failed to load new comments:", error);
+    }
+  };
+
   const submitComment = async (e) => {
     e.preventDefault();
     setErrorMsg("");
@@ -74,7 +99,9 @@ export default function DiscussionPost() {
 
       if (res.ok) {
         setNewComment("");
-        loadPost(); // Reload to get new comment
+        // Fetch just the new comment; if older pages are still unloaded it shows up under "Load more"
+        if (!nextCursor) loadNewComments();
+        setPost(prev => prev && { ...prev, post_count: (prev.post_count || 0) + 1 });
       } else {
         setErrorMsg(data.error || "Failed to post comment");
       }
@@ -132,7 +159,7 @@ export default function DiscussionPost() {
       <div className="card bg-base-100 shadow-xl">
         <div className="card-body">
           <h3 className="card-title">
-            Comments ({comments.length})
+            Comments ({post.post_count ?? comments.length})
           </h3>
 
           {/* Comment Form */}
@@ -194,6 +221,14 @@ export default function DiscussionPost() {
               ))}
             </div>
           )}
+
+          {nextCursor && (
+            <div className="text-center mt-4">
+              <button className="btn btn-outline btn-sm" onClick={() => loadPost(nextCursor)}>
+                Load more
+              </button>
+            </div>
+          )}
         </div>
       </div>
     </div>
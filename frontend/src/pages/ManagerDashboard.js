@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from "react";
 import { useParams, useNavigate } from "react-router-dom";
 import { API_BASE_URL } from "../config";
+import { subscribeToBidding } from "../realtime";
 import {
   RegistrationsTab,
   ComplaintsTab,
@@ -46,6 +47,12 @@ export default function ManagerDashboard() {
     fetchDataForTab(activeTab);
   }, [activeTab]);
 
+  // Reload pending deliveries when orders are placed, bid on or assigned
+  useEffect(() => {
+    if (activeTab !== "deliveries") return undefined;
+    return subscribeToBidding(() => fetchDeliveries());
+  }, [activeTab]);
+
   // Clear success messages after 5 seconds
   useEffect(() => {
     if (successMsg) {
@@ -0,0 +1,54 @@
+import { BIDDING_WS_URL } from "./config";
+
+// Subscribe to live bidding events (order.created, bid.created, order.assigned).
+// Reconnects with backoff after the connection drops; the server closes with
+// 4003/4004 for users who may not listen, and those are not retried. A backend
+// that never accepts the socket (e.g. manage.py runserver, which has no
+// WebSocket support) is given up on after MAX_FAILED_CONNECTS attempts.
+// Returns a function that closes the subscription.
+const MAX_FAILED_CONNECTS = 3;
+
+export function subscribeToBidding(onEvent) {
+  let socket = null;
+  let retryTimer = null;
+  let retryDelay = 1000;
+  let closed = false;
+  let everOpened = false;
+  let failedConnects = 0;
+
+  const connect = () => {
+    socket = new WebSocket(BIDDING_WS_URL);
+
+    socket.onopen = () => {
+      everOpened = true;
+      retryDelay = 1000;
+    };
+
+    socket.onmessage = (message) => {
+      try {
+        const event = JSON.parse(message.data);
+        if (event.type !== "pong") onEvent(event);
+      } catch (error) {
+        console.error("Bad bidding event:", error);
+      }
+    };
+
+    socket.onclose = (event) => {
+      if (closed || event.code === 4003 || event.code === 4004) return;
+      if (!everOpened && ++failedConnects >= MAX_FAILED_CONNECTS) {
+        console.warn("Live bidding updates unavailable (is the backend running under ASGI?)");
+        return;
+      }
+      retryTimer = setTimeout(connect, retryDelay);
+      retryDelay = Math.min(retryDelay * 2, 30000);
+    };
+  };
+
+  connect();
+
+  return () => {
+    closed = true;
+    clearTimeout(retryTimer);
+    if (socket) socket.close();
+  };
+}
@@ -4,10 +4,10 @@ from .models import (
     MenuItem, Order, OrderItem,
     FoodRating, DeliveryRating,
     Complaint, Compliment,
-    DeliveryBid, DeliveryAssignment,
-    DiscussionTopic, DiscussionPost,
+    DeliveryBid, DeliveryAssignment, DeliveryBatch, GeocodeCache,
+    DiscussionTopic, DiscussionPost, DiscussionSummary,
     KnowledgeBaseEntry, KnowledgeBaseRating,
-    Transaction, PaymentMethod,
+    Transaction, LedgerEntry, LedgerSnapshot, PaymentMethod,
     RegistrationRequest
 )
 
@@ -53,7 +53,7 @@ class OrderItemAdmin(admin.ModelAdmin):
 
 @admin.register(Complaint)
 class ComplaintAdmin(admin.ModelAdmin):
-    list_display = ['id', 'complainant', 'target_user', 'target_type', 'target_chef', 'target_delivery', 'order', 'status', 'weight', 'processed_by', 'created_at']
+    list_display = ['id', 'complainant', 'target_user', 'target_type', 'target_chef', 'target_delivery', 'order', 'status', 'weight', 'duplicate_of', 'processed_by', 'created_at']
     list_filter = ['status', 'target_type', 'weight']
 
 @admin.register(Compliment)
@@ -72,6 +72,25 @@ class TransactionAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'transaction_type', 'amount', 'order', 'payment_status', 'balance_after', 'timestamp']
     list_filter = ['transaction_type', 'payment_status']
 
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'account', 'customer', 'kind', 'amount', 'transaction', 'order', 'created_at']
+    list_filter = ['account', 'kind']
+
+    # Written only by api/ledger.py, two balanced legs at a time
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(LedgerSnapshot)
+class LedgerSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['id', 'customer', 'balance', 'last_entry_id', 'as_of', 'created_at']
+
 @admin.register(FoodRating)
 class FoodRatingAdmin(admin.ModelAdmin):
     list_display = ['id', 'order_item', 'customer', 'rating', 'created_at']
@@ -88,6 +107,16 @@ class DeliveryBidAdmin(admin.ModelAdmin):
 class DeliveryAssignmentAdmin(admin.ModelAdmin):
     list_display = ['id', 'order', 'delivery_person', 'assigned_by', 'winning_bid', 'assigned_at']
 
+@admin.register(DeliveryBatch)
+class DeliveryBatchAdmin(admin.ModelAdmin):
+    list_display = ['id', 'geohash', 'window_start', 'status', 'created_at']
+    list_filter = ['status']
+
+@admin.register(GeocodeCache)
+class GeocodeCacheAdmin(admin.ModelAdmin):
+    list_display = ['id', 'normalized_address', 'latitude', 'longitude', 'geohash', 'source']
+    list_filter = ['source']
+
 @admin.register(DiscussionTopic)
 class DiscussionTopicAdmin(admin.ModelAdmin):
     list_display = ['id', 'title', 'author', 'topic_type', 'related_chef', 'related_dish', 'related_delivery', 'created_at']
@@ -97,6 +126,10 @@ class DiscussionTopicAdmin(admin.ModelAdmin):
 class DiscussionPostAdmin(admin.ModelAdmin):
     list_display = ['id', 'topic', 'author', 'created_at']
 
+@admin.register(DiscussionSummary)
+class DiscussionSummaryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'topic', 'post_count', 'last_post_id', 'updated_at']
+
 @admin.register(KnowledgeBaseEntry)
 class KnowledgeBaseEntryAdmin(admin.ModelAdmin):
     list_display = ['id', 'author', 'question', 'author_type', 'rating_sum', 'rating_count', 'is_flagged', 'is_removed', 'created_at']
@@ -0,0 +1,84 @@
+"""
+Per-session conversation memory for chat_with_ai.
+
+Each session keeps its last MAX_TURNS messages (user and assistant) as a
+compact list of (role, text) pairs in the Django cache, texts cut to
+MAX_CHARS, so a session never holds more than MAX_TURNS * MAX_CHARS
+characters. The entry is rewritten with a fresh TTL on every exchange; idle
+sessions simply expire.
+
+Before a call the history is trimmed, newest first, to HISTORY_TOKENS
+estimated tokens (prompt_context.estimate_tokens); older turns are dropped.
+
+Sessions are keyed by the client's session_id (scoped to the user when logged
+in) or, for logged-in users who send none, by the user. Visitors without a
+session_id get no memory. Like the other cache-backed state, memory is only
+shared between processes with a shared cache backend.
+"""
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .prompt_context import estimate_tokens
+
+MAX_TURNS = getattr(settings, "CHAT_MEMORY_TURNS", 12)  # messages, not exchanges
+MAX_CHARS = getattr(settings, "CHAT_MEMORY_MAX_CHARS", 1000)  # per message
+HISTORY_TOKENS = getattr(settings, "CHAT_MEMORY_TOKENS", 400)
+TTL = getattr(settings, "CHAT_MEMORY_TTL", 30 * 60)  # seconds idle
+
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+ROLES = {"u": "user", "a": "assistant"}
+
+
+def session_key(user, session_id=None):
+    """Cache key for the conversation, or None when the caller has no session."""
+    if session_id is not None and not SESSION_ID_RE.match(str(session_id)):
+        session_id = None
+    if user is not None:
+        return f"chat_memory:user:{user.id}:{session_id or ''}"
+    if session_id:
+        return f"chat_memory:visitor:{session_id}"
+    return None
+
+
+def get_turns(key):
+    return cache.get(key, []) if key else []
+
+
+def append(key, user_message, answer):
+    """Record one exchange, keeping only the last MAX_TURNS messages."""
+    if not key:
+        return
+    turns = get_turns(key)
+    turns.extend([("u", user_message[:MAX_CHARS]), ("a", answer[:MAX_CHARS])])
+    cache.set(key, turns[-MAX_TURNS:], timeout=TTL)
+
+
+def clear(key):
+    if key:
+        cache.delete(key)
+
+
+def history_messages(key, budget=HISTORY_TOKENS):
+    """Chat messages for the most recent turns that fit the token budget, oldest first."""
+    messages, used = [], 0
+    for role, text in reversed(get_turns(key)):
+        cost = estimate_tokens(text) + 4  # Per-message overhead
+        if used + cost > budget:
+            break
+        messages.append({"role": ROLES[role], "content": text})
+        used += cost
+    messages.reverse()
+    # Never start on an assistant reply whose question was trimmed away
+    if messages and messages[0]["role"] == "assistant":
+        messages.pop(0)
+    return messages
+
+
+def last_user_message(key):
+    for role, text in reversed(get_turns(key)):
+        if role == "u":
+            return text
+    return None
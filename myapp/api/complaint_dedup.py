@@ -0,0 +1,139 @@
+"""
+Near-duplicate complaint detection (MinHash + LSH).
+
+Each complaint description is reduced to a MinHash signature. The signature is
+split into bands and every band is hashed into a bucket key stored in
+ComplaintBucket, indexed on (target_user, bucket). Finding candidates for a new
+complaint is then an indexed lookup on its own bucket keys instead of a scan
+over every complaint ever filed against that user.
+"""
+import hashlib
+import re
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Complaint, ComplaintSignature, ComplaintBucket
+
+NUM_PERM = 64        # signature length
+BANDS = 16           # BANDS * ROWS must equal NUM_PERM
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 4     # character shingles
+
+# Estimated Jaccard similarity required to treat two complaints as duplicates
+SIMILARITY_THRESHOLD = getattr(settings, "COMPLAINT_DUPLICATE_THRESHOLD", 0.6)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _make_permutations():
+    """Fixed (a, b) pairs so signatures are stable across processes."""
+    perms = []
+    for i in range(NUM_PERM):
+        digest = hashlib.sha1(f"minhash-{i}".encode()).digest()
+        a = int.from_bytes(digest[:8], "big") % _MERSENNE_PRIME or 1
+        b = int.from_bytes(digest[8:16], "big") % _MERSENNE_PRIME
+        perms.append((a, b))
+    return perms
+
+
+_PERMUTATIONS = _make_permutations()
+
+
+def normalize_text(text):
+    """Lowercase, drop punctuation and collapse whitespace."""
+    text = re.sub(r"[^a-z0-9\s]", " ", (text or "").lower())
+    return " ".join(text.split())
+
+
+def shingles(text):
+    text = normalize_text(text)
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signature(text):
+    """Return the MinHash signature (list of NUM_PERM ints) for a text."""
+    hashed = [zlib.crc32(s.encode()) for s in shingles(text)]
+    if not hashed:
+        return [_MAX_HASH] * NUM_PERM
+    return [
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashed)
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def band_keys(signature):
+    """Hash each band of the signature into a bucket key."""
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.md5(",".join(map(str, rows)).encode()).hexdigest()[:16]
+        keys.append(f"{band}:{digest}")
+    return keys
+
+
+def estimated_similarity(sig_a, sig_b):
+    """Fraction of matching signature positions (estimates Jaccard similarity)."""
+    matches = sum(1 for x, y in zip(sig_a, sig_b) if x == y)
+    return matches / NUM_PERM
+
+
+def find_duplicate(target_user_id, signature, exclude_complaint_id=None):
+    """
+    Look up the closest earlier complaint against the same user.
+    Returns (complaint_id, similarity) or (None, 0.0).
+    """
+    keys = band_keys(signature)
+    candidates = ComplaintSignature.objects.filter(
+        target_user_id=target_user_id,
+        buckets__target_user_id=target_user_id,
+        buckets__bucket__in=keys,
+    ).distinct()
+    if exclude_complaint_id:
+        candidates = candidates.exclude(complaint_id=exclude_complaint_id)
+
+    # Highest similarity wins; ties go to the oldest complaint
+    best_id, best_score = None, 0.0
+    for candidate in candidates.only("complaint_id", "minhash").order_by("complaint_id"):
+        score = estimated_similarity(signature, candidate.minhash)
+        if score > best_score:
+            best_id, best_score = candidate.complaint_id, score
+
+    if best_score >= SIMILARITY_THRESHOLD:
+        return best_id, best_score
+    return None, 0.0
+
+
+def index_complaint(complaint):
+    """
+    Add a complaint to the LSH index and link it to its cluster.
+    The cluster root is the earliest complaint of the group; every duplicate
+    points straight at the root through Complaint.duplicate_of.
+    Returns the root complaint id, or None if the complaint starts a new cluster.
+    """
+    signature = minhash_signature(complaint.description)
+
+    with transaction.atomic():
+        match_id, _ = find_duplicate(complaint.target_user_id, signature, exclude_complaint_id=complaint.id)
+        root_id = None
+        if match_id:
+            match = Complaint.objects.only("id", "duplicate_of_id").get(id=match_id)
+            root_id = match.duplicate_of_id or match.id
+            complaint.duplicate_of_id = root_id
+            complaint.save(update_fields=["duplicate_of"])
+
+        sig = ComplaintSignature.objects.create(
+            complaint=complaint,
+            target_user_id=complaint.target_user_id,
+            minhash=signature,
+        )
+        ComplaintBucket.objects.bulk_create([
+            ComplaintBucket(signature=sig, target_user_id=complaint.target_user_id, bucket=key)
+            for key in band_keys(signature)
+        ])
+
+    return root_id
@@ -0,0 +1,52 @@
+"""
+Version counters for content the chat assistant depends on.
+
+"kb", "menu" and "chef" are bumped (from the model signals in models.py)
+whenever something that ends up in the LLM prompt changes. Caches built from
+that content store the versions they were built with and treat any
+difference as stale. Counters live in the Django cache so every process sees
+the same values when a shared cache backend is configured.
+"""
+from django.core.cache import cache
+
+KB = "kb"
+MENU = "menu"
+CHEF = "chef"
+NAMES = (KB, MENU, CHEF)
+
+# Fields of each model that feed the prompt; saves touching only other fields
+# (order counters, ratings) do not bump the version
+PROMPT_FIELDS = {
+    KB: ("question", "answer", "author_type", "is_removed"),
+    MENU: ("name", "description", "price", "is_vip_exclusive", "chef_id"),
+    CHEF: ("average_rating",),
+}
+
+
+def _key(name):
+    return f"content_version:{name}"
+
+
+def get_versions(names=NAMES):
+    """{name: version} for the given counters."""
+    values = cache.get_many([_key(name) for name in names])
+    return {name: values.get(_key(name), 0) for name in names}
+
+
+def bump(name):
+    try:
+        return cache.incr(_key(name))
+    except ValueError:
+        cache.add(_key(name), 0, timeout=None)
+        return cache.incr(_key(name))
+
+
+def snapshot(name, instance):
+    """Remember the prompt fields as loaded, so a later save can tell if they changed."""
+    # Read __dict__ directly: touching a deferred field would load it (and recurse through post_init)
+    instance._prompt_snapshot = {f: instance.__dict__[f] for f in PROMPT_FIELDS[name] if f in instance.__dict__}
+
+
+def changed(name, instance):
+    loaded = getattr(instance, "_prompt_snapshot", {})
+    return any(instance.__dict__.get(f) != value for f, value in loaded.items())
@@ -0,0 +1,56 @@
+"""
+Keyset ("cursor") paging over a timestamp column plus id.
+
+A page is fetched with WHERE (ts, id) < (cursor ts, cursor id) ORDER BY ts
+DESC, id DESC LIMIT n (or the mirror image ascending), so each page costs one
+index range scan however deep it is, and rows inserted meanwhile never shift
+later pages the way OFFSET does. Cursors are opaque url-safe strings.
+"""
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, pk):
+    raw = json.dumps([timestamp.isoformat(), pk], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(timestamp, pk) from a cursor made by encode_cursor. Raises InvalidCursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        iso, pk = json.loads(raw)
+        timestamp = parse_datetime(iso)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if timestamp is None or not isinstance(pk, int):
+        raise InvalidCursor("Invalid cursor")
+    return timestamp, pk
+
+
+def keyset_page(queryset, field, cursor=None, limit=20, descending=True):
+    """
+    One page of `queryset` ordered by (field, id), starting after `cursor`.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    direction = "lt" if descending else "gt"
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(**{f"{field}__{direction}": timestamp}) | Q(**{field: timestamp, f"id__{direction}": pk})
+        )
+    order = [f"-{field}", "-id"] if descending else [field, "id"]
+    rows = list(queryset.order_by(*order)[:limit + 1])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], field), rows[-1].id)
+    return rows, next_cursor
@@ -0,0 +1,290 @@
+"""
+Automatic delivery assignment over pending bids.
+
+A sweep loads every unassigned pending order with its bids, scores each bid on
+price, driver rating and the driver's current active load, and solves the whole
+batch at once with a greedy matching (cheapest edge first, re-scoring a
+driver's remaining bids as their load grows). The result is written with one
+bulk insert of DeliveryAssignment rows and one bulk update of Order rows.
+
+The solver (solve_assignment) works on plain tuples so it can be simulated and
+benchmarked without a database (see simulate_delivery_assignment).
+"""
+import heapq
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import DeliveryAssignment, DeliveryBid, DeliveryPerson, Order
+from .realtime import broadcast
+
+# Lower cost is better. Price is the premium over the order's lowest bid,
+# rating and load are scaled to 0..1.
+DEFAULT_WEIGHTS = {"price": 0.6, "rating": 0.3, "load": 0.1}
+WEIGHTS = getattr(settings, "DELIVERY_ASSIGNMENT_WEIGHTS", DEFAULT_WEIGHTS)
+
+# A driver never gets more than this many active (preparing/ready/delivering) orders
+MAX_ACTIVE_LOAD = getattr(settings, "DELIVERY_MAX_ACTIVE_LOAD", 3)
+
+ACTIVE_STATUSES = ["preparing", "ready", "delivering"]
+
+BidCandidate = namedtuple("BidCandidate", ["bid_id", "order_id", "delivery_person_id", "amount", "rating"])
+Decision = namedtuple("Decision", ["bid", "cost", "lowest_bid", "load", "lowest_bidder_full"])
+
+
+def bid_cost(bid, lowest_amount, load, weights=WEIGHTS, max_load=MAX_ACTIVE_LOAD):
+    """Weighted cost of a bid given the order's lowest bid and the driver's load."""
+    lowest = float(lowest_amount) or 1.0
+    price_premium = (float(bid.amount) - float(lowest_amount)) / lowest
+    rating_penalty = (5.0 - min(max(bid.rating or 0.0, 0.0), 5.0)) / 5.0
+    load_penalty = load / max_load if max_load else 0.0
+    return (
+        weights["price"] * price_premium
+        + weights["rating"] * rating_penalty
+        + weights["load"] * load_penalty
+    )
+
+
+def solve_assignment(candidates, driver_loads, weights=WEIGHTS, max_load=MAX_ACTIVE_LOAD):
+    """
+    Match orders to bids as a batch.
+
+    candidates: iterable of BidCandidate
+    driver_loads: {delivery_person_id: number of active orders}
+    Returns a list of Decision, at most one per order.
+    """
+    lowest = {}
+    for bid in candidates:
+        current = lowest.get(bid.order_id)
+        if current is None or (bid.amount, bid.bid_id) < (current.amount, current.bid_id):
+            lowest[bid.order_id] = bid
+
+    loads = dict(driver_loads)
+
+    # Heap of (cost, bid_id, load the cost was computed with, bid)
+    heap = []
+    for bid in candidates:
+        load = loads.get(bid.delivery_person_id, 0)
+        if load >= max_load:
+            continue
+        cost = bid_cost(bid, lowest[bid.order_id].amount, load, weights, max_load)
+        heap.append((cost, bid.bid_id, load, bid))
+    heapq.heapify(heap)
+
+    assigned_orders = set()
+    decisions = []
+    while heap:
+        cost, bid_id, load_at_scoring, bid = heapq.heappop(heap)
+        if bid.order_id in assigned_orders:
+            continue
+        load = loads.get(bid.delivery_person_id, 0)
+        if load >= max_load:
+            continue
+        if load != load_at_scoring:
+            # Driver picked up work since this bid was scored - re-score lazily
+            cost = bid_cost(bid, lowest[bid.order_id].amount, load, weights, max_load)
+            heapq.heappush(heap, (cost, bid_id, load, bid))
+            continue
+
+        lowest_bid = lowest[bid.order_id]
+        lowest_bidder_full = loads.get(lowest_bid.delivery_person_id, 0) >= max_load
+        decisions.append(Decision(bid, cost, lowest_bid, load, lowest_bidder_full))
+        assigned_orders.add(bid.order_id)
+        loads[bid.delivery_person_id] = load + 1
+
+    return decisions
+
+
+def justification_memo(decision, names):
+    """Explain an automatic assignment for the DeliveryAssignment record."""
+    bid, lowest = decision.bid, decision.lowest_bid
+    driver = names.get(bid.delivery_person_id, f"driver #{bid.delivery_person_id}")
+    if bid.bid_id == lowest.bid_id:
+        return (
+            f"Auto-assigned to lowest bidder {driver} (${bid.amount}, rating {bid.rating:.1f}, "
+            f"{decision.load} active deliveries)."
+        )
+    lowest_driver = names.get(lowest.delivery_person_id, f"driver #{lowest.delivery_person_id}")
+    if decision.lowest_bidder_full:
+        reason = f"{lowest_driver} already had the maximum of {MAX_ACTIVE_LOAD} active deliveries"
+    else:
+        reason = "better combined price/rating/load score"
+    return (
+        f"Auto-assigned to {driver} (${bid.amount}, rating {bid.rating:.1f}, {decision.load} active deliveries) "
+        f"instead of lowest bidder {lowest_driver} (${lowest.amount}, rating {lowest.rating:.1f}): {reason}."
+    )
+
+
+def load_candidates():
+    """Bids on every unassigned pending order, plus current driver loads and names."""
+    drivers = {
+        dp["id"]: dp
+        for dp in DeliveryPerson.objects.values("id", "average_rating", "user_profile__user__username")
+    }
+    bids = DeliveryBid.objects.filter(
+        order__status="pending",
+        order__delivery_person__isnull=True,
+        order__assignment__isnull=True,
+    ).values_list("id", "order_id", "delivery_person_id", "bid_amount")
+
+    candidates = [
+        BidCandidate(bid_id, order_id, dp_id, amount, drivers[dp_id]["average_rating"])
+        for bid_id, order_id, dp_id, amount in bids
+        if dp_id in drivers
+    ]
+    loads = dict(
+        Order.objects.filter(delivery_person__isnull=False, status__in=ACTIVE_STATUSES)
+        .values_list("delivery_person")
+        .annotate(n=Count("id"))
+    )
+    names = {dp_id: dp["user_profile__user__username"] for dp_id, dp in drivers.items()}
+    return candidates, loads, names
+
+
+def _open_orders_for_update():
+    """Unassigned pending orders, row-locked (only the order rows)."""
+    return Order.objects.select_for_update(of=("self",)).filter(
+        status="pending",
+        delivery_person__isnull=True,
+        assignment__isnull=True,
+    )
+
+
+def apply_assignments(orders, choices, assigned_by=None):
+    """
+    Bulk-write assignments for locked orders.
+    choices: {order_id: (bid, justification_memo)} where bid has
+    bid_id, delivery_person_id and amount.
+    """
+    now = timezone.now()
+    assignments = []
+    for order in orders:
+        bid, memo = choices[order.id]
+        order.delivery_person_id = bid.delivery_person_id
+        order.delivery_bid_price = Decimal(str(bid.amount))
+        order.status = "preparing"
+        order.updated_at = now  # bulk_update skips auto_now
+        assignments.append(DeliveryAssignment(
+            order_id=order.id,
+            delivery_person_id=bid.delivery_person_id,
+            assigned_by=assigned_by,
+            winning_bid_id=bid.bid_id,
+            justification_memo=memo,
+        ))
+
+    DeliveryAssignment.objects.bulk_create(assignments, batch_size=1000)
+    Order.objects.bulk_update(orders, ["delivery_person", "delivery_bid_price", "status", "updated_at"], batch_size=1000)
+
+    if orders:
+        broadcast("order.assigned", {"assignments": [
+            {"order_id": order.id, "delivery_person_id": order.delivery_person_id} for order in orders
+        ]})
+
+
+def run_assignment_sweep(assigned_by=None, dry_run=False):
+    """
+    Assign every pending order that has bids in one batch.
+    Returns a summary dict with the assignments made (or proposed when dry_run).
+    """
+    candidates, loads, names = load_candidates()
+    decisions = solve_assignment(candidates, loads)
+
+    proposals = [
+        {
+            "order_id": d.bid.order_id,
+            "bid_id": d.bid.bid_id,
+            "delivery_person_id": d.bid.delivery_person_id,
+            "delivery_person": names.get(d.bid.delivery_person_id),
+            "bid_amount": str(d.bid.amount),
+            "lowest_bid": d.bid.bid_id == d.lowest_bid.bid_id,
+            "score": round(d.cost, 4),
+        }
+        for d in decisions
+    ]
+    if dry_run or not decisions:
+        return {"assigned": 0, "orders_considered": len({c.order_id for c in candidates}), "assignments": proposals}
+
+    by_order = {d.bid.order_id: d for d in decisions}
+    with transaction.atomic():
+        # Re-check under lock: a manager may have assigned some orders by hand meanwhile
+        orders = list(_open_orders_for_update().filter(id__in=by_order.keys()))
+        apply_assignments(orders, {
+            order.id: (by_order[order.id].bid, justification_memo(by_order[order.id], names))
+            for order in orders
+        }, assigned_by)
+
+    assigned_ids = {order.id for order in orders}
+    return {
+        "assigned": len(orders),
+        "orders_considered": len({c.order_id for c in candidates}),
+        "assignments": [p for p in proposals if p["order_id"] in assigned_ids],
+    }
+
+
+# ============================================
+# BID WINDOWS
+# ============================================
+
+BID_WINDOW_MINUTES = getattr(settings, "BID_WINDOW_MINUTES", 15)
+BID_WINDOW_BATCH_SIZE = getattr(settings, "BID_WINDOW_BATCH_SIZE", 200)
+
+
+def lowest_bids(order_ids):
+    """
+    The lowest bid per order - the same rule assign_delivery applies
+    (DeliveryBid is ordered by bid_amount), with ties going to the earliest bid.
+    Returns {order_id: BidCandidate}.
+    """
+    winners = {}
+    bids = DeliveryBid.objects.filter(order_id__in=order_ids).order_by(
+        "order_id", "bid_amount", "id"
+    ).values_list("id", "order_id", "delivery_person_id", "bid_amount", "delivery_person__average_rating")
+    for bid_id, order_id, dp_id, amount, rating in bids:
+        if order_id not in winners:
+            winners[order_id] = BidCandidate(bid_id, order_id, dp_id, amount, rating)
+    return winners
+
+
+def close_expired_bid_windows(window_minutes=BID_WINDOW_MINUTES, batch_size=BID_WINDOW_BATCH_SIZE):
+    """
+    Close bidding on pending orders older than the window and assign each to
+    its lowest bidder. Orders are taken oldest-first in batches (served by the
+    (status, created_at) index); SKIP LOCKED lets several workers run at once.
+    Orders without any bid stay pending for the manager.
+    Returns the number of orders assigned.
+    """
+    from django.db.models import Exists, OuterRef
+
+    cutoff = timezone.now() - timedelta(minutes=window_minutes)
+    memo = f"Bid window closed after {window_minutes} minutes; lowest bid selected automatically."
+    has_bids = Exists(DeliveryBid.objects.filter(order=OuterRef("pk")))
+
+    closed = 0
+    while True:
+        with transaction.atomic():
+            orders = list(
+                Order.objects.select_for_update(of=("self",), skip_locked=True).filter(
+                    has_bids,
+                    status="pending",
+                    created_at__lte=cutoff,
+                    delivery_person__isnull=True,
+                    assignment__isnull=True,
+                ).order_by("created_at")[:batch_size]
+            )
+            if not orders:
+                break
+
+            winners = lowest_bids([order.id for order in orders])
+            orders = [order for order in orders if order.id in winners]
+            apply_assignments(orders, {order.id: (winners[order.id], memo) for order in orders})
+            closed += len(orders)
+
+        if len(orders) < batch_size:
+            break
+
+    return closed
@@ -0,0 +1,139 @@
+"""
+Persisted AI summaries of discussion topics.
+
+Each DiscussionSummary remembers the post count and last post id it was built
+from, so AIDiscussionReview just reads the table. Two things keep it current:
+
+- schedule_refresh(), called when a post is added or deleted (signals in
+  models.py), re-summarizes that topic on a background thread pool
+- refresh_stale_summaries() (run by the refresh_discussion_summaries command)
+  re-summarizes every topic whose posts changed since its summary. Run it once
+  after deploying, and now and then (or with --loop) to retry refreshes that
+  failed or were lost to a restart
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, F, Max, Q
+
+from .llm_gateway import LLMGatewayError, gateway
+from .models import DiscussionPost, DiscussionSummary, DiscussionTopic
+
+# The gateway allows LLM_PER_USER_CONCURRENCY calls per key and every summary
+# shares one key, so more workers than that would only wait in its queue
+WORKERS = getattr(settings, "DISCUSSION_SUMMARY_WORKERS", 2)
+AUTO_REFRESH = getattr(settings, "DISCUSSION_SUMMARY_AUTO_REFRESH", True)
+USER_KEY = "discussion-review"
+
+_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="discussion-summary")
+_queued = set()  # Topic ids waiting for a worker
+_queued_lock = threading.Lock()
+
+PROMPT_NOTE = (
+    "Provide a brief summary of this discussion topic. What are the main points being discussed? "
+    "What is the overall sentiment? Keep it concise (2-3 sentences max)."
+)
+
+
+def build_prompt(topic, comments):
+    comments_text = "\n".join([f"- {c}" for c in comments])
+    dish_info = f"Related Dish: {topic.related_dish.name}\n" if topic.related_dish else ""
+    author = topic.author.username if topic.author else "Unknown"
+    return f"{PROMPT_NOTE}\n\nTopic: {topic.title}\nStarted by: {author}\n{dish_info}\nComments:\n{comments_text}"
+
+
+def stale_topic_ids():
+    """Ids of topics with posts whose summary is missing or built from different posts."""
+    return list(
+        DiscussionTopic.objects.annotate(n_posts=Count('posts'), last_post=Max('posts__id'))
+        .filter(n_posts__gt=0)
+        .filter(
+            Q(summary__isnull=True)
+            | ~Q(summary__post_count=F('n_posts'))
+            | ~Q(summary__last_post_id=F('last_post'))
+        )
+        .order_by('-created_at')
+        .values_list('id', flat=True)
+    )
+
+
+def summarize_topic(topic_id):
+    """Summarize one topic and store it. Returns the DiscussionSummary, or None if it has no posts."""
+    topic = DiscussionTopic.objects.select_related('author', 'related_dish').get(id=topic_id)
+    posts = list(DiscussionPost.objects.filter(topic_id=topic_id).order_by('created_at', 'id').values_list('id', 'content'))
+    if not posts:
+        DiscussionSummary.objects.filter(topic_id=topic_id).delete()
+        return None
+
+    response = gateway.chat([{'role': 'user', 'content': build_prompt(topic, [c for _, c in posts])}], user_key=USER_KEY)
+
+    # Record the posts actually summarized; anything added meanwhile is picked up next run
+    summary, _ = DiscussionSummary.objects.update_or_create(
+        topic_id=topic_id,
+        defaults={
+            "summary": response['message']['content'],
+            "post_count": len(posts),
+            "last_post_id": max(post_id for post_id, _ in posts),
+        },
+    )
+    return summary
+
+
+def _summarize_in_worker(topic_id):
+    try:
+        return summarize_topic(topic_id)
+    finally:
+        connections.close_all()  # This worker thread's own DB connection
+
+
+def _refresh_queued(topic_id):
+    with _queued_lock:
+        _queued.discard(topic_id)  # Posts added from here on queue another refresh
+    try:
+        _summarize_in_worker(topic_id)
+    except (LLMGatewayError, DiscussionTopic.DoesNotExist):
+        pass  # Left stale for the next post or refresh_discussion_summaries run
+
+
+def schedule_refresh(topic_id):
+    """Re-summarize a topic in the background; a topic already waiting is not queued twice."""
+    if not AUTO_REFRESH:
+        return
+    with _queued_lock:
+        if topic_id in _queued:
+            return
+        _queued.add(topic_id)
+    _pool.submit(_refresh_queued, topic_id)
+
+
+def refresh_stale_summaries(workers=WORKERS, limit=None):
+    """Re-summarize stale topics on a pool of `workers` threads. Returns (refreshed, failed)."""
+    # Summaries of topics whose posts were all deleted
+    DiscussionSummary.objects.filter(topic__posts__isnull=True).delete()
+
+    topic_ids = stale_topic_ids()
+    if limit is not None:
+        topic_ids = topic_ids[:limit]
+
+    refreshed, failed = 0, []
+
+    def run(topic_id, call):
+        nonlocal refreshed
+        try:
+            call()
+            refreshed += 1
+        except (LLMGatewayError, DiscussionTopic.DoesNotExist) as e:
+            failed.append((topic_id, str(e)))
+
+    if workers <= 1:
+        for topic_id in topic_ids:
+            run(topic_id, lambda: summarize_topic(topic_id))
+        return refreshed, failed
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_summarize_in_worker, topic_id): topic_id for topic_id in topic_ids}
+        for future in as_completed(futures):
+            run(futures[future], future.result)
+    return refreshed, failed
@@ -0,0 +1,166 @@
+"""
+Local stand-in for an Ollama host, for load tests without a model.
+
+Implements the parts of the Ollama HTTP API the app uses:
+    POST /api/chat      non-streaming JSON, or NDJSON chunks when "stream" is
+                        true (Ollama's default)
+    GET  /api/tags      the served model
+    GET  /api/version
+
+Replies are canned text of `tokens` words. Timing follows a real host: a
+fixed `latency` before the first token (prompt processing), then tokens at
+`tokens_per_second`. `error_rate` makes that share of calls fail with a 500.
+
+Run it with: python manage.py fake_ollama --port 11434
+"""
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILLER = (
+    "Thanks for asking. Our kitchen prepares every dish fresh to order and delivery usually "
+    "takes about thirty minutes depending on the distance and how busy the drivers are. "
+    "VIP customers get a discount on every order and registered customers can track their "
+    "deposit balance from the account page. Let us know if there is anything else we can help with."
+).split()
+
+
+class FakeOllamaConfig:
+    def __init__(self, model="gpt-oss:20b", latency=0.2, tokens_per_second=50.0, tokens=60, jitter=0.1, error_rate=0.0):
+        self.model = model
+        self.latency = latency  # seconds before the first token
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.jitter = jitter  # +/- fraction applied to latency and token rate
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "streamed": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def count(self, **changes):
+        with self.lock:
+            for key, delta in changes.items():
+                self.stats[key] += delta
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+    def reply_tokens(self, messages):
+        question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        words = f"(simulated answer to: {question[:80]})".split() + FILLER * (self.tokens // len(FILLER) + 1)
+        return [word + " " for word in words[:self.tokens]]
+
+    def vary(self, value):
+        return value * random.uniform(1 - self.jitter, 1 + self.jitter) if value else 0
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, as the client pools connections
+    config = None  # Set per server by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # The client gave up waiting (e.g. a gateway timeout)
+
+    def write_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json(200, {"models": [{"name": self.config.model, "model": self.config.model}]})
+        elif self.path == "/api/version":
+            self.send_json(200, {"version": "0.0.0-fake"})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self.send_json(400, {"error": "invalid JSON"})
+        if self.path != "/api/chat":
+            return self.send_json(404, {"error": "not found"})
+
+        config = self.config
+        config.count(requests=1, in_flight=1)
+        try:
+            self.chat(config, body)
+        finally:
+            config.count(in_flight=-1)
+
+    def chat(self, config, body):
+        started = time.monotonic()
+        messages = body.get("messages") or []
+        stream = body.get("stream", True)
+        tokens = config.reply_tokens(messages)
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        token_delay = 1 / config.vary(config.tokens_per_second) if config.tokens_per_second else 0
+
+        time.sleep(config.vary(config.latency))
+        if random.random() < config.error_rate:
+            config.count(errors=1)
+            return self.send_json(500, {"error": "simulated model failure"})
+
+        def final(content):
+            elapsed = int((time.monotonic() - started) * 1e9)
+            return {
+                "model": config.model, "created_at": _now(),
+                "message": {"role": "assistant", "content": content},
+                "done": True, "done_reason": "stop",
+                "total_duration": elapsed, "load_duration": 0,
+                "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(config.latency * 1e9),
+                "eval_count": len(tokens), "eval_duration": max(0, elapsed - int(config.latency * 1e9)),
+            }
+
+        if not stream:
+            time.sleep(token_delay * len(tokens))
+            return self.send_json(200, final("".join(tokens)))
+
+        config.count(streamed=1)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                self.write_chunk({
+                    "model": config.model, "created_at": _now(),
+                    "message": {"role": "assistant", "content": token}, "done": False,
+                })
+                time.sleep(token_delay)
+            self.write_chunk(final(""))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # The client cancelled the stream
+
+
+def make_server(host="127.0.0.1", port=11434, config=None):
+    """A ThreadingHTTPServer serving the fake API (port 0 picks a free port)."""
+    handler = type("Handler", (FakeOllamaHandler,), {"config": config or FakeOllamaConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_background(host="127.0.0.1", port=0, config=None):
+    """Serve on a daemon thread; returns (server, base URL)."""
+    server = make_server(host, port, config)
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
@@ -0,0 +1,192 @@
+"""
+Full-text search over discussion topic titles and post bodies (search_discussions).
+
+Postgres: DiscussionTopic and DiscussionPost carry a search_vector column that
+a tsvector_update_trigger keeps current on every insert and text change, with
+a GIN index on each (migration 0017). Matches use websearch_to_tsquery, are
+ranked with ts_rank and highlighted with ts_headline.
+
+SQLite (development): the same migration creates external-content FTS5 tables,
+api_discussiontopic_fts and api_discussionpost_fts, synced by triggers.
+Matches are ranked with bm25() and highlighted with snippet(). Django rebuilds
+SQLite tables for some schema changes, which drops their triggers; rerun the
+0017 migration (migrate api 0016, then migrate) if that happens.
+
+Either way topic and post hits are merged into one ranked list, title matches
+weighted by TITLE_BOOST, and paged by offset. Highlights are computed only
+for the page returned; matched terms are wrapped in <mark> in otherwise
+HTML-escaped text.
+"""
+import re
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Value
+from django.utils.html import escape
+
+from .models import DiscussionPost, DiscussionTopic
+
+CONFIG = "english"  # Must match the triggers' pg_catalog.english
+TITLE_BOOST = 2.0
+MAX_QUERY_CHARS = 200
+MAX_PAGE = 50  # Offset paging; nobody reads past this
+
+# Query parameter -> DiscussionTopic column
+FILTERS = {
+    "topic_type": "topic_type",
+    "related_chef": "related_chef_id",
+    "related_dish": "related_dish_id",
+    "related_delivery": "related_delivery_id",
+}
+
+# Control characters mark matches in ts_headline/snippet output and become
+# <mark> after escaping; clean_query keeps them out of search text
+START, STOP = "\x02", "\x03"
+_CONTROL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def clean_query(text):
+    return _CONTROL_RE.sub(" ", text or "").strip()[:MAX_QUERY_CHARS]
+
+
+def _mark(text):
+    return escape(text).replace(START, "<mark>").replace(STOP, "</mark>")
+
+
+# ---------- Postgres ----------
+
+def _pg_query(text):
+    return SearchQuery(text, config=CONFIG, search_type="websearch")
+
+
+def _pg_matches(text, filters, offset, count):
+    query = _pg_query(text)
+    topics = DiscussionTopic.objects.filter(search_vector=query, **filters).annotate(
+        kind=Value("topic"), topic_ref=F("id"), rank=SearchRank(F("search_vector"), query) * TITLE_BOOST,
+    ).values_list("id", "kind", "topic_ref", "rank")
+    posts = DiscussionPost.objects.filter(
+        search_vector=query, **{f"topic__{field}": value for field, value in filters.items()}
+    ).annotate(
+        kind=Value("post"), topic_ref=F("topic_id"), rank=SearchRank(F("search_vector"), query),
+    ).values_list("id", "kind", "topic_ref", "rank")
+    return list(topics.union(posts, all=True).order_by("-rank", "-id")[offset:offset + count])
+
+
+def _pg_highlights(text, topic_ids, post_ids):
+    query = _pg_query(text)
+    marks = {"start_sel": START, "stop_sel": STOP}
+    highlights = {}
+    for pk, headline in DiscussionTopic.objects.filter(id__in=topic_ids).annotate(
+        headline=SearchHeadline("title", query, config=CONFIG, highlight_all=True, **marks)
+    ).values_list("id", "headline"):
+        highlights["topic", pk] = headline
+    for pk, headline in DiscussionPost.objects.filter(id__in=post_ids).annotate(
+        headline=SearchHeadline(
+            "content", query, config=CONFIG, max_words=35, min_words=15,
+            max_fragments=2, fragment_delimiter=" … ", **marks,
+        )
+    ).values_list("id", "headline"):
+        highlights["post", pk] = headline
+    return highlights
+
+
+# ---------- SQLite FTS5 ----------
+
+TOPIC_FTS = f"{DiscussionTopic._meta.db_table}_fts"
+POST_FTS = f"{DiscussionPost._meta.db_table}_fts"
+
+
+def _fts_query(text):
+    # Every word must match; quoting keeps FTS5 operators in user input literal
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", text.lower()))
+
+
+def _fts_matches(text, filters, offset, count):
+    match = _fts_query(text)
+    if not match:
+        return []
+    where = "".join(f" AND t.{column} = %s" for column in filters)
+    values = list(filters.values())
+    topic_table, post_table = DiscussionTopic._meta.db_table, DiscussionPost._meta.db_table
+    sql = f"""
+        SELECT t.id, 'topic' AS kind, t.id AS topic_ref, -bm25({TOPIC_FTS}) * %s AS rank
+        FROM {TOPIC_FTS} JOIN {topic_table} t ON t.id = {TOPIC_FTS}.rowid
+        WHERE {TOPIC_FTS} MATCH %s{where}
+        UNION ALL
+        SELECT p.id, 'post', p.topic_id, -bm25({POST_FTS})
+        FROM {POST_FTS} JOIN {post_table} p ON p.id = {POST_FTS}.rowid
+        JOIN {topic_table} t ON t.id = p.topic_id
+        WHERE {POST_FTS} MATCH %s{where}
+        ORDER BY rank DESC, id DESC
+        LIMIT %s OFFSET %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [TITLE_BOOST, match, *values, match, *values, count, offset])
+        return cursor.fetchall()
+
+
+def _fts_highlights(text, topic_ids, post_ids):
+    match = _fts_query(text)
+    highlights = {}
+    with connection.cursor() as cursor:
+        for kind, fts, ids, snippet in (
+            ("topic", TOPIC_FTS, topic_ids, f"highlight({TOPIC_FTS}, 0, %s, %s)"),
+            ("post", POST_FTS, post_ids, f"snippet({POST_FTS}, 0, %s, %s, ' … ', 32)"),
+        ):
+            if not ids:
+                continue
+            cursor.execute(
+                f"SELECT rowid, {snippet} FROM {fts} WHERE {fts} MATCH %s "
+                f"AND rowid IN ({', '.join(['%s'] * len(ids))})",
+                [START, STOP, match, *ids],
+            )
+            for pk, headline in cursor.fetchall():
+                highlights[kind, pk] = headline
+    return highlights
+
+
+# ---------- entry point ----------
+
+def search(text, filters=None, page=1, limit=20):
+    """
+    One page of hits for `text`, best first. `filters` maps FILTERS keys to
+    values. Returns (hits, has_more); each hit is a dict ready for the API.
+    """
+    filters = {FILTERS[name]: value for name, value in (filters or {}).items()}
+    if connection.vendor == "postgresql":
+        matches, highlight = _pg_matches, _pg_highlights
+    else:
+        matches, highlight = _fts_matches, _fts_highlights
+
+    rows = matches(text, filters, (page - 1) * limit, limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    topic_hits = [pk for pk, kind, _, _ in rows if kind == "topic"]
+    post_hits = [pk for pk, kind, _, _ in rows if kind == "post"]
+    highlights = highlight(text, topic_hits, post_hits)
+    topics = DiscussionTopic.objects.select_related("author").only(
+        "id", "title", "topic_type", "created_at", "author__username"
+    ).in_bulk({topic_id for _, _, topic_id, _ in rows})
+    posts = DiscussionPost.objects.select_related("author").only(
+        "id", "topic_id", "created_at", "author__username"
+    ).in_bulk(post_hits)
+
+    hits = []
+    for pk, kind, topic_id, rank in rows:
+        topic = topics.get(topic_id)
+        source = topic if kind == "topic" else posts.get(pk)
+        if topic is None or source is None:  # Deleted between the two queries
+            continue
+        hits.append({
+            "type": kind,
+            "topic_id": topic_id,
+            "post_id": pk if kind == "post" else None,
+            "title": topic.title,
+            "topic_type": topic.topic_type,
+            "author": source.author.username,
+            "highlight": _mark(highlights.get((kind, pk), "")),
+            "rank": round(float(rank), 4),
+            "created_at": source.created_at.strftime("%Y-%m-%d %H:%M"),
+        })
+    return hits, has_more
@@ -0,0 +1,206 @@
+"""
+Offline address normalization, geocoding and multi-drop delivery batching.
+
+Addresses are normalized to a building-level key (abbreviations expanded, unit
+and apartment numbers dropped) and resolved against a local gazetteer CSV
+(settings.GAZETTEER_PATH, columns: address,lat,lng). Street-only rows in the
+gazetteer act as a fallback for house numbers that are not listed. Every
+normalized address is resolved once and kept in the GeocodeCache table.
+
+build_delivery_batches() groups open orders by geohash cell and time window
+into DeliveryBatch runs that drivers can bid on as a unit.
+"""
+import csv
+import re
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DeliveryBatch, GeocodeCache, Order
+
+GAZETTEER_PATH = getattr(settings, "GAZETTEER_PATH", settings.BASE_DIR / "data" / "gazetteer.csv")
+GEOHASH_PRECISION = 9             # stored per address (~5m)
+BATCH_GEOHASH_PRECISION = getattr(settings, "BATCH_GEOHASH_PRECISION", 7)  # ~150m cell
+BATCH_WINDOW_MINUTES = getattr(settings, "BATCH_WINDOW_MINUTES", 10)
+
+BATCHABLE_STATUSES = ["pending", "preparing", "ready"]
+
+ABBREVIATIONS = {
+    "st": "street", "ave": "avenue", "av": "avenue", "rd": "road", "blvd": "boulevard",
+    "dr": "drive", "ln": "lane", "ct": "court", "pl": "place", "pkwy": "parkway",
+    "hwy": "highway", "sq": "square", "ter": "terrace", "e": "east", "w": "west",
+    "n": "north", "s": "south",
+}
+UNIT_PATTERN = re.compile(r"\b(apt|apartment|unit|suite|ste|fl|floor|rm|room)\b\.?\s*\w+|#\s*\w+")
+
+
+def normalize_address(address):
+    """Building-level key: lowercase, units dropped, abbreviations expanded."""
+    text = UNIT_PATTERN.sub(" ", (address or "").lower())
+    text = re.sub(r"[^a-z0-9\s]", " ", text)
+    words = [ABBREVIATIONS.get(w, w) for w in text.split()]
+    # Drop ordinal suffixes so "5th" and "5" match
+    words = [re.sub(r"^(\d+)(st|nd|rd|th)$", r"\1", w) for w in words]
+    return " ".join(words)[:255]
+
+
+def street_key(normalized):
+    """The street part of a normalized address (leading house number removed)."""
+    return re.sub(r"^\d+\w*\s+", "", normalized)
+
+
+@lru_cache(maxsize=1)
+def load_gazetteer():
+    """Read the gazetteer file once per process into {normalized address: (lat, lng)}."""
+    entries = {}
+    try:
+        with open(GAZETTEER_PATH, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    entries[normalize_address(row["address"])] = (float(row["lat"]), float(row["lng"]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def resolve(normalized):
+    """Look a normalized address up in the gazetteer. Returns (lat, lng, source)."""
+    gazetteer = load_gazetteer()
+    if normalized in gazetteer:
+        return (*gazetteer[normalized], "gazetteer")
+    street = street_key(normalized)
+    if street != normalized and street in gazetteer:
+        return (*gazetteer[street], "street")
+    return None, None, "unresolved"
+
+
+def geocode_addresses(addresses):
+    """
+    Geocode many raw addresses with one cache read and one bulk insert.
+    Returns {raw address: GeocodeCache}.
+    """
+    normalized = {address: normalize_address(address) for address in addresses}
+    cached = {g.normalized_address: g for g in GeocodeCache.objects.filter(normalized_address__in=set(normalized.values()))}
+
+    missing = []
+    for key in set(normalized.values()) - set(cached):
+        lat, lng, source = resolve(key)
+        missing.append(GeocodeCache(
+            normalized_address=key,
+            latitude=lat,
+            longitude=lng,
+            geohash=encode_geohash(lat, lng) if lat is not None else "",
+            source=source,
+        ))
+    if missing:
+        GeocodeCache.objects.bulk_create(missing, ignore_conflicts=True)
+        for g in GeocodeCache.objects.filter(normalized_address__in=[m.normalized_address for m in missing]):
+            cached[g.normalized_address] = g
+
+    return {address: cached[key] for address, key in normalized.items()}
+
+
+def geocode(address):
+    return geocode_addresses([address])[address]
+
+
+def _window_start(moment, minutes=BATCH_WINDOW_MINUTES):
+    moment = moment.replace(second=0, microsecond=0)
+    return moment - timedelta(minutes=moment.minute % minutes)
+
+
+def batchable_orders():
+    """Orders still open for bidding, the ones a batch is made of and bid on."""
+    return Order.objects.filter(status__in=BATCHABLE_STATUSES, delivery_person__isnull=True)
+
+
+def close_finished_batches():
+    """Close open batches none of whose orders are open for bidding any more."""
+    return DeliveryBatch.objects.filter(status="open").exclude(
+        orders__in=batchable_orders()
+    ).update(status="closed")
+
+
+def build_delivery_batches(precision=BATCH_GEOHASH_PRECISION, window_minutes=BATCH_WINDOW_MINUTES):
+    """
+    Group open, unassigned orders by geohash cell and creation window into
+    multi-drop DeliveryBatch runs. Single orders are left alone. Orders join an
+    existing open batch for the same cell and window; batches whose orders
+    have all been assigned are closed first so none are joined.
+    Returns the number of orders batched.
+    """
+    close_finished_batches()
+    orders = list(
+        batchable_orders().filter(delivery_batch__isnull=True).select_related("geocode")
+    )
+    if not orders:
+        return 0
+
+    # Resolve addresses that have not been geocoded yet
+    ungeocoded = [o for o in orders if o.geocode_id is None and o.delivery_address]
+    if ungeocoded:
+        locations = geocode_addresses({o.delivery_address for o in ungeocoded})
+        for order in ungeocoded:
+            order.geocode = locations[order.delivery_address]
+        Order.objects.bulk_update(ungeocoded, ["geocode"])
+
+    groups = {}
+    for order in orders:
+        if order.geocode is None or not order.geocode.geohash:
+            continue
+        key = (order.geocode.geohash[:precision], _window_start(order.created_at, window_minutes))
+        groups.setdefault(key, []).append(order)
+
+    existing = {
+        (b.geohash, b.window_start): b
+        for b in DeliveryBatch.objects.filter(
+            status="open",
+            geohash__in={k[0] for k in groups},
+            window_start__in={k[1] for k in groups},
+        )
+    }
+
+    batched = []
+    now = timezone.now()
+    with transaction.atomic():
+        for key, members in groups.items():
+            batch = existing.get(key)
+            if batch is None:
+                if len(members) < 2:
+                    continue
+                batch = DeliveryBatch.objects.create(geohash=key[0], window_start=key[1])
+            for order in members:
+                order.delivery_batch = batch
+                order.updated_at = now  # bulk_update skips auto_now
+                batched.append(order)
+        Order.objects.bulk_update(batched, ["delivery_batch", "updated_at"])
+
+    return len(batched)
@@ -0,0 +1,87 @@
+"""
+KB answer ratings (rate_kb_entry, rate_kb_entries_bulk).
+
+A rating is an INSERT into KnowledgeBaseRating, whose unique (entry, user)
+constraint turns a second rating by the same user into an IntegrityError,
+plus an UPDATE ... SET rating_sum = rating_sum + n on the entry, both in one
+transaction. Nothing is read and written back, so concurrent raters never
+lose each other's updates. A 0 rating flags the entry for manager review.
+The UPDATE skips post_save, so the chat search index (kb_search.py), whose
+ranking includes the average rating, is refreshed explicitly on commit.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import kb_search
+from .llm_cache import answer_cache
+from .models import KnowledgeBaseEntry, KnowledgeBaseRating
+
+MAX_BULK = 50
+
+RATED = "rated"
+DUPLICATE = "duplicate"
+NOT_FOUND = "not_found"
+INVALID = "invalid"
+
+
+def parse_rating(entry_id, rating):
+    """(entry_id, rating) as ints, or None if either is missing or out of range."""
+    try:
+        entry_id, rating = int(entry_id), int(rating)
+    except (TypeError, ValueError):
+        return None
+    if not 0 <= rating <= 5:
+        return None
+    return entry_id, rating
+
+
+def _rate(user, entry_id, rating):
+    """Insert the rating and bump the counters; call inside a transaction."""
+    if not KnowledgeBaseEntry.objects.filter(id=entry_id).exists():
+        return {"entry_id": entry_id, "status": NOT_FOUND}
+    try:
+        with transaction.atomic():  # Savepoint, so a duplicate doesn't break the outer transaction
+            KnowledgeBaseRating.objects.create(entry_id=entry_id, user=user, rating=rating)
+    except IntegrityError:
+        return {"entry_id": entry_id, "status": DUPLICATE}
+
+    changes = {"rating_sum": F("rating_sum") + rating, "rating_count": F("rating_count") + 1}
+    if rating == 0:
+        changes.update(is_flagged=True, flagged_count=F("flagged_count") + 1)
+        transaction.on_commit(lambda: answer_cache.discard(entry_id))
+    KnowledgeBaseEntry.objects.filter(id=entry_id).update(**changes)
+    transaction.on_commit(lambda: _refresh_search_index(entry_id))
+
+    rating_sum, rating_count, is_flagged = KnowledgeBaseEntry.objects.filter(id=entry_id).values_list(
+        "rating_sum", "rating_count", "is_flagged"
+    ).get()
+    return {
+        "entry_id": entry_id,
+        "status": RATED,
+        "new_average": rating_sum / rating_count if rating_count else None,
+        "is_flagged": is_flagged,
+    }
+
+
+def _refresh_search_index(entry_id):
+    entry = KnowledgeBaseEntry.objects.filter(id=entry_id).only(
+        "id", "question", "answer", "author_type", "is_removed", "rating_sum", "rating_count"
+    ).first()
+    if entry is None:
+        kb_search.entry_deleted(entry_id)
+    elif entry.author_type == 'employee':
+        kb_search.entry_changed(entry)
+
+
+@transaction.atomic
+def rate_entry(user, entry_id, rating):
+    return _rate(user, entry_id, rating)
+
+
+@transaction.atomic
+def rate_entries(user, ratings):
+    """
+    Apply several (entry_id, rating) pairs in one transaction, each one
+    independent of the others: returns one result per pair, in order.
+    """
+    return [_rate(user, entry_id, rating) for entry_id, rating in ratings]
@@ -0,0 +1,127 @@
+"""
+Retention for LLM answers stored as KnowledgeBaseEntry rows (is_generated).
+
+chat_with_ai stores every LLM answer so it can be rated; left alone the table
+grows without bound. Curated entries (employee-authored, or written by a
+customer through kb/add/) are never touched here. Retrieval (kb_search.py,
+kb_vectors.py, prompt_context.py) only reads employee entries anyway.
+
+- purge_expired() deletes generated entries older than TTL_DAYS that nobody
+  rated, that average below MIN_RATING stars, or that were flagged or removed,
+  in chunks of CHUNK rows with one short transaction per chunk.
+- merge_duplicates() folds generated entries asking the same question (case
+  and surrounding whitespace ignored) into the best-rated one, moving their
+  ratings over.
+
+Run both periodically: python manage.py kb_retention --loop
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Lower, Trim
+from django.utils import timezone
+
+from .models import KnowledgeBaseEntry, KnowledgeBaseRating
+
+TTL_DAYS = getattr(settings, "KB_GENERATED_TTL_DAYS", 30)
+MIN_RATING = getattr(settings, "KB_RETENTION_MIN_RATING", 3)
+CHUNK = getattr(settings, "KB_RETENTION_CHUNK", 500)
+
+
+def expired_entries(ttl_days=TTL_DAYS, min_rating=MIN_RATING):
+    cutoff = timezone.now() - timedelta(days=ttl_days)
+    return KnowledgeBaseEntry.objects.filter(is_generated=True, created_at__lt=cutoff).filter(
+        Q(rating_count=0)
+        | Q(rating_sum__lt=F('rating_count') * min_rating)
+        | Q(is_flagged=True)
+        | Q(is_removed=True)
+    )
+
+
+def purge_expired(ttl_days=TTL_DAYS, min_rating=MIN_RATING, chunk=CHUNK):
+    """Delete expired generated entries chunk by chunk. Returns the number deleted."""
+    deleted = 0
+    while True:
+        ids = list(expired_entries(ttl_days, min_rating).order_by('id').values_list('id', flat=True)[:chunk])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            KnowledgeBaseEntry.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+def _question_key():
+    return Lower(Trim('question'))
+
+
+def duplicate_questions(limit=CHUNK):
+    """Normalized questions asked by more than one live generated entry."""
+    return list(
+        KnowledgeBaseEntry.objects.filter(is_generated=True, is_removed=False)
+        .annotate(key=_question_key())
+        .values('key')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+        .values_list('key', flat=True)[:limit]
+    )
+
+
+def _rank(entry):
+    # Unflagged first, then best average, then most ratings, then oldest
+    return (entry.is_flagged, -(entry.average_rating or 0), -entry.rating_count, entry.id)
+
+
+@transaction.atomic
+def merge_group(key):
+    """Merge one question's generated entries into its best one. Returns the number removed."""
+    entries = sorted(
+        KnowledgeBaseEntry.objects.select_for_update()
+        .filter(is_generated=True, is_removed=False)
+        .annotate(key=_question_key())
+        .filter(key=key),
+        key=_rank,
+    )
+    if len(entries) < 2:
+        return 0
+    keeper, duplicates = entries[0], entries[1:]
+    duplicate_ids = [e.id for e in duplicates]
+
+    # Move ratings over. A user who rated the keeper keeps that rating, and one
+    # who rated several duplicates keeps their latest; the rest go with the duplicates
+    rated = set(keeper.ratings.values_list('user_id', flat=True))
+    move_ids, rating_sum, zeros = [], 0, 0
+    for rating_id, user_id, rating in KnowledgeBaseRating.objects.filter(
+        entry_id__in=duplicate_ids
+    ).order_by('-created_at', '-id').values_list('id', 'user_id', 'rating'):
+        if user_id in rated:
+            continue
+        rated.add(user_id)
+        move_ids.append(rating_id)
+        rating_sum += rating
+        zeros += rating == 0
+    KnowledgeBaseRating.objects.filter(id__in=move_ids).update(entry=keeper)
+
+    if move_ids:
+        KnowledgeBaseEntry.objects.filter(id=keeper.id).update(
+            rating_sum=F('rating_sum') + rating_sum,
+            rating_count=F('rating_count') + len(move_ids),
+            flagged_count=F('flagged_count') + zeros,
+            **({"is_flagged": True} if zeros else {}),  # As rate_kb_entry does for a 0-star rating
+        )
+    KnowledgeBaseEntry.objects.filter(id__in=duplicate_ids).delete()
+    return len(duplicate_ids)
+
+
+def merge_duplicates(chunk=CHUNK):
+    """Merge every group of duplicate generated entries. Returns the number of entries removed."""
+    removed = 0
+    while True:
+        keys = duplicate_questions(chunk)
+        if not keys:
+            return removed
+        merged = sum(merge_group(key) for key in keys)
+        if not merged:
+            return removed
+        removed += merged
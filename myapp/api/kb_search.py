@@ -0,0 +1,256 @@
+"""
+Knowledge-base retrieval for chat_with_ai (BM25 over an in-memory inverted index).
+
+The index covers employee-authored, non-removed KnowledgeBaseEntry rows. It is
+built once per process on first use and then kept current entry-by-entry from
+the post_save / post_delete signals in models.py, so a search only touches the
+postings of the query terms instead of scanning the table.
+
+Other processes learn about changes through a version counter in the Django
+cache (KB_INDEX_VERSION_KEY) and rebuild when they see one they did not make.
+This needs a shared cache backend; with the default per-process LocMemCache
+each process only sees its own writes until it restarts.
+"""
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import KnowledgeBaseEntry
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Added per average-rating star (same weight the keyword matcher used)
+RATING_BOOST = 0.5
+MAX_RATING = 5
+
+# A message with several keywords may still be answered by an entry matching
+# only one of them if that term alone (plus rating boost) scores this much:
+# a term in roughly one entry in ten, or a well-rated entry
+SINGLE_TERM_MIN_SCORE = getattr(settings, "KB_SINGLE_TERM_MIN_SCORE", 2.5)
+
+KB_INDEX_VERSION_KEY = "kb_search:version"
+
+STOP_WORDS = {
+    'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', 'your',
+    'yours', 'yourself', 'yourselves', 'he', 'him', 'his', 'himself', 'she',
+    'her', 'hers', 'herself', 'it', 'its', 'itself', 'they', 'them', 'their',
+    'theirs', 'themselves', 'what', 'which', 'who', 'whom', 'this', 'that',
+    'these', 'those', 'am', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
+    'have', 'has', 'had', 'having', 'do', 'does', 'did', 'doing', 'a', 'an',
+    'the', 'and', 'but', 'if', 'or', 'because', 'as', 'until', 'while', 'of',
+    'at', 'by', 'for', 'with', 'about', 'against', 'between', 'into', 'through',
+    'during', 'before', 'after', 'above', 'below', 'to', 'from', 'up', 'down',
+    'in', 'out', 'on', 'off', 'over', 'under', 'again', 'further', 'then',
+    'once', 'here', 'there', 'when', 'where', 'why', 'how', 'all', 'each',
+    'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only',
+    'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just',
+    'don', 'should', 'now', 'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren',
+    'couldn', 'didn', 'doesn', 'hadn', 'hasn', 'haven', 'isn', 'ma', 'mightn',
+    'mustn', 'needn', 'shan', 'shouldn', 'wasn', 'weren', 'won', 'wouldn',
+    'could', 'would', 'please', 'tell', 'know', 'want', 'like', 'get', 'make'
+}
+
+
+def tokenize(text):
+    """Lowercase alphabetic words, stop words and words under 3 letters dropped."""
+    return [w for w in re.findall(r'\b[a-zA-Z]+\b', (text or "").lower()) if w not in STOP_WORDS and len(w) > 2]
+
+
+def is_indexed(entry):
+    return entry.author_type == 'employee' and not entry.is_removed
+
+
+class BM25Index:
+    """Inverted index: term -> {entry_id: term frequency}."""
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_terms = {}    # entry_id -> Counter of terms
+        self.doc_lengths = {}  # entry_id -> number of tokens
+        self.ratings = {}      # entry_id -> average rating (entries with ratings only)
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, entry_id, text, average_rating=None):
+        self.remove(entry_id)
+        tokens = tokenize(text)
+        terms = Counter(tokens)
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[entry_id] = tf
+        self.doc_terms[entry_id] = terms
+        self.doc_lengths[entry_id] = len(tokens)
+        self.total_length += len(tokens)
+        if average_rating is not None:
+            self.ratings[entry_id] = average_rating
+
+    def remove(self, entry_id):
+        terms = self.doc_terms.pop(entry_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            docs = self.postings[term]
+            docs.pop(entry_id, None)
+            if not docs:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(entry_id)
+        self.ratings.pop(entry_id, None)
+
+    def search(self, query_terms, k=5, min_matches=1):
+        """
+        Score entries containing at least min_matches distinct query terms.
+        Returns up to k (score, matched_terms, entry_id), best first.
+
+        Terms are visited rarest first and each entry is scored completely the
+        first time it is seen. Once the k-th best score beats the most any
+        not-yet-seen entry could still reach (remaining terms' upper bounds plus
+        the top rating boost), the long postings of common words are skipped.
+        """
+        n = len(self.doc_lengths)
+        if not n:
+            return []
+        avg_length = self.total_length / n or 1.0
+
+        terms = []
+        for term in set(query_terms):
+            docs = self.postings.get(term)
+            if docs:
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                terms.append((idf, docs))
+        terms.sort(key=lambda t: (-t[0], len(t[1])))
+
+        # bounds[i]: best score an entry first seen at terms[i] could still get
+        bounds = [0.0] * (len(terms) + 1)
+        bounds[len(terms)] = MAX_RATING * RATING_BOOST
+        for i in range(len(terms) - 1, -1, -1):
+            bounds[i] = bounds[i + 1] + terms[i][0] * (K1 + 1)
+
+        top = []  # min-heap of (score, -entry_id, matched)
+        seen = set()
+        for i, (_, docs) in enumerate(terms):
+            if len(top) == k and top[0][0] >= bounds[i]:
+                break
+            for entry_id in docs:
+                if entry_id in seen:
+                    continue
+                seen.add(entry_id)
+                norm = K1 * (1 - B + B * self.doc_lengths[entry_id] / avg_length)
+                score, matched = 0.0, 0
+                for idf, other in terms:
+                    tf = other.get(entry_id)
+                    if tf:
+                        score += idf * tf * (K1 + 1) / (tf + norm)
+                        matched += 1
+                if matched < min_matches:
+                    continue
+                score += self.ratings.get(entry_id, 0.0) * RATING_BOOST
+                item = (score, -entry_id, matched)
+                if len(top) < k:
+                    heapq.heappush(top, item)
+                elif item > top[0]:
+                    heapq.heapreplace(top, item)
+
+        return [(score, matched, -neg_id) for score, neg_id, matched in sorted(top, reverse=True)]
+
+
+def entry_text(entry):
+    return f"{entry.question} {entry.answer}"
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def _current_version():
+    return cache.get_or_set(KB_INDEX_VERSION_KEY, 0, timeout=None)
+
+
+def build_index(entries=None):
+    """Build an index from the given entries (default: every indexable entry)."""
+    if entries is None:
+        entries = KnowledgeBaseEntry.objects.filter(author_type='employee', is_removed=False).only(
+            "id", "question", "answer", "rating_sum", "rating_count"
+        ).iterator(chunk_size=2000)
+    index = BM25Index()
+    for entry in entries:
+        index.add(entry.id, entry_text(entry), entry.average_rating)
+    return index
+
+
+def get_index():
+    """This process's index, rebuilt if another process changed the KB."""
+    global _index, _index_version
+    version = _current_version()
+    with _lock:
+        if _index is None or _index_version != version:
+            _index = build_index()
+            _index_version = version
+        return _index
+
+
+def _bump_version():
+    """Publish a change; returns True if no other process changed the KB since our last sync."""
+    global _index_version
+    try:
+        version = cache.incr(KB_INDEX_VERSION_KEY)
+    except ValueError:
+        cache.set(KB_INDEX_VERSION_KEY, 1, timeout=None)
+        version = 1
+    in_sync = _index_version is not None and version == _index_version + 1
+    if in_sync:
+        _index_version = version
+    return in_sync
+
+
+def entry_changed(entry):
+    """Apply one saved entry to the index (called from the post_save signal)."""
+    with _lock:
+        in_sync = _bump_version()
+        if _index is None or not in_sync:
+            return  # Rebuilt on next search
+        if is_indexed(entry):
+            _index.add(entry.id, entry_text(entry), entry.average_rating)
+        else:
+            _index.remove(entry.id)
+
+
+def entry_deleted(entry_id):
+    with _lock:
+        in_sync = _bump_version()
+        if _index is not None and in_sync:
+            _index.remove(entry_id)
+
+
+def find_answer(message, strict=False):
+    """
+    Best employee KB entry for a chat message, or None.
+    Like the old matching rule the entry must contain at least two of the
+    message's keywords (one if the message only has one), or a single keyword
+    scoring at least SINGLE_TERM_MIN_SCORE, the way a single match used to pass
+    on its rating boost. With strict the message needs at least two keywords
+    and the entry must contain all of them.
+    """
+    keywords = tokenize(message)
+    unique = set(keywords)
+    if not keywords or (strict and len(unique) < 2):
+        return None
+
+    index = get_index()
+    if strict:
+        results = index.search(keywords, k=1, min_matches=len(unique))
+    else:
+        results = index.search(keywords, k=1, min_matches=min(len(unique), 2))
+        if not results and len(unique) > 1 and SINGLE_TERM_MIN_SCORE is not None:
+            results = [r for r in index.search(keywords, k=1) if r[0] >= SINGLE_TERM_MIN_SCORE]
+    if not results:
+        return None
+    return KnowledgeBaseEntry.objects.filter(id=results[0][2], is_removed=False).first()
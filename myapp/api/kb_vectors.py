@@ -0,0 +1,305 @@
+"""
+Semantic KB matching without a network: hashed TF-IDF reduced with LSA.
+
+Each employee-authored KnowledgeBaseEntry is embedded locally:
+words and character 4-grams are hashed into HASH_DIM buckets, weighted with
+sublinear TF-IDF and projected onto LSA_DIM components from a truncated SVD of
+the corpus. The unit-length vectors are stored as one contiguous float32
+matrix on disk and memory-mapped for search, which is a batched dot product
+against the query vector.
+
+Files in settings.KB_VECTOR_DIR:
+    model.npz     idf weights and SVD components (written by rebuild)
+    vectors.f32   N x LSA_DIM float32 rows
+    ids.i64       N int64 entry ids, -1 for deleted rows
+
+New entries are appended, edited ones re-embedded in their row and deleted
+ones tombstoned as they happen (see the KnowledgeBaseEntry signals in
+models.py). The SVD basis is refit, and
+tombstones dropped, by a rebuild: python manage.py rebuild_kb_vectors, or
+automatically while the corpus is smaller than LSA_DIM and whenever it has
+doubled since the last fit.
+
+Every web worker writes to the same files, so writes (appends, tombstones,
+rebuilds) hold an exclusive flock on KB_VECTOR_DIR/.lock and reopening the
+files for search holds a shared one: rows and ids are never appended by two
+processes at once, and a rebuild's three renames are never seen half done.
+"""
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+import numpy as np
+from django.conf import settings
+
+from .kb_search import tokenize
+from .models import KnowledgeBaseEntry
+
+HASH_DIM = 2 ** 13
+LSA_DIM = 128
+SEARCH_BATCH = 8192
+REFIT_SLACK = 10
+
+# Cosine similarity a semantic match needs before chat_with_ai uses it
+SIMILARITY_THRESHOLD = getattr(settings, "KB_SEMANTIC_THRESHOLD", 0.12)
+# Stricter threshold for follow-up messages in a conversation
+FOLLOW_UP_THRESHOLD = getattr(settings, "KB_SEMANTIC_FOLLOW_UP_THRESHOLD", 0.35)
+
+
+def vector_dir():
+    # Read on every use so override_settings can point tests at a scratch directory
+    return getattr(settings, "KB_VECTOR_DIR", settings.BASE_DIR / "data" / "kb_vectors")
+
+
+def _path(name):
+    return os.path.join(vector_dir(), name)
+
+
+def _hashed_features(text):
+    """Bucket index per feature: words plus character 4-grams of each word."""
+    features = []
+    for word in tokenize(text):
+        features.append(zlib.crc32(word.encode()) % HASH_DIM)
+        padded = f"<{word}>"
+        features.extend(zlib.crc32(padded[i:i + 4].encode()) % HASH_DIM for i in range(len(padded) - 3))
+    return features
+
+
+def _term_counts(feature_lists):
+    """Dense (len(feature_lists), HASH_DIM) raw feature counts."""
+    counts = np.zeros((len(feature_lists), HASH_DIM), dtype=np.float32)
+    for row, features in enumerate(feature_lists):
+        if len(features):
+            np.add.at(counts[row], features, 1.0)
+    return counts
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class Model:
+    def __init__(self, idf, components, fit_rows=0):
+        self.idf = idf.astype(np.float32)
+        self.components = components.astype(np.float32)  # (dims, HASH_DIM)
+        self.fit_rows = fit_rows  # Corpus size the basis was fitted on
+
+    @property
+    def dims(self):
+        return self.components.shape[0]
+
+    def tfidf(self, texts=None, feature_lists=None):
+        if feature_lists is None:
+            feature_lists = [_hashed_features(text) for text in texts]
+        counts = _term_counts(feature_lists)
+        np.log1p(counts, out=counts)
+        counts *= self.idf
+        return _normalize(counts)
+
+    def project(self, texts):
+        return (self.tfidf(texts) @ self.components.T).astype(np.float32)
+
+    def embed(self, texts):
+        return _normalize(self.project(texts))
+
+
+def fit(texts, dims=LSA_DIM, chunk=2000, seed=0):
+    """Fit idf weights and an LSA basis with a chunked randomized SVD."""
+    features = [np.array(_hashed_features(text), dtype=np.int64) for text in texts]
+
+    df = np.zeros(HASH_DIM, dtype=np.float64)
+    for start in range(0, len(features), chunk):
+        df += (_term_counts(features[start:start + chunk]) > 0).sum(axis=0)
+    idf = np.log((1 + len(texts)) / (1 + df)) + 1.0
+    model = Model(idf, np.zeros((0, HASH_DIM)))
+
+    def blocks():
+        for start in range(0, len(features), chunk):
+            yield start, model.tfidf(feature_lists=features[start:start + chunk])
+
+    dims = max(1, min(dims, len(texts)))
+    rank = min(dims + 10, len(texts))
+
+    # Range finder with one power iteration: Y = X (X^T (X omega))
+    omega = np.random.default_rng(seed).standard_normal((HASH_DIM, rank)).astype(np.float32)
+    y = np.vstack([block @ omega for _, block in blocks()])
+    z = np.zeros((HASH_DIM, rank), dtype=np.float32)
+    for start, block in blocks():
+        z += block.T @ y[start:start + len(block)]
+    z, _ = np.linalg.qr(z)
+    y = np.vstack([block @ z for _, block in blocks()])
+    q, _ = np.linalg.qr(y)
+
+    b = np.zeros((q.shape[1], HASH_DIM), dtype=np.float32)
+    for start, block in blocks():
+        b += q[start:start + len(block)].T @ block
+    _, _, vt = np.linalg.svd(b, full_matrices=False)
+    return Model(idf, vt[:dims])
+
+
+def _indexable_entries():
+    return KnowledgeBaseEntry.objects.filter(author_type='employee', is_removed=False).only(
+        "id", "question", "answer"
+    ).order_by("id")
+
+
+def _text(entry):
+    return f"{entry.question} {entry.answer}"
+
+
+def rebuild(dims=LSA_DIM):
+    """Refit the model on every indexable entry and rewrite the vector files. Returns the row count."""
+    with _locked():
+        return _rebuild(dims)
+
+
+def _rebuild(dims=LSA_DIM):
+    entries = list(_indexable_entries())
+    os.makedirs(vector_dir(), exist_ok=True)
+    texts = [_text(e) for e in entries]
+
+    if texts:
+        model = fit(texts, dims)
+        vectors = np.vstack([model.embed(texts[i:i + 2000]) for i in range(0, len(texts), 2000)])
+    else:
+        model = Model(np.ones(HASH_DIM), np.zeros((1, HASH_DIM)))
+        vectors = np.zeros((0, 1), dtype=np.float32)
+    ids = np.array([e.id for e in entries], dtype=np.int64)
+
+    # Write side files first and swap them in, so readers never see a half-written index
+    tmp = f"{os.getpid()}.tmp"
+    np.savez(_path(f"model.{tmp}.npz"), idf=model.idf, components=model.components, fit_rows=len(ids))
+    vectors.astype(np.float32).tofile(_path(f"vectors.f32.{tmp}"))
+    ids.tofile(_path(f"ids.i64.{tmp}"))
+    os.replace(_path(f"model.{tmp}.npz"), _path("model.npz"))
+    os.replace(_path(f"vectors.f32.{tmp}"), _path("vectors.f32"))
+    os.replace(_path(f"ids.i64.{tmp}"), _path("ids.i64"))
+    _state.clear()
+    return len(ids)
+
+
+_lock = threading.Lock()
+_state = {}
+
+
+@contextmanager
+def _locked(shared=False):
+    """This process's lock plus a lock on the vector files shared with other processes."""
+    with _lock:
+        os.makedirs(vector_dir(), exist_ok=True)
+        with open(_path(".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _signature():
+    try:
+        return tuple((s.st_ino, s.st_size, s.st_mtime_ns) for s in (
+            os.stat(_path("model.npz")), os.stat(_path("ids.i64")), os.stat(_path("vectors.f32"))
+        ))
+    except FileNotFoundError:
+        return None
+
+
+def _load():
+    """Model plus memory-mapped vectors/ids, reopened when the files change on disk."""
+    signature = _signature()
+    if signature is None:
+        _rebuild()
+        signature = _signature()
+    if _state.get("signature") != signature:
+        with np.load(_path("model.npz")) as data:
+            model = Model(data["idf"], data["components"], int(data["fit_rows"]))
+        rows = min(os.path.getsize(_path("ids.i64")) // 8,
+                   os.path.getsize(_path("vectors.f32")) // (4 * model.dims))
+        _state.update(
+            signature=signature,
+            model=model,
+            ids=np.memmap(_path("ids.i64"), dtype=np.int64, mode="r+", shape=(rows,)) if rows else np.zeros(0, np.int64),
+            vectors=np.memmap(_path("vectors.f32"), dtype=np.float32, mode="r+", shape=(rows, model.dims))
+            if rows else np.zeros((0, model.dims), np.float32),
+        )
+    return _state["model"], _state["vectors"], _state["ids"]
+
+
+def add_entry(entry):
+    """Index an entry's current text: re-embed its row if it has one, else append."""
+    with _locked():
+        model, vectors, ids = _load()
+        if len(ids) < LSA_DIM or len(ids) >= 2 * model.fit_rows + REFIT_SLACK:
+            # Small corpus (refitting is cheap and the basis would not cover new
+            # words) or it has doubled since the basis was fitted: refit instead of appending
+            _rebuild()
+            return
+        vector = model.embed([_text(entry)])
+        rows = np.nonzero(ids == entry.id)[0]
+        if len(rows):
+            vectors[rows] = vector
+            vectors.flush()
+            return
+        with open(_path("vectors.f32"), "ab") as f:
+            f.write(vector.tobytes())
+        with open(_path("ids.i64"), "ab") as f:
+            f.write(np.array([entry.id], dtype=np.int64).tobytes())
+
+
+def remove_entry(entry_id):
+    """Tombstone an entry's row in place."""
+    with _locked():
+        _, vectors, ids = _load()
+        rows = np.nonzero(ids == entry_id)[0]
+        if len(rows):
+            ids[rows] = -1
+            vectors[rows] = 0.0
+            ids.flush()
+            vectors.flush()
+
+
+def entry_changed(entry):
+    if entry.author_type == 'employee' and not entry.is_removed:
+        add_entry(entry)
+    else:
+        remove_entry(entry.id)
+
+
+def search(query, k=5):
+    """Top-k (similarity, entry_id) by cosine similarity, best first."""
+    # Reading only needs a shared lock, unless the files are missing and _load builds them
+    with _locked(shared=_signature() is not None):
+        model, vectors, ids = _load()
+    if not len(ids):
+        return []
+    # The query is not renormalized after projection, so words the basis does
+    # not cover lower the similarity instead of being ignored
+    q = model.project([query])[0]
+
+    scores = np.empty(len(ids), dtype=np.float32)
+    for start in range(0, len(ids), SEARCH_BATCH):
+        scores[start:start + SEARCH_BATCH] = vectors[start:start + SEARCH_BATCH] @ q
+    scores[ids < 0] = -np.inf
+
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(float(scores[i]), int(ids[i])) for i in top if np.isfinite(scores[i])]
+
+
+def find_answer(message, threshold=SIMILARITY_THRESHOLD):
+    """Closest employee KB entry to the message if it is similar enough, else None."""
+    for similarity, entry_id in search(message, k=1):
+        if similarity >= threshold:
+            return KnowledgeBaseEntry.objects.filter(id=entry_id, is_removed=False).first()
+    return None
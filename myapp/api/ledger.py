@@ -0,0 +1,203 @@
+"""
+Double-entry ledger behind CustomerProfile.deposit_balance.
+
+Every balance change goes through record(), which in one transaction, with
+the customer row locked by the caller (select_for_update):
+- writes the Transaction row (order payments included),
+- appends two LedgerEntry legs that sum to zero, one on the customer's
+  deposit account and one on the contra account for the kind (KINDS),
+- updates deposit_balance, which stays the cached current balance,
+- and saves a LedgerSnapshot once SNAPSHOT_EVERY customer entries have
+  accumulated since the last one.
+
+Past balances and statements start from the customer's latest snapshot before
+the point asked for and add only the entries after it, so they read at most
+about SNAPSHOT_EVERY rows however long the history. Balances from before the
+ledger were carried over as 'opening' entries by migration 0018.
+python manage.py ledger_audit checks that everything adds up.
+"""
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .cursors import decode_cursor, keyset_page
+from .models import CustomerProfile, LedgerEntry, LedgerSnapshot, Transaction
+
+SNAPSHOT_EVERY = getattr(settings, "LEDGER_SNAPSHOT_EVERY", 50)
+
+CUSTOMER = "customer"
+
+# kind -> (sign of the change to the customer's balance, contra account)
+KINDS = {
+    "deposit": (1, "stripe"),
+    "order_payment": (-1, "sales"),
+    "refund": (1, "sales"),
+    "withdrawal": (-1, "payout"),  # Closing an account pays out what is left
+}
+
+
+def customer_entries(customer):
+    return LedgerEntry.objects.filter(customer=customer, account=CUSTOMER)
+
+
+# ---------- writing ----------
+
+@transaction.atomic
+def record(customer, kind, amount, order=None, **transaction_fields):
+    """
+    Apply `amount` (positive) of `kind` to a customer locked with
+    select_for_update. Updates and saves customer.deposit_balance and returns
+    the Transaction. Raises ValueError if the balance would go negative.
+    """
+    sign, contra = KINDS[kind]
+    change = sign * Decimal(amount)
+    if customer.deposit_balance + change < 0:
+        raise ValueError("Insufficient funds")
+    customer.deposit_balance += change
+    customer.save(update_fields=["deposit_balance"])
+
+    record_row = Transaction.objects.create(
+        user_id=customer.user_profile.user_id,
+        transaction_type=kind,
+        amount=Decimal(amount),
+        order=order,
+        payment_status="succeeded",
+        balance_after=customer.deposit_balance,
+        **transaction_fields,
+    )
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(account=CUSTOMER, customer=customer, kind=kind, amount=change, transaction=record_row, order=order),
+        LedgerEntry(account=contra, kind=kind, amount=-change, transaction=record_row, order=order),
+    ])
+    _maybe_snapshot(customer)
+    return record_row
+
+
+def _latest_snapshot(customer, **filters):
+    return LedgerSnapshot.objects.filter(customer=customer, **filters).order_by("-last_entry_id").first()
+
+
+def _maybe_snapshot(customer):
+    snapshot = _latest_snapshot(customer)
+    tail = customer_entries(customer)
+    if snapshot:
+        tail = tail.filter(id__gt=snapshot.last_entry_id)
+    stats = tail.aggregate(n=Count("id"), total=Sum("amount"), last_id=Max("id"), last_at=Max("created_at"))
+    if stats["n"] < SNAPSHOT_EVERY:
+        return None
+    return LedgerSnapshot.objects.create(
+        customer=customer,
+        balance=(snapshot.balance if snapshot else 0) + stats["total"],
+        last_entry_id=stats["last_id"],
+        as_of=stats["last_at"],  # Entries are appended under the customer lock, so ids and times agree
+    )
+
+
+def refund_order(order, amount=None):
+    """Credit back `amount` (default: all not yet refunded) of what the order cost."""
+    with transaction.atomic():
+        customer = CustomerProfile.objects.select_for_update().select_related("user_profile").get(id=order.customer_id)
+        refunded = Transaction.objects.filter(order=order, transaction_type="refund").aggregate(
+            total=Sum("amount")
+        )["total"] or Decimal("0")
+        amount = order.total_price - refunded if amount is None else Decimal(amount)
+        if amount <= 0 or refunded + amount > order.total_price:
+            raise ValueError("Refund exceeds what is left to refund on this order")
+        return record(customer, "refund", amount, order=order)
+
+
+# ---------- reading ----------
+
+def _balance(customer, snapshot_filter, entry_filter):
+    snapshot = _latest_snapshot(customer, **snapshot_filter)
+    entries = customer_entries(customer).filter(**entry_filter)
+    base = Decimal("0")
+    if snapshot:
+        entries, base = entries.filter(id__gt=snapshot.last_entry_id), snapshot.balance
+    return base + (entries.aggregate(total=Sum("amount"))["total"] or 0)
+
+
+def balance_as_of(customer, at=None):
+    """Balance from the entries created before `at` (all of them if None)."""
+    if at is None:
+        return _balance(customer, {}, {})
+    return _balance(customer, {"as_of__lt": at}, {"created_at__lt": at})
+
+
+def balance_through(customer, entry_id):
+    """Balance right after entry `entry_id`."""
+    return _balance(customer, {"last_entry_id__lte": entry_id}, {"id__lte": entry_id})
+
+
+def statement(customer, since, until, cursor=None, limit=100):
+    """
+    Customer entries created in [since, until), oldest first, one page at a
+    time, each with the running balance after it. Raises InvalidCursor.
+    """
+    entries = customer_entries(customer).filter(created_at__gte=since, created_at__lt=until).only(
+        "id", "kind", "amount", "order_id", "transaction_id", "created_at"
+    )
+    rows, next_cursor = keyset_page(entries, "created_at", cursor, limit, descending=False)
+    opening = balance_through(customer, decode_cursor(cursor)[1]) if cursor else balance_as_of(customer, since)
+
+    balance, lines = opening, []
+    for entry in rows:
+        balance += entry.amount
+        lines.append({"entry": entry, "balance": balance})
+    return {"opening_balance": opening, "closing_balance": balance, "lines": lines, "next_cursor": next_cursor}
+
+
+def parse_when(value):
+    """Aware datetime from an ISO datetime or date (midnight), or None if unparseable."""
+    try:
+        when = parse_datetime(value)
+        if when is None:
+            day = parse_date(value)
+            when = datetime.combine(day, time.min) if day else None
+    except ValueError:
+        return None
+    if when is not None and timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+
+# ---------- auditing ----------
+
+@transaction.atomic
+def rebuild_balance(customer_id):
+    """Reset a customer's deposit_balance from their ledger entries."""
+    customer = CustomerProfile.objects.select_for_update().get(id=customer_id)
+    customer.deposit_balance = customer_entries(customer).aggregate(total=Sum("amount"))["total"] or Decimal("0")
+    customer.save(update_fields=["deposit_balance"])
+    return customer.deposit_balance
+
+
+def audit(fix=False):
+    """
+    Problems found, as strings: postings whose legs don't sum to zero, and
+    customers whose deposit_balance or snapshots disagree with their entries.
+    With fix, deposit_balance is reset from the ledger and bad snapshots deleted.
+    """
+    problems = [
+        f"Transaction {row['transaction_id']}: legs sum to {row['total']}"
+        for row in LedgerEntry.objects.values("transaction_id").annotate(total=Sum("amount")).exclude(total=0)
+    ]
+    customers = CustomerProfile.objects.annotate(
+        ledger=Sum("ledger_entries__amount", filter=Q(ledger_entries__account=CUSTOMER))
+    )
+    for customer in customers.iterator():
+        ledger = customer.ledger or Decimal("0")
+        if ledger != customer.deposit_balance:
+            problems.append(f"Customer {customer.id}: deposit_balance {customer.deposit_balance}, ledger {ledger}")
+            if fix:
+                rebuild_balance(customer.id)
+        elif balance_as_of(customer) != ledger:
+            problems.append(f"Customer {customer.id}: snapshots disagree with the ledger")
+            if fix:
+                LedgerSnapshot.objects.filter(customer=customer).delete()
+    return problems
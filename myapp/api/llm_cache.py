@@ -0,0 +1,147 @@
+"""
+Answer cache in front of the LLM for chat_with_ai.
+
+Answers are kept per process in an LRU keyed on the normalized question,
+with a TTL. A question that is not an exact repeat can still hit when its
+keyword set is close enough to a cached one (Jaccard similarity >=
+settings.LLM_CACHE_SIMILARITY; set it to None for exact matches only).
+Negations are kept as a keyword and must agree, so "is the kabsa spicy" never
+answers "is the kabsa not spicy".
+
+The cache remembers the KB/menu/chef content versions (content_versions.py)
+it was filled under and empties itself when any of them changes, so answers
+never outlive the information they were generated from.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from .content_versions import get_versions
+from .kb_search import tokenize
+
+CACHE_SIZE = getattr(settings, "LLM_CACHE_SIZE", 1000)
+CACHE_TTL = getattr(settings, "LLM_CACHE_TTL", 3600)  # seconds
+SIMILARITY = getattr(settings, "LLM_CACHE_SIMILARITY", 0.8)
+
+CachedAnswer = namedtuple("CachedAnswer", ["answer", "entry_id", "keywords", "stored_at"])
+
+
+def normalize_question(text):
+    """Lowercase, punctuation dropped, whitespace collapsed."""
+    return " ".join(re.sub(r"[^a-z0-9\s]", " ", (text or "").lower()).split())
+
+
+NEGATION = "not"
+_NEGATION_RE = re.compile(r"\b(?:no|not|nor|never|none|without|\w+n't)\b")
+
+
+def question_keywords(text):
+    """kb_search keywords plus NEGATION if the question negates anything (stop words drop it)."""
+    keywords = set(tokenize(text))
+    if _NEGATION_RE.search((text or "").lower().replace("\u2019", "'")):
+        keywords.add(NEGATION)
+    return frozenset(keywords)
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class AnswerCache:
+    def __init__(self, capacity=CACHE_SIZE, ttl=CACHE_TTL, similarity=SIMILARITY):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        self._versions = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0, "similar_hits": 0, "misses": 0,
+            "evictions": 0, "expirations": 0, "invalidations": 0,
+        }
+
+    def _check_versions(self):
+        versions = get_versions()
+        if versions != self._versions:
+            self.stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._versions = versions
+
+    def _live(self, key, now):
+        cached = self._entries.get(key)
+        if cached is None:
+            return None
+        if now - cached.stored_at > self.ttl:
+            del self._entries[key]
+            self.stats["expirations"] += 1
+            return None
+        return cached
+
+    def get(self, question):
+        """Cached answer for the question (exact or similar), or None."""
+        key = normalize_question(question)
+        now = time.monotonic()
+        with self._lock:
+            self._check_versions()
+
+            cached = self._live(key, now)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return cached
+
+            if self.similarity is not None:
+                keywords = question_keywords(question)
+                negated = NEGATION in keywords
+                best_key, best_score = None, 0.0
+                for other_key, other in self._entries.items():
+                    if (NEGATION in other.keywords) != negated:
+                        continue
+                    score = jaccard(keywords, other.keywords)
+                    if score > best_score:
+                        best_key, best_score = other_key, score
+                if best_key is not None and best_score >= self.similarity:
+                    cached = self._live(best_key, now)
+                    if cached is not None:
+                        self._entries.move_to_end(best_key)
+                        self.stats["similar_hits"] += 1
+                        return cached
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, question, answer, entry_id):
+        key = normalize_question(question)
+        with self._lock:
+            self._check_versions()
+            self._entries[key] = CachedAnswer(answer, entry_id, question_keywords(question), time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def discard(self, entry_id):
+        """Drop answers backed by a KB entry (e.g. it was flagged or removed)."""
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v.entry_id == entry_id]:
+                del self._entries[key]
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["similar_hits"] + self.stats["misses"]
+            hits = self.stats["hits"] + self.stats["similar_hits"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "ttl_seconds": self.ttl,
+                "hit_rate": round(hits / lookups, 4) if lookups else None,
+            }
+
+
+answer_cache = AnswerCache()
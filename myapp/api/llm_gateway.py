@@ -0,0 +1,334 @@
+"""
+Shared gateway for every LLM call (chat_with_ai, chat_with_ai_stream, discussion summaries).
+
+All calls run on one background event loop thread over a single pooled
+ollama.AsyncClient (httpx connection pool), so sync views only block on a
+future and never open their own connections. On top of that the gateway adds:
+
+- a global concurrency limit (LLM_MAX_CONCURRENCY) and a per-user one
+  (LLM_PER_USER_CONCURRENCY)
+- a bounded wait queue (LLM_MAX_QUEUE); when it is full, or a call waits longer
+  than LLM_QUEUE_TIMEOUT, the call is shed with GatewayBusy (HTTP 429)
+- a per-call timeout (LLM_TIMEOUT, GatewayTimeout / 504)
+- a circuit breaker: after LLM_BREAKER_FAILURES consecutive failures calls fail
+  fast with CircuitOpen (503) for LLM_BREAKER_COOLDOWN seconds, then one trial
+  call decides whether it closes again
+- latency and token metrics (metrics())
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+import httpx
+from django.conf import settings
+from ollama import AsyncClient
+
+MODEL = getattr(settings, "LLM_MODEL", "gpt-oss:20b")
+MAX_CONCURRENCY = getattr(settings, "LLM_MAX_CONCURRENCY", 8)
+PER_USER_CONCURRENCY = getattr(settings, "LLM_PER_USER_CONCURRENCY", 2)
+MAX_QUEUE = getattr(settings, "LLM_MAX_QUEUE", 32)
+QUEUE_TIMEOUT = getattr(settings, "LLM_QUEUE_TIMEOUT", 10)  # seconds
+TIMEOUT = getattr(settings, "LLM_TIMEOUT", 120)  # seconds per call
+BREAKER_FAILURES = getattr(settings, "LLM_BREAKER_FAILURES", 5)
+BREAKER_COOLDOWN = getattr(settings, "LLM_BREAKER_COOLDOWN", 30)  # seconds
+KEEP_ALIVE = getattr(settings, "OLLAMA_KEEP_ALIVE", "30m")
+# Reverse proxies in front of Django that append to X-Forwarded-For
+TRUSTED_PROXY_COUNT = getattr(settings, "LLM_TRUSTED_PROXY_COUNT", 0)
+
+
+class LLMGatewayError(Exception):
+    status = 503
+
+
+class GatewayBusy(LLMGatewayError):
+    status = 429
+
+
+class GatewayTimeout(LLMGatewayError):
+    status = 504
+
+
+class CircuitOpen(LLMGatewayError):
+    status = 503
+
+
+class LLMCallFailed(LLMGatewayError):
+    status = 503
+
+
+_DONE = object()
+
+
+class LLMGateway:
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._client = None
+        self._global = None
+        self._user_limits = {}  # user key -> [semaphore, holders + waiters]
+        self._waiting = 0
+
+        # Circuit breaker
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+        self._latencies = deque(maxlen=1000)
+        self.stats = {
+            "calls": 0, "succeeded": 0, "failed": 0, "timeouts": 0,
+            "shed": 0, "short_circuited": 0, "cancelled": 0,
+            "prompt_tokens": 0, "completion_tokens": 0,
+            "in_flight": 0,
+        }
+
+    # ---------- loop management ----------
+
+    def _ensure_started(self):
+        if self._loop is not None:
+            return
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                self._client = AsyncClient(
+                    host=os.getenv("OLLAMA_HOST"),
+                    headers={'Authorization': f'Bearer {os.getenv("OLLAMA_API_KEY")}'},
+                    timeout=httpx.Timeout(TIMEOUT, connect=10),
+                    limits=httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY),
+                )
+                self._global = asyncio.Semaphore(MAX_CONCURRENCY)
+                ready.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="llm-gateway", daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+
+    def _submit(self, coro):
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    # ---------- admission control (gateway loop only) ----------
+
+    def _check_breaker(self):
+        if self._opened_at is None:
+            return
+        if time.monotonic() - self._opened_at < BREAKER_COOLDOWN or self._trial_running:
+            self.stats["short_circuited"] += 1
+            raise CircuitOpen("The AI service is temporarily unavailable. Please try again shortly.")
+        self._trial_running = True  # Half-open: let this one call through
+
+    def _record(self, ok):
+        """ok=None is a call that ended without a verdict on the model (cancelled)."""
+        if ok is None:
+            pass
+        elif ok:
+            self._failures = 0
+            self._opened_at = None
+        else:
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= BREAKER_FAILURES:
+                self._opened_at = time.monotonic()
+        self._trial_running = False
+
+    async def _acquire(self, user_key):
+        self._check_breaker()
+        if self._waiting >= MAX_QUEUE:
+            self.stats["shed"] += 1
+            self._trial_running = False
+            raise GatewayBusy("The AI assistant is busy. Please try again in a moment.")
+
+        limit = self._user_limits.setdefault(user_key, [asyncio.Semaphore(PER_USER_CONCURRENCY), 0])
+        limit[1] += 1
+        self._waiting += 1
+        acquired = []
+
+        async def acquire_both():
+            await limit[0].acquire()
+            acquired.append(limit[0])
+            await self._global.acquire()
+            acquired.append(self._global)
+
+        try:
+            await asyncio.wait_for(acquire_both(), QUEUE_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            for semaphore in acquired:
+                semaphore.release()
+            self._release_user(user_key)
+            self._trial_running = False
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.stats["shed"] += 1
+            raise GatewayBusy("The AI assistant is busy. Please try again in a moment.")
+        finally:
+            self._waiting -= 1
+        self.stats["in_flight"] += 1
+
+    def _release(self, user_key):
+        self.stats["in_flight"] -= 1
+        self._global.release()
+        self._user_limits[user_key][0].release()
+        self._release_user(user_key)
+
+    def _release_user(self, user_key):
+        limit = self._user_limits[user_key]
+        limit[1] -= 1
+        if limit[1] == 0:
+            del self._user_limits[user_key]
+
+    def _finish(self, started, response, ok):
+        self._record(ok)
+        if ok is None:
+            self.stats["cancelled"] += 1
+        elif ok:
+            self.stats["succeeded"] += 1
+            self._latencies.append(time.monotonic() - started)
+            self.stats["prompt_tokens"] += response.get("prompt_eval_count") or 0
+            self.stats["completion_tokens"] += response.get("eval_count") or 0
+        else:
+            self.stats["failed"] += 1
+
+    # ---------- calls (gateway loop only) ----------
+
+    async def _chat(self, messages, user_key, options):
+        await self._acquire(user_key)
+        self.stats["calls"] += 1
+        started = time.monotonic()
+        response, ok = None, False
+        try:
+            response = await asyncio.wait_for(
+                self._client.chat(model=MODEL, messages=messages, keep_alive=KEEP_ALIVE, **options), TIMEOUT
+            )
+            ok = True
+            return response
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise GatewayTimeout("The AI assistant took too long to answer.")
+        except Exception as e:
+            raise LLMCallFailed(f"AI Error: {str(e)}. Is Ollama running?")
+        finally:
+            self._finish(started, response or {}, ok)
+            self._release(user_key)
+
+    async def _stream(self, messages, user_key, options, push):
+        """Run a streaming chat on the gateway loop, handing chunks to push()."""
+        await self._acquire(user_key)
+        self.stats["calls"] += 1
+        started = time.monotonic()
+        last, ok = {}, False
+
+        async def consume():
+            nonlocal last
+            stream = await self._client.chat(
+                model=MODEL, messages=messages, stream=True, keep_alive=KEEP_ALIVE, **options
+            )
+            async for chunk in stream:
+                last = chunk
+                push(chunk)
+
+        try:
+            await asyncio.wait_for(consume(), TIMEOUT)
+            ok = True
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise GatewayTimeout("The AI assistant took too long to answer.")
+        except asyncio.CancelledError:
+            # The client went away: says nothing about the model, so it neither
+            # resets nor adds to the breaker's failure count
+            ok = None
+            raise
+        except Exception as e:
+            raise LLMCallFailed(f"AI Error: {str(e)}. Is Ollama running?")
+        finally:
+            self._finish(started, last or {}, ok)
+            self._release(user_key)
+
+    # ---------- public API ----------
+
+    def chat(self, messages, user_key="anonymous", **options):
+        """Blocking chat call for sync views. Raises LLMGatewayError."""
+        return self._submit(self._chat(messages, user_key, options)).result()
+
+    async def achat(self, messages, user_key="anonymous", **options):
+        return await asyncio.wrap_future(self._submit(self._chat(messages, user_key, options)))
+
+    async def astream(self, messages, user_key="anonymous", **options):
+        """Async generator of streamed chunks, usable from any event loop."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def push(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass  # The consumer's loop has closed; nobody is listening
+
+        async def produce():
+            try:
+                await self._stream(messages, user_key, options, push)
+                push(_DONE)
+            except BaseException as e:
+                push(e)
+                raise
+
+        future = self._submit(produce())
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()  # Stop generating if the consumer went away
+
+    def metrics(self):
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+        return {
+            **self.stats,
+            "queued": self._waiting,
+            "circuit": "closed" if self._opened_at is None else "open",
+            "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99)},
+            "limits": {
+                "max_concurrency": MAX_CONCURRENCY,
+                "per_user_concurrency": PER_USER_CONCURRENCY,
+                "max_queue": MAX_QUEUE,
+                "timeout_seconds": TIMEOUT,
+            },
+        }
+
+
+gateway = LLMGateway()
+
+
+def client_address(request):
+    """
+    The visitor's address. Behind TRUSTED_PROXY_COUNT proxies REMOTE_ADDR is
+    the nearest proxy, so it is read from X-Forwarded-For instead, counting
+    from the right: entries further left were sent by the client and can be forged.
+    """
+    if TRUSTED_PROXY_COUNT:
+        forwarded = [a.strip() for a in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if a.strip()]
+        if forwarded:
+            return forwarded[-min(TRUSTED_PROXY_COUNT, len(forwarded))]
+    return request.META.get("REMOTE_ADDR", "unknown")
+
+
+def user_key_for(request, user=None):
+    """Per-user concurrency key: the user id, or the client address for visitors."""
+    if user is not None:
+        return f"user:{user.id}"
+    return f"ip:{client_address(request)}"
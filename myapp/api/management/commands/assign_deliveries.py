@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from api.delivery_assignment import run_assignment_sweep
+
+
+class Command(BaseCommand):
+    help = "Run one automatic delivery assignment sweep over all pending orders with bids"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Show the assignments without saving them")
+
+    def handle(self, *args, **options):
+        result = run_assignment_sweep(dry_run=options["dry_run"])
+        for a in result["assignments"]:
+            self.stdout.write(
+                f"Order #{a['order_id']} -> {a['delivery_person']} (${a['bid_amount']}, "
+                f"{'lowest' if a['lowest_bid'] else 'not lowest'}, score {a['score']})"
+            )
+        verb = "Would assign" if options["dry_run"] else "Assigned"
+        count = len(result["assignments"]) if options["dry_run"] else result["assigned"]
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {count} of {result['orders_considered']} orders with bids"
+        ))
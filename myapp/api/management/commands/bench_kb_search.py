@@ -0,0 +1,86 @@
+import itertools
+import random
+import statistics
+import time
+from collections import namedtuple
+
+from django.core.management.base import BaseCommand
+
+from api.kb_search import RATING_BOOST, BM25Index, tokenize
+
+Entry = namedtuple("Entry", ["id", "question", "answer", "rating_sum", "rating_count"])
+
+TOPIC_WORDS = [
+    "delivery", "refund", "order", "vip", "discount", "shawarma", "kabsa", "maqluba", "halal",
+    "allergy", "gluten", "vegetarian", "spicy", "hours", "open", "closed", "deposit", "balance",
+    "complaint", "compliment", "chef", "driver", "rating", "menu", "price", "tahini", "rice",
+]
+
+
+def legacy_match(entries, keywords):
+    """The old chat_with_ai path: substring filter over every entry, then rescan each match per keyword."""
+    best_match, best_score = None, 0
+    for entry in entries:
+        text = (entry.question + " " + entry.answer).lower()
+        if not any(k in text for k in keywords):
+            continue  # What the icontains OR-chain filtered out in SQL
+        score = sum(1 for k in keywords if k in text)
+        if entry.rating_count > 0:
+            score += entry.rating_sum / entry.rating_count * RATING_BOOST
+        if score > best_score:
+            best_score, best_match = score, entry
+    return best_match
+
+
+class Command(BaseCommand):
+    help = "Benchmark BM25 KB retrieval against the old keyword scan on synthetic entries (no database)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entries", type=int, default=100000)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--vocabulary", type=int, default=20000)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        vocabulary = TOPIC_WORDS + [
+            "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9)))
+            for _ in range(options["vocabulary"])
+        ]
+        # Zipf-like word frequencies
+        cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocabulary))))
+
+        def sentence(n):
+            return " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=n))
+
+        entries = []
+        for entry_id in range(1, options["entries"] + 1):
+            count = rng.randint(0, 20)
+            entries.append(Entry(entry_id, sentence(rng.randint(5, 12)), sentence(rng.randint(15, 40)),
+                                 sum(rng.randint(1, 5) for _ in range(count)), count))
+        queries = [sentence(rng.randint(3, 8)) for _ in range(options["queries"])]
+        self.stdout.write(f"{len(entries)} entries, {len(queries)} queries")
+
+        start = time.perf_counter()
+        index = BM25Index()
+        for entry in entries:
+            index.add(entry.id, f"{entry.question} {entry.answer}",
+                      entry.rating_sum / entry.rating_count if entry.rating_count else None)
+        self.stdout.write(f"Index build: {time.perf_counter() - start:.2f} s, {len(index.postings)} terms")
+
+        def run(search):
+            timings = []
+            for query in queries:
+                keywords = tokenize(query)
+                start = time.perf_counter()
+                search(keywords)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+        bm25_p50, bm25_p95 = run(lambda keywords: index.search(keywords, k=5, min_matches=2))
+        self.stdout.write(self.style.SUCCESS(f"BM25 index:   p50 {bm25_p50:.2f} ms, p95 {bm25_p95:.2f} ms"))
+
+        legacy_p50, legacy_p95 = run(lambda keywords: legacy_match(entries, keywords))
+        self.stdout.write(f"Keyword scan: p50 {legacy_p50:.2f} ms, p95 {legacy_p95:.2f} ms "
+                          "(in-process; the database path also pays for the icontains scan and row transfer)")
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.realtime import GROUP_DRIVERS, InMemoryChannelLayer, run_socket
+
+
+class Command(BaseCommand):
+    help = "Benchmark WebSocket fan-out latency of the live bidding channel with N connected clients"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=1000)
+        parser.add_argument("--messages", type=int, default=50)
+        parser.add_argument("--interval", type=float, default=0.02, help="Seconds between published events")
+
+    def handle(self, *args, **options):
+        latencies, elapsed = asyncio.run(self.run(options["clients"], options["messages"], options["interval"]))
+
+        latencies.sort()
+        expected = options["clients"] * options["messages"]
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(f"Delivered {len(latencies)}/{expected} messages to {options['clients']} clients in {elapsed:.2f}s")
+        self.stdout.write(
+            f"Fan-out latency: p50 {pct(0.50):.2f} ms, p95 {pct(0.95):.2f} ms, "
+            f"p99 {pct(0.99):.2f} ms, max {latencies[-1] * 1000:.2f} ms, mean {statistics.mean(latencies) * 1000:.2f} ms"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Throughput: {len(latencies) / elapsed:.0f} socket sends/s"))
+
+    async def run(self, n_clients, n_messages, interval):
+        layer = InMemoryChannelLayer()
+        latencies = []
+        done = asyncio.Event()
+        expected = n_clients * n_messages
+        disconnects = []
+
+        def make_client():
+            # Fake ASGI receive/send pair: the client stays connected until told to leave
+            leave = asyncio.Event()
+            disconnects.append(leave)
+
+            async def receive():
+                await leave.wait()
+                return {"type": "websocket.disconnect"}
+
+            async def send(event):
+                message = json.loads(event["text"])
+                latencies.append(time.time() - message["sent_at"])
+                if len(latencies) >= expected:
+                    done.set()
+
+            return receive, send
+
+        sockets = [asyncio.ensure_future(run_socket(*make_client(), [GROUP_DRIVERS], layer=layer)) for _ in range(n_clients)]
+        while layer.group_size(GROUP_DRIVERS) < n_clients:
+            await asyncio.sleep(0.01)
+
+        # Publish from a worker thread, the way a sync Django view would
+        def publish():
+            for i in range(n_messages):
+                layer.group_send(GROUP_DRIVERS, {"type": "bid.created", "data": {"order_id": i}, "sent_at": time.time()})
+                time.sleep(interval)
+
+        start = time.perf_counter()
+        publisher = threading.Thread(target=publish)
+        publisher.start()
+        try:
+            await asyncio.wait_for(done.wait(), timeout=60 + n_messages * interval)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - start
+        publisher.join()
+
+        for leave in disconnects:
+            leave.set()
+        await asyncio.gather(*sockets)
+        return latencies, elapsed
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.geocoding import BATCH_GEOHASH_PRECISION, BATCH_WINDOW_MINUTES, build_delivery_batches
+
+
+class Command(BaseCommand):
+    help = "Geocode open orders and group nearby ones into multi-drop delivery batches (once, or in a loop)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--precision", type=int, default=BATCH_GEOHASH_PRECISION, help="Geohash cell length")
+        parser.add_argument("--window-minutes", type=int, default=BATCH_WINDOW_MINUTES)
+        parser.add_argument("--loop", action="store_true", help="Keep running, checking every --interval seconds")
+        parser.add_argument("--interval", type=int, default=60)
+
+    def handle(self, *args, **options):
+        while True:
+            batched = build_delivery_batches(options["precision"], options["window_minutes"])
+            if batched or not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(f"Batched {batched} orders"))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.delivery_assignment import BID_WINDOW_BATCH_SIZE, BID_WINDOW_MINUTES, close_expired_bid_windows
+
+
+class Command(BaseCommand):
+    help = "Close expired bid windows and assign each order to its lowest bidder (once, or in a loop)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window-minutes", type=int, default=BID_WINDOW_MINUTES)
+        parser.add_argument("--batch-size", type=int, default=BID_WINDOW_BATCH_SIZE)
+        parser.add_argument("--loop", action="store_true", help="Keep running, checking every --interval seconds")
+        parser.add_argument("--interval", type=int, default=30)
+
+    def handle(self, *args, **options):
+        while True:
+            closed = close_expired_bid_windows(options["window_minutes"], options["batch_size"])
+            if closed or not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(f"Closed {closed} bid windows"))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from api.fake_ollama import FakeOllamaConfig, make_server
+
+
+class Command(BaseCommand):
+    help = "Serve a fake Ollama /api/chat for offline load tests (point OLLAMA_HOST at it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=11434)
+        parser.add_argument("--model", default="gpt-oss:20b")
+        parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+        parser.add_argument("--tokens-per-second", type=float, default=50.0)
+        parser.add_argument("--tokens", type=int, default=60, help="Tokens per reply")
+        parser.add_argument("--jitter", type=float, default=0.1, help="+/- fraction applied to latency and token rate")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls that fail with a 500")
+
+    def handle(self, *args, **options):
+        config = FakeOllamaConfig(
+            model=options["model"], latency=options["latency"], tokens_per_second=options["tokens_per_second"],
+            tokens=options["tokens"], jitter=options["jitter"], error_rate=options["error_rate"],
+        )
+        server = make_server(options["host"], options["port"], config)
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f"Fake Ollama listening on http://{host}:{port} (Ctrl+C to stop)"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {config.stats}")
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.kb_retention import CHUNK, MIN_RATING, TTL_DAYS, expired_entries, merge_duplicates, purge_expired
+
+
+class Command(BaseCommand):
+    help = "Merge duplicate LLM-generated KB entries and purge expired ones (once, or in a loop)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ttl-days", type=int, default=TTL_DAYS)
+        parser.add_argument("--min-rating", type=float, default=MIN_RATING,
+                            help="Rated entries averaging below this are purged after the TTL")
+        parser.add_argument("--chunk", type=int, default=CHUNK)
+        parser.add_argument("--no-merge", action="store_true", help="Skip merging duplicate questions")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be purged")
+        parser.add_argument("--loop", action="store_true", help="Keep running, every --interval seconds")
+        parser.add_argument("--interval", type=int, default=3600)
+
+    def handle(self, *args, **options):
+        if options["dry_run"]:
+            count = expired_entries(options["ttl_days"], options["min_rating"]).count()
+            self.stdout.write(f"{count} generated KB entries would be purged")
+            return
+
+        while True:
+            merged = 0 if options["no_merge"] else merge_duplicates(options["chunk"])
+            purged = purge_expired(options["ttl_days"], options["min_rating"], options["chunk"])
+            if merged or purged or not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(f"Merged {merged} duplicate and purged {purged} expired KB entries"))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
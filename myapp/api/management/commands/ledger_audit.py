@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.ledger import audit
+
+
+class Command(BaseCommand):
+    help = "Check that ledger postings balance and that deposit balances and snapshots match the ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true",
+                            help="Reset mismatched deposit balances from the ledger and drop bad snapshots")
+
+    def handle(self, *args, **options):
+        problems = audit(fix=options["fix"])
+        for problem in problems:
+            self.stdout.write(self.style.WARNING(problem))
+        if problems:
+            self.stdout.write(f"{len(problems)} problem(s) found")
+        else:
+            self.stdout.write(self.style.SUCCESS("Ledger is consistent"))
@@ -0,0 +1,224 @@
+import os
+import random
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http.request import validate_host
+from django.test import Client
+
+from api.fake_ollama import FakeOllamaConfig, start_in_background
+from api.models import KnowledgeBaseEntry
+
+NOVEL_TOPICS = [
+    "parking", "birthday cake", "catering for forty people", "gift cards", "wheelchair access",
+    "outdoor seating", "live music", "late night delivery", "nut free desserts", "corporate accounts",
+]
+
+
+def nonce(rng):
+    return "".join(rng.choice("bcdfghjklmnpqrstvwxz") + rng.choice("aeiou") for _ in range(3))
+
+
+LOCAL_HOSTS = {"", "localhost", "127.0.0.1", "::1"}
+
+
+def is_local_database(settings_dict):
+    """SQLite, a database on this machine, or a test database."""
+    return (
+        "sqlite" in settings_dict["ENGINE"]
+        or (settings_dict.get("HOST") or "") in LOCAL_HOSTS
+        or str(settings_dict["NAME"]).startswith("test_")
+    )
+
+
+def request_host():
+    """A Host header the views accept: the first concrete ALLOWED_HOSTS entry, or localhost under DEBUG."""
+    allowed = list(settings.ALLOWED_HOSTS)
+    if settings.DEBUG and not allowed:
+        allowed = [".localhost", "127.0.0.1", "[::1]"]  # What Django allows then
+    for pattern in allowed:
+        host = pattern.lstrip(".")
+        if host and host != "*" and validate_host(host, allowed):
+            return host
+    return "localhost" if validate_host("localhost", allowed) else None
+
+
+def percentiles(latencies):
+    if not latencies:
+        return "-"
+    ordered = sorted(latencies)
+
+    def at(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+    return (f"p50 {statistics.median(ordered) * 1000:.1f} ms, p95 {at(0.95):.1f} ms, "
+            f"p99 {at(0.99):.1f} ms, max {ordered[-1] * 1000:.1f} ms")
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the chat and discussion summary endpoints at a fixed concurrency and report throughput, "
+        "tail latency, KB hit rate and LLM calls avoided. Starts a fake Ollama unless --ollama-host is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--users", type=int, default=None, help="Distinct client addresses (default: --concurrency)")
+        parser.add_argument("--mode", default="auto", choices=["auto", "keyword", "semantic"])
+        parser.add_argument("--kb-share", type=float, default=0.4, help="Share of chat questions taken from the KB")
+        parser.add_argument("--repeat-share", type=float, default=0.3, help="Share of chat questions asked before")
+        parser.add_argument("--summary-share", type=float, default=0.1, help="Share of requests to discussion_summary/")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--keep", action="store_true", help="Keep the KB entries LLM answers created")
+        parser.add_argument(
+            "--database", default=None,
+            help="Name of the default database, to confirm a run against one that is not local or a test database",
+        )
+
+        parser.add_argument("--ollama-host", default=None, help="Use this host instead of a local fake")
+        parser.add_argument("--latency", type=float, default=0.2, help="Fake: seconds before the first token")
+        parser.add_argument("--tokens-per-second", type=float, default=50.0)
+        parser.add_argument("--tokens", type=int, default=60)
+        parser.add_argument("--error-rate", type=float, default=0.0)
+
+    def handle(self, *args, **options):
+        # The run writes KB entries through the real views; keep it off shared databases by accident
+        name = str(connection.settings_dict["NAME"])
+        if options["database"] is not None and options["database"] != name:
+            raise CommandError(f"--database {options['database']} does not match the default database ({name})")
+        if options["database"] is None and not is_local_database(connection.settings_dict):
+            raise CommandError(
+                f"The default database ({name} on {connection.settings_dict.get('HOST')}) is not local. "
+                f"Pass --database {name} to load test it anyway."
+            )
+
+        fake = None
+        if options["ollama_host"]:
+            os.environ["OLLAMA_HOST"] = options["ollama_host"]
+        else:
+            fake = FakeOllamaConfig(
+                latency=options["latency"], tokens_per_second=options["tokens_per_second"],
+                tokens=options["tokens"], error_rate=options["error_rate"],
+            )
+            server, url = start_in_background(config=fake)
+            os.environ["OLLAMA_HOST"] = url  # Read when the gateway starts, on the first LLM call
+            self.stdout.write(f"Fake Ollama on {url}")
+
+        # django.test.Client sends Host: testserver, which only the test runner allows
+        host = request_host()
+        if host is None:
+            raise CommandError("No usable host in ALLOWED_HOSTS to send the requests to")
+
+        # Imported after OLLAMA_HOST is set
+        from api.llm_gateway import gateway
+
+        rng = random.Random(options["seed"])
+        kb_questions = list(
+            KnowledgeBaseEntry.objects.filter(author_type="employee", is_removed=False).values_list("question", flat=True)
+        )
+        manager = User.objects.filter(userprofile__user_type="manager").first()
+        if not kb_questions:
+            self.stderr.write("No employee KB entries: every chat question will go to the LLM")
+        if manager is None and options["summary_share"]:
+            self.stderr.write("No manager account: skipping discussion_summary/ requests")
+
+        users = options["users"] or options["concurrency"]
+        workload, asked = [], []
+        for _ in range(options["requests"]):
+            roll = rng.random()
+            if manager is not None and roll < options["summary_share"]:
+                workload.append(("summary", None, None))
+            elif kb_questions and rng.random() < options["kb_share"]:
+                workload.append(("chat", rng.choice(kb_questions), rng.randrange(users)))
+            elif asked and rng.random() < options["repeat_share"]:
+                workload.append(("chat", rng.choice(asked), rng.randrange(users)))
+            else:
+                question = f"Do you offer {rng.choice(NOVEL_TOPICS)} for {nonce(rng)} {nonce(rng)}?"
+                asked.append(question)
+                workload.append(("chat", question, rng.randrange(users)))
+
+        local = threading.local()
+
+        def run(task):
+            kind, question, address = task
+            started = time.monotonic()
+            if kind == "summary":
+                if not hasattr(local, "manager_client"):
+                    local.manager_client = Client(HTTP_HOST=host, raise_request_exception=False)
+                    local.manager_client.force_login(manager)
+                response = local.manager_client.get("/api/discussion_summary/")
+                source = None
+            else:
+                # A visitor from one of `users` addresses (the gateway's per-user limit keys on it)
+                client = Client(
+                    HTTP_HOST=host, REMOTE_ADDR=f"10.77.{address // 250}.{address % 250 + 1}",
+                    raise_request_exception=False,
+                )
+                response = client.post(
+                    "/api/chat/", {"message": question, "mode": options["mode"]}, content_type="application/json"
+                )
+                if response.status_code != 200:
+                    source = "error"
+                else:
+                    data = response.json()
+                    source = "kb" if data.get("source") == "knowledge_base" else "cache" if data.get("cached") else "llm"
+                    if source == "llm":
+                        created_ids.add(data["entry_id"])  # Set.add is atomic; coalesced answers share an id
+            return kind, response.status_code, time.monotonic() - started, source
+
+        created_ids = set()
+        calls_before = gateway.stats["calls"]
+        shed_before = gateway.stats["shed"]
+
+        self.stdout.write(
+            f"{len(workload)} requests, concurrency {options['concurrency']}, {users} client addresses, mode {options['mode']}"
+        )
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            results = list(pool.map(run, workload))
+        elapsed = time.monotonic() - started
+
+        latencies, statuses, sources = defaultdict(list), defaultdict(Counter), Counter()
+        for kind, status_code, latency, source in results:
+            latencies[kind].append(latency)
+            statuses[kind][status_code] += 1
+            if kind == "chat" and source != "error":
+                sources[source] += 1
+
+        self.stdout.write(f"\nWall time {elapsed:.2f} s, throughput {len(results) / elapsed:.1f} req/s")
+        for kind in ["chat", "summary"]:
+            if latencies[kind]:
+                self.stdout.write(f"  {kind:8} {len(latencies[kind]):6} requests  {percentiles(latencies[kind])}")
+                self.stdout.write(f"  {'':8} status {dict(statuses[kind])}")
+
+        answered = sum(sources.values())
+        llm_calls = gateway.stats["calls"] - calls_before
+        if answered:
+            self.stdout.write(
+                f"\nChat answered {answered}: KB {sources['kb']} ({sources['kb'] / answered:.1%} hit rate), "
+                f"answer cache {sources['cache']}, LLM {sources['llm']}"
+            )
+            self.stdout.write(
+                f"LLM calls made {llm_calls}, avoided {answered - sources['llm']} "
+                f"({(answered - sources['llm']) / answered:.1%} of answered chats), "
+                f"shed by the gateway {gateway.stats['shed'] - shed_before}"
+            )
+        errors = sum(count for code, count in statuses["chat"].items() if code != 200)
+        if errors:
+            self.stderr.write(f"{errors} chat requests failed: status {dict(statuses['chat'])}")
+        if fake is not None:
+            self.stdout.write(f"Fake Ollama {fake.stats}")
+
+        if not options["keep"]:
+            deleted, _ = KnowledgeBaseEntry.objects.filter(
+                id__in=created_ids, author_type="visitor", is_generated=True
+            ).delete()
+            self.stdout.write(f"Removed {deleted} KB entries created by the run")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api.complaint_dedup import index_complaint
+from api.models import Complaint, ComplaintSignature
+
+
+class Command(BaseCommand):
+    help = "Rebuild the near-duplicate (MinHash LSH) index over complaint descriptions"
+
+    def handle(self, *args, **options):
+        # Start from scratch so clusters are rebuilt oldest-first
+        ComplaintSignature.objects.all().delete()
+        Complaint.objects.update(duplicate_of=None)
+
+        indexed = 0
+        duplicates = 0
+        for complaint in Complaint.objects.order_by('id').iterator():
+            if index_complaint(complaint):
+                duplicates += 1
+            indexed += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} complaints, {duplicates} linked as near-duplicates"
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.kb_vectors import LSA_DIM, rebuild
+
+
+class Command(BaseCommand):
+    help = "Refit the semantic KB model and rewrite the memory-mapped vector index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dims", type=int, default=LSA_DIM, help="Number of LSA components")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rows = rebuild(options["dims"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {rows} entries in {time.perf_counter() - start:.2f} s"
+        ))
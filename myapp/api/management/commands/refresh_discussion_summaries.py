@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.discussion_summaries import WORKERS, refresh_stale_summaries
+
+
+class Command(BaseCommand):
+    help = "Re-summarize discussion topics with new posts since their stored summary (once, or in a loop)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=WORKERS)
+        parser.add_argument("--limit", type=int, default=None, help="At most this many topics per run")
+        parser.add_argument("--loop", action="store_true", help="Keep running, checking every --interval seconds")
+        parser.add_argument("--interval", type=int, default=60)
+
+    def handle(self, *args, **options):
+        while True:
+            refreshed, failed = refresh_stale_summaries(options["workers"], options["limit"])
+            for topic_id, error in failed:
+                self.stderr.write(f"Topic #{topic_id}: {error}")
+            if refreshed or failed or not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(f"Refreshed {refreshed} summaries ({len(failed)} failed)"))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
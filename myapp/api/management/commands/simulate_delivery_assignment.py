@@ -0,0 +1,61 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from api.delivery_assignment import BidCandidate, MAX_ACTIVE_LOAD, solve_assignment
+
+
+class Command(BaseCommand):
+    help = "Simulate and benchmark the delivery assignment solver on synthetic bids (no database)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=10000)
+        parser.add_argument("--drivers", type=int, default=500)
+        parser.add_argument("--bids-per-order", type=int, default=8)
+        parser.add_argument("--max-load", type=int, default=MAX_ACTIVE_LOAD)
+        parser.add_argument("--runs", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        n_orders, n_drivers = options["orders"], options["drivers"]
+        max_load = options["max_load"]
+
+        ratings = {d: round(rng.uniform(1.5, 5.0), 2) for d in range(1, n_drivers + 1)}
+        loads = {d: rng.randint(0, max_load - 1) for d in ratings}
+
+        candidates = []
+        bid_id = 0
+        for order_id in range(1, n_orders + 1):
+            base = rng.uniform(3.0, 12.0)
+            for driver in rng.sample(range(1, n_drivers + 1), min(options["bids_per_order"], n_drivers)):
+                bid_id += 1
+                amount = Decimal(str(round(base * rng.uniform(0.8, 1.5), 2)))
+                candidates.append(BidCandidate(bid_id, order_id, driver, amount, ratings[driver]))
+
+        self.stdout.write(
+            f"{n_orders} orders, {n_drivers} drivers, {len(candidates)} bids, "
+            f"capacity {n_drivers * max_load - sum(loads.values())} free slots"
+        )
+
+        timings = []
+        decisions = []
+        for _ in range(options["runs"]):
+            start = time.perf_counter()
+            decisions = solve_assignment(candidates, loads, max_load=max_load)
+            timings.append(time.perf_counter() - start)
+
+        lowest = sum(1 for d in decisions if d.bid.bid_id == d.lowest_bid.bid_id)
+        premium = [
+            float(d.bid.amount - d.lowest_bid.amount) for d in decisions if d.bid.bid_id != d.lowest_bid.bid_id
+        ]
+        self.stdout.write(f"Assigned {len(decisions)} orders ({lowest} to the lowest bidder)")
+        if premium:
+            self.stdout.write(f"Average premium over lowest bid when not lowest: ${statistics.mean(premium):.2f}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Solver time: best {min(timings) * 1000:.1f} ms, "
+            f"median {statistics.median(timings) * 1000:.1f} ms over {len(timings)} runs"
+        ))
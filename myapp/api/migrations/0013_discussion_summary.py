@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_delivery_batching'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscussionSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.TextField()),
+                ('post_count', models.IntegerField(default=0)),
+                ('last_post_id', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('topic', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='api.discussiontopic')),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_generated(apps, schema_editor):
+    # Visitors can only get KB rows from the chat, so theirs are LLM answers. Older
+    # customer-authored rows can be either and are left as curated.
+    KnowledgeBaseEntry = apps.get_model('api', 'KnowledgeBaseEntry')
+    KnowledgeBaseEntry.objects.filter(author_type='visitor').update(is_generated=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_discussion_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebaseentry',
+            name='is_generated',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='knowledgebaseentry',
+            name='author_type',
+            field=models.CharField(choices=[('employee', 'Employee'), ('customer', 'Customer'), ('visitor', 'Visitor')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='knowledgebaseentry',
+            index=models.Index(fields=['author_type', 'is_removed', 'rating_sum'], name='api_knowled_author__4432bc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='knowledgebaseentry',
+            index=models.Index(fields=['is_generated', 'created_at'], name='api_knowled_is_gene_4c833b_idx'),
+        ),
+        migrations.RunPython(mark_generated, migrations.RunPython.noop),
+    ]
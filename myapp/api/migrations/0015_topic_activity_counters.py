@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:26
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    DiscussionTopic = apps.get_model('api', 'DiscussionTopic')
+    DiscussionPost = apps.get_model('api', 'DiscussionPost')
+    posts = DiscussionPost.objects.filter(topic=OuterRef('pk')).order_by().values('topic')
+    DiscussionTopic.objects.update(
+        post_count=Coalesce(Subquery(posts.annotate(n=Count('id')).values('n')), 0),
+        last_activity_at=Coalesce(Subquery(posts.annotate(last=Max('created_at')).values('last')), 'created_at'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_kb_retention'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discussiontopic',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='discussiontopic',
+            name='post_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='discussiontopic',
+            index=models.Index(fields=['-created_at', '-id'], name='api_discuss_created_38624e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discussiontopic',
+            index=models.Index(fields=['-last_activity_at', '-id'], name='api_discuss_last_ac_56ffa0_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
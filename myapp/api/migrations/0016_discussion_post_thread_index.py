@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_topic_activity_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='discussionpost',
+            index=models.Index(fields=['topic', 'created_at', 'id'], name='api_discuss_topic_i_3246b5_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:31
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# (table, text column) pairs indexed for forum_search.py
+SEARCHED = [
+    ('api_discussiontopic', 'title'),
+    ('api_discussionpost', 'content'),
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table, column in SEARCHED:
+        if vendor == 'postgresql':
+            # search_vector is recomputed by the database on every insert and text change
+            schema_editor.execute(
+                f"CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE OF {column} ON {table} "
+                f"FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_vector, 'pg_catalog.english', {column})"
+            )
+            schema_editor.execute(
+                f"UPDATE {table} SET search_vector = to_tsvector('pg_catalog.english', coalesce({column}, ''))"
+            )
+            schema_editor.execute(f"CREATE INDEX {table}_search_vector_gin ON {table} USING gin (search_vector)")
+        elif vendor == 'sqlite':
+            # External-content FTS5 table: stores only the index, kept in sync by triggers
+            fts = f"{table}_fts"
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({column}, content='{table}', content_rowid='id', "
+                f"tokenize='porter unicode61')"
+            )
+            schema_editor.execute(
+                f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END"
+            )
+            schema_editor.execute(
+                f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END"
+            )
+            schema_editor.execute(
+                f"CREATE TRIGGER {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+                f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END"
+            )
+            schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table, column in SEARCHED:
+        if vendor == 'postgresql':
+            schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_vector_gin")
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_search_vector ON {table}")
+        elif vendor == 'sqlite':
+            for action in ('insert', 'delete', 'update'):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{action}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_discussion_post_thread_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discussionpost',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='discussiontopic',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
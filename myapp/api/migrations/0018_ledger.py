@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_balances(apps, schema_editor):
+    """Carry each existing deposit_balance over as an opening posting plus a snapshot."""
+    CustomerProfile = apps.get_model('api', 'CustomerProfile')
+    LedgerEntry = apps.get_model('api', 'LedgerEntry')
+    LedgerSnapshot = apps.get_model('api', 'LedgerSnapshot')
+    for customer in CustomerProfile.objects.exclude(deposit_balance=0).iterator():
+        leg, _ = LedgerEntry.objects.bulk_create([
+            LedgerEntry(account='customer', customer=customer, kind='opening', amount=customer.deposit_balance),
+            LedgerEntry(account='opening', kind='opening', amount=-customer.deposit_balance),
+        ])
+        LedgerSnapshot.objects.create(
+            customer=customer, balance=customer.deposit_balance, last_entry_id=leg.id, as_of=leg.created_at,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_forum_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(choices=[('customer', 'Customer Deposit'), ('stripe', 'Stripe Clearing'), ('sales', 'Order Sales'), ('payout', 'Closure Payouts'), ('opening', 'Opening Balances')], max_length=20)),
+                ('kind', models.CharField(choices=[('deposit', 'Deposit'), ('withdrawal', 'Withdrawal'), ('order_payment', 'Order Payment'), ('refund', 'Refund'), ('opening', 'Opening Balance')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='api.customerprofile')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='api.order')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='api.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'id'], name='api_ledgere_custome_e74d14_idx'), models.Index(fields=['customer', 'created_at', 'id'], name='api_ledgere_custome_c5766a_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('last_entry_id', models.BigIntegerField()),
+                ('as_of', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_snapshots', to='api.customerprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'last_entry_id'], name='api_ledgers_custome_38085a_idx'), models.Index(fields=['customer', 'as_of'], name='api_ledgers_custome_702c19_idx')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 
@@ -377,6 +380,49 @@ class MenuItem(models.Model):
         return f"{self.name} by {self.chef.user_profile.user.username}"
 
 
+# ============================================
+# GEOCODING / DELIVERY BATCHING MODELS
+# ============================================
+
+class GeocodeCache(models.Model):
+    SOURCE_CHOICES = [
+        ('gazetteer', 'Gazetteer'),
+        ('street', 'Street Centroid'),
+        ('unresolved', 'Unresolved'),
+    ]
+
+    normalized_address = models.CharField(max_length=255, unique=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='unresolved')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.normalized_address} ({self.geohash or self.source})"
+
+
+class DeliveryBatch(models.Model):
+    """Multi-drop run: orders headed to the same geohash cell in the same time window"""
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('closed', 'Closed'),
+    ]
+
+    geohash = models.CharField(max_length=12)
+    window_start = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['geohash', 'window_start']),
+        ]
+
+    def __str__(self):
+        return f"Batch #{self.id} ({self.geohash}, {self.window_start:%Y-%m-%d %H:%M})"
+
+
 # ============================================
 # ORDER MODELS
 # ============================================
@@ -403,14 +449,23 @@ class Order(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # For delta polling (since=)
     delivery_person = models.ForeignKey(DeliveryPerson, on_delete=models.SET_NULL, null=True, blank=True, related_name='deliveries')
     delivery_bid_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     is_free_delivery = models.BooleanField(default=False)  # For VIP tracking
+    geocode = models.ForeignKey(GeocodeCache, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
+    delivery_batch = models.ForeignKey(DeliveryBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
 
     # Stripe fields
     stripe_payment_intent_id = models.CharField(max_length=255, blank=True, null=True)
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='pending')
 
+    class Meta:
+        indexes = [
+            # Bid-window scheduler scans pending orders oldest-first
+            models.Index(fields=['status', 'created_at']),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} by {self.customer.user_profile.user.username}"
 
@@ -491,10 +546,38 @@ class Complaint(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     processed_at = models.DateTimeField(null=True, blank=True)
 
+    # Near-duplicate clustering: points at the earliest complaint of the cluster
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='duplicates')
+
     def __str__(self):
         return f"Complaint by {self.complainant.username} against {self.target_user.username}"
 
 
+class ComplaintSignature(models.Model):
+    """MinHash signature of a complaint description (see complaint_dedup.py)"""
+    complaint = models.OneToOneField(Complaint, on_delete=models.CASCADE, related_name='signature')
+    target_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    minhash = models.JSONField()
+
+    def __str__(self):
+        return f"Signature for Complaint #{self.complaint_id}"
+
+
+class ComplaintBucket(models.Model):
+    """One LSH band bucket of a complaint signature, looked up per target user"""
+    signature = models.ForeignKey(ComplaintSignature, on_delete=models.CASCADE, related_name='buckets')
+    target_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    bucket = models.CharField(max_length=40)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['target_user', 'bucket']),
+        ]
+
+    def __str__(self):
+        return f"Bucket {self.bucket} for Complaint #{self.signature.complaint_id}"
+
+
 class Compliment(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -579,8 +662,21 @@ class DiscussionTopic(models.Model):
     related_dish = models.ForeignKey(MenuItem, on_delete=models.SET_NULL, null=True, blank=True)
     related_delivery = models.ForeignKey(DeliveryPerson, on_delete=models.SET_NULL, null=True, blank=True)
 
+    # Maintained by create_reply and the DiscussionPost post_delete signal
+    post_count = models.IntegerField(default=0)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Postgres only, filled in by a database trigger (see forum_search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id']),
+            models.Index(fields=['-last_activity_at', '-id']),
+        ]
+
     def __str__(self):
         return f"{self.title} by {self.author.username}"
 
@@ -591,10 +687,57 @@ class DiscussionPost(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Postgres only, filled in by a database trigger (see forum_search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Thread pages: WHERE topic_id = ? AND (created_at, id) > cursor ORDER BY created_at, id
+            models.Index(fields=['topic', 'created_at', 'id']),
+        ]
+
     def __str__(self):
         return f"Post by {self.author.username} in {self.topic.title}"
 
 
+@receiver(post_save, sender=DiscussionPost)
+def increment_topic_post_count(sender, instance, created, **kwargs):
+    if created:
+        # F() keeps concurrent replies from losing counts
+        DiscussionTopic.objects.filter(id=instance.topic_id).update(
+            post_count=F('post_count') + 1,
+            last_activity_at=instance.created_at,
+        )
+
+
+@receiver(post_delete, sender=DiscussionPost)
+def decrement_topic_post_count(sender, instance, **kwargs):
+    DiscussionTopic.objects.filter(id=instance.topic_id, post_count__gt=0).update(post_count=F('post_count') - 1)
+
+
+@receiver(post_save, sender=DiscussionPost)
+@receiver(post_delete, sender=DiscussionPost)
+def refresh_topic_summary(sender, instance, created=None, **kwargs):
+    # New and deleted posts (post_delete sends no `created`); edits keep the summary
+    if created is False:
+        return
+    from .discussion_summaries import schedule_refresh
+    topic_id = instance.topic_id
+    transaction.on_commit(lambda: schedule_refresh(topic_id))
+
+
+class DiscussionSummary(models.Model):
+    """AI summary of a topic, with the posts it was built from (see discussion_summaries.py)"""
+    topic = models.OneToOneField(DiscussionTopic, on_delete=models.CASCADE, related_name='summary')
+    summary = models.TextField()
+    post_count = models.IntegerField(default=0)
+    last_post_id = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of {self.topic.title} ({self.post_count} posts)"
+
+
 # ============================================
 # KNOWLEDGE BASE MODELS
 # ============================================
@@ -603,6 +746,7 @@ class KnowledgeBaseEntry(models.Model):
     AUTHOR_TYPE_CHOICES = [
         ('employee', 'Employee'),
         ('customer', 'Customer'),
+        ('visitor', 'Visitor'),
     ]
 
     author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
@@ -619,8 +763,17 @@ class KnowledgeBaseEntry(models.Model):
     is_removed = models.BooleanField(default=False)
     flagged_count = models.IntegerField(default=0)  # Count of 0-star ratings
 
+    # Stored LLM answer (chat_with_ai), subject to retention (kb_retention.py)
+    is_generated = models.BooleanField(default=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['author_type', 'is_removed', 'rating_sum']),
+            models.Index(fields=['is_generated', 'created_at']),
+        ]
+
     def __str__(self):
         return f"KB: {self.question[:50]}..."
 
@@ -645,6 +798,50 @@ class KnowledgeBaseRating(models.Model):
         return f"{self.user.username} rated KB entry {self.rating}"
 
 
+@receiver(post_save, sender=KnowledgeBaseEntry)
+def update_kb_search_index(sender, instance, **kwargs):
+    """Keep the chat KB search indexes (kb_search.py, kb_vectors.py) in step with employee entries"""
+    if instance.author_type == 'employee':
+        from . import kb_search, kb_vectors
+        transaction.on_commit(lambda: kb_search.entry_changed(instance))
+        transaction.on_commit(lambda: kb_vectors.entry_changed(instance))
+
+
+@receiver(post_delete, sender=KnowledgeBaseEntry)
+def remove_from_kb_search_index(sender, instance, **kwargs):
+    if instance.author_type == 'employee':
+        from . import kb_search, kb_vectors
+        entry_id = instance.id
+        transaction.on_commit(lambda: kb_search.entry_deleted(entry_id))
+        transaction.on_commit(lambda: kb_vectors.remove_entry(entry_id))
+
+
+# Chat prompt content versions (api/content_versions.py): bumped when a save
+# changes something the LLM prompt shows, so cached answers/context go stale
+CONTENT_VERSION_MODELS = {KnowledgeBaseEntry: 'kb', MenuItem: 'menu', Chef: 'chef'}
+
+
+def snapshot_prompt_fields(sender, instance, **kwargs):
+    from .content_versions import snapshot
+    snapshot(CONTENT_VERSION_MODELS[sender], instance)
+
+
+def bump_content_version(sender, instance, created=False, **kwargs):
+    from .content_versions import bump, changed, snapshot
+    name = CONTENT_VERSION_MODELS[sender]
+    if name == 'kb' and instance.author_type != 'employee' and (created or not changed(name, instance)):
+        return  # Only employee entries are prompt content (an entry being curated still counts)
+    if created or kwargs.get('signal') is post_delete or changed(name, instance):
+        transaction.on_commit(lambda: bump(name))
+    snapshot(name, instance)
+
+
+for _model in CONTENT_VERSION_MODELS:
+    post_init.connect(snapshot_prompt_fields, sender=_model)
+    post_save.connect(bump_content_version, sender=_model)
+    post_delete.connect(bump_content_version, sender=_model)
+
+
 # ============================================
 # FINANCIAL MODELS
 # ============================================
@@ -682,6 +879,63 @@ class Transaction(models.Model):
         return f"{self.transaction_type} ${self.amount} by {self.user.username}"
 
 
+class LedgerEntry(models.Model):
+    """
+    One leg of a double-entry posting (see ledger.py). Every posting writes
+    two legs whose amounts sum to zero; a customer's balance is the sum of
+    their 'customer' legs. Entries are never updated or deleted, and a
+    customer with entries cannot be deleted either (accounts are closed).
+    """
+    ACCOUNT_CHOICES = [
+        ('customer', 'Customer Deposit'),
+        ('stripe', 'Stripe Clearing'),
+        ('sales', 'Order Sales'),
+        ('payout', 'Closure Payouts'),
+        ('opening', 'Opening Balances'),
+    ]
+    KIND_CHOICES = Transaction.TRANSACTION_TYPES + [('opening', 'Opening Balance')]
+
+    account = models.CharField(max_length=20, choices=ACCOUNT_CHOICES)
+    customer = models.ForeignKey(CustomerProfile, on_delete=models.PROTECT, null=True, blank=True, related_name='ledger_entries')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)  # Signed, from the account's side
+    transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'id']),  # Tail after a snapshot
+            models.Index(fields=['customer', 'created_at', 'id']),  # Statements by date
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValidationError("Ledger entries are append-only")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.kind} {self.account} {self.amount}"
+
+
+class LedgerSnapshot(models.Model):
+    """A customer's ledger balance through entry last_entry_id (created at as_of)."""
+    customer = models.ForeignKey(CustomerProfile, on_delete=models.CASCADE, related_name='ledger_snapshots')
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    last_entry_id = models.BigIntegerField()
+    as_of = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'last_entry_id']),
+            models.Index(fields=['customer', 'as_of']),
+        ]
+
+    def __str__(self):
+        return f"{self.customer} balance {self.balance} through entry {self.last_entry_id}"
+
+
 class PaymentMethod(models.Model):
     """Optional: for saving customer payment methods"""
     customer_profile = models.ForeignKey(CustomerProfile, on_delete=models.CASCADE, related_name='payment_methods')
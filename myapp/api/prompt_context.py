@@ -0,0 +1,201 @@
+"""
+System prompt for chat_with_ai.
+
+The prompt is a stable base (a fixed STATIC_PREFIX plus the chef section)
+followed by a context section picked for the message: the top-k KB entries
+(kb_search's BM25 index) and menu items (a BM25 index over the menu) that are
+relevant to it, packed in rank order into CONTEXT_TOKENS estimated tokens.
+
+The base is cached per process together with the chef content version it was
+built from (content_versions.py) and is byte-identical across requests, so the
+Ollama server can reuse its prompt/KV cache for it; only the short context
+section differs per question.
+
+Every built prompt's estimated size is recorded in prompt_stats.
+"""
+import threading
+import time
+from collections import deque, namedtuple
+
+from django.conf import settings
+
+from .content_versions import CHEF, MENU, get_versions
+from .kb_search import BM25Index, get_index, tokenize
+from .models import Chef, KnowledgeBaseEntry, MenuItem
+
+CONTEXT_TTL = getattr(settings, "PROMPT_CONTEXT_TTL", 300)  # seconds
+CONTEXT_TOKENS = getattr(settings, "PROMPT_CONTEXT_TOKENS", 800)  # budget for the per-message section
+KB_CONTEXT_K = getattr(settings, "PROMPT_CONTEXT_KB_K", 5)
+MENU_CONTEXT_K = getattr(settings, "PROMPT_CONTEXT_MENU_K", 5)
+
+ChatPrompt = namedtuple("ChatPrompt", ["text", "tokens", "context_tokens", "kb_ids", "menu_ids", "dropped"])
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+STATIC_PREFIX = """You are a helpful customer service assistant for Mashallah Eats, an online Middle Eastern restaurant ordering and delivery system.
+
+About Mashallah Eats:
+- We offer authentic Middle Eastern dishes prepared by our talented chefs
+- Customers can browse menus, place orders, and get food delivered
+- Registered customers can rate food and delivery quality (1-5 stars)
+- VIP status is earned after spending $100 or making 3 orders
+- VIP members get 5% discount, access to exclusive dishes, and 1 free delivery per 3 orders
+- Customers can file complaints or compliments about chefs and delivery personnel
+- We have a discussion forum where customers can discuss chefs, dishes, and delivery experiences
+
+Our Menu:
+- Beef Shawarma Wrap - $9.49: Thin-sliced spiced beef wrapped in warm pita with tahini sauce.
+- Mixed Grill Platter - $18.99 (VIP Only): Skewers of chicken, kofta, and lamb served with rice and grilled vegetables.
+- Lamb Kabsa - $15.99: Traditional Gulf rice dish cooked with tender lamb, tomatoes, and warm spices.
+- Maqluba - $14.99 (VIP Only): Layered rice dish with chicken, eggplant, and cauliflower flipped before serving.
+- Chicken Shawarma Plate - $12.99: Marinated chicken roasted on a vertical spit, served with rice, garlic sauce, and salad.
+
+Use the information in this message to answer questions accurately. Keep responses helpful, concise, and friendly. If you don't know specific details, suggest the customer contact the manager.
+"""
+
+
+def chef_section():
+    chefs = Chef.objects.order_by('id').values_list('user_profile__user__username', 'average_rating')
+    if not chefs:
+        return ""
+    lines = "".join(f"- {username} (Rating: {rating or 'N/A'})\n" for username, rating in chefs)
+    return "\nOur Chefs:\n" + lines
+
+
+_base = {"version": None, "built_at": 0.0, "prompt": None}
+_menu = {"version": None, "index": None, "lines": {}}
+_lock = threading.Lock()
+
+
+def get_base_prompt():
+    """STATIC_PREFIX plus the chef section, rebuilt only when the chef version changed."""
+    version = get_versions([CHEF])[CHEF]
+    now = time.monotonic()
+    with _lock:
+        if _base["prompt"] is not None and _base["version"] == version and now - _base["built_at"] < CONTEXT_TTL:
+            return _base["prompt"]
+    prompt = STATIC_PREFIX + chef_section()
+    with _lock:
+        _base.update(version=version, built_at=now, prompt=prompt)
+    return prompt
+
+
+def menu_line(name, price, vip, description):
+    return f"- {name}: ${price}{' (VIP Exclusive)' if vip else ''} - {description[:100] if description else 'No description'}\n"
+
+
+def _menu_index():
+    """BM25 index over menu item names and descriptions, rebuilt when the menu version changed."""
+    version = get_versions([MENU])[MENU]
+    with _lock:
+        if _menu["index"] is not None and _menu["version"] == version:
+            return _menu["index"], _menu["lines"]
+    index, lines = BM25Index(), {}
+    for item_id, name, price, vip, description in MenuItem.objects.values_list(
+        'id', 'name', 'price', 'is_vip_exclusive', 'description'
+    ):
+        index.add(item_id, f"{name} {description or ''}")
+        lines[item_id] = menu_line(name, price, vip, description)
+    with _lock:
+        _menu.update(version=version, index=index, lines=lines)
+    return index, lines
+
+
+def select_context(message, budget=CONTEXT_TOKENS):
+    """
+    Relevant KB entries and menu items for the message, fitted into `budget`
+    tokens. Candidates are taken alternately from the two rankings (best
+    first); one that does not fit is skipped so shorter ones can still be used.
+    Returns (section text, kb ids, menu ids, number dropped for the budget).
+    """
+    terms = tokenize(message)
+    if not terms:
+        return "", [], [], 0
+
+    kb_ids = [entry_id for _, _, entry_id in get_index().search(terms, k=KB_CONTEXT_K)]
+    kb_lines = {
+        entry_id: f"Q: {question}\nA: {answer}\n\n"
+        for entry_id, question, answer in KnowledgeBaseEntry.objects.filter(
+            id__in=kb_ids, is_removed=False
+        ).values_list('id', 'question', 'answer')
+    }
+    menu_index, menu_lines = _menu_index()
+    menu_ids = [item_id for _, _, item_id in menu_index.search(terms, k=MENU_CONTEXT_K)]
+
+    candidates = []
+    for rank in range(max(len(kb_ids), len(menu_ids))):
+        if rank < len(kb_ids) and kb_ids[rank] in kb_lines:
+            candidates.append(("kb", kb_ids[rank], kb_lines[kb_ids[rank]]))
+        if rank < len(menu_ids):
+            candidates.append(("menu", menu_ids[rank], menu_lines[menu_ids[rank]]))
+
+    headers = {
+        "kb": "\nKnowledge Base (use this information to answer questions):\n",
+        "menu": "\nRelevant Menu Items:\n",
+    }
+    chosen = {"kb": [], "menu": []}
+    used, dropped = 0, 0
+    for kind, item_id, line in candidates:
+        cost = estimate_tokens(line) + (0 if chosen[kind] else estimate_tokens(headers[kind]))
+        if used + cost > budget:
+            dropped += 1
+            continue
+        chosen[kind].append((item_id, line))
+        used += cost
+
+    section = "".join(
+        headers[kind] + "".join(line for _, line in chosen[kind]) for kind in ["kb", "menu"] if chosen[kind]
+    )
+    return section, [i for i, _ in chosen["kb"]], [i for i, _ in chosen["menu"]], dropped
+
+
+def build_chat_prompt(message, budget=CONTEXT_TOKENS):
+    """System prompt for one chat message (see the module docstring). Records its size in prompt_stats."""
+    base = get_base_prompt()
+    section, kb_ids, menu_ids, dropped = select_context(message, budget)
+    text = base + section
+    prompt = ChatPrompt(text, estimate_tokens(text), estimate_tokens(section), kb_ids, menu_ids, dropped)
+    prompt_stats.record(prompt)
+    return prompt
+
+
+class PromptStats:
+    """Estimated prompt sizes of recent chat requests in this process."""
+
+    def __init__(self, keep=500):
+        self._recent = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self.stats = {"prompts": 0, "over_budget": 0, "tokens_total": 0}
+
+    def record(self, prompt):
+        with self._lock:
+            self.stats["prompts"] += 1
+            self.stats["tokens_total"] += prompt.tokens
+            if prompt.dropped:
+                self.stats["over_budget"] += 1
+            self._recent.append({
+                "at": time.time(),
+                "tokens": prompt.tokens,
+                "context_tokens": prompt.context_tokens,
+                "kb_ids": prompt.kb_ids,
+                "menu_ids": prompt.menu_ids,
+                "dropped": prompt.dropped,
+            })
+
+    def metrics(self, recent=20):
+        with self._lock:
+            sizes = sorted(r["tokens"] for r in self._recent)
+            return {
+                **self.stats,
+                "budget_tokens": CONTEXT_TOKENS,
+                "avg_tokens": round(self.stats["tokens_total"] / self.stats["prompts"], 1) if self.stats["prompts"] else None,
+                "p95_tokens": sizes[min(len(sizes) - 1, int(len(sizes) * 0.95))] if sizes else None,
+                "recent": list(self._recent)[-recent:],
+            }
+
+
+prompt_stats = PromptStats()
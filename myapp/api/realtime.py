@@ -0,0 +1,223 @@
+"""
+Live bidding events over WebSocket.
+
+Drivers and managers connect to ws://<host>/ws/bidding/ (session cookie auth)
+and receive JSON events instead of polling. Browsers send the session cookie
+with a socket opened from any site, so the handshake's Origin must be one of
+CSRF_TRUSTED_ORIGINS / CORS_ALLOWED_ORIGINS or a host in ALLOWED_HOSTS:
+
+    order.created   a customer placed an order that is open for bids
+    bid.created     a driver bid on an order
+    order.assigned  one or more orders were assigned and are closed for bidding
+
+Events go through a channel layer. The default InMemoryChannelLayer only
+reaches sockets served by the same process. Any class with the same methods
+(new_channel, remove_channel, receive, group_add, group_discard, group_send)
+can be plugged in through settings.REALTIME_CHANNEL_LAYER, e.g. a Redis
+pub/sub backed layer for multi-process deployments.
+"""
+import asyncio
+import json
+import threading
+import time
+import uuid
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.http.request import validate_host
+from django.utils.module_loading import import_string
+
+WEBSOCKET_PATH = "/ws/bidding/"
+
+GROUP_DRIVERS = "drivers"
+GROUP_MANAGERS = "managers"
+
+GROUPS_BY_USER_TYPE = {
+    "delivery": [GROUP_DRIVERS],
+    "manager": [GROUP_MANAGERS],
+}
+
+
+class InMemoryChannelLayer:
+    """
+    Process-local channel layer.
+    group_send is thread-safe so sync views can publish while sockets are
+    served on the ASGI event loop. Each channel has a bounded queue; a slow
+    client loses its oldest events rather than growing memory without limit.
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self._channels = {}  # channel name -> (loop, queue)
+        self._groups = {}    # group name -> set of channel names
+        self._lock = threading.Lock()
+
+    def new_channel(self):
+        name = f"ws.{uuid.uuid4().hex}"
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._channels[name] = (loop, asyncio.Queue(maxsize=self.capacity))
+        return name
+
+    def remove_channel(self, channel):
+        with self._lock:
+            self._channels.pop(channel, None)
+            for members in self._groups.values():
+                members.discard(channel)
+
+    async def receive(self, channel):
+        _, queue = self._channels[channel]
+        return await queue.get()
+
+    def group_add(self, group, channel):
+        with self._lock:
+            self._groups.setdefault(group, set()).add(channel)
+
+    def group_discard(self, group, channel):
+        with self._lock:
+            self._groups.get(group, set()).discard(channel)
+
+    def group_send(self, group, message):
+        with self._lock:
+            targets = [self._channels[c] for c in self._groups.get(group, ()) if c in self._channels]
+        for loop, queue in targets:
+            try:
+                loop.call_soon_threadsafe(_put_dropping_oldest, queue, message)
+            except RuntimeError:
+                pass  # Event loop already closed
+
+    def group_size(self, group):
+        with self._lock:
+            return len(self._groups.get(group, ()))
+
+
+def _put_dropping_oldest(queue, message):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+_layer = None
+_layer_lock = threading.Lock()
+
+
+def get_channel_layer():
+    global _layer
+    if _layer is None:
+        with _layer_lock:
+            if _layer is None:
+                path = getattr(settings, "REALTIME_CHANNEL_LAYER", "api.realtime.InMemoryChannelLayer")
+                _layer = import_string(path)()
+    return _layer
+
+
+def broadcast(event_type, data, groups=(GROUP_DRIVERS, GROUP_MANAGERS)):
+    """
+    Publish an event to connected drivers/managers once the current
+    transaction commits (immediately when not in a transaction).
+    """
+    def send():
+        message = {"type": event_type, "data": data, "sent_at": time.time()}
+        layer = get_channel_layer()
+        for group in groups:
+            layer.group_send(group, message)
+
+    transaction.on_commit(send)
+
+
+# ============================================
+# ASGI WEBSOCKET APPLICATION
+# ============================================
+
+def _origin_allowed(scope):
+    """Whether the page opening the socket may use the visitor's session (no Origin: refused)."""
+    origin = next((value.decode("latin-1") for name, value in scope.get("headers", []) if name == b"origin"), None)
+    if not origin:
+        return False
+    trusted = [*getattr(settings, "CSRF_TRUSTED_ORIGINS", []), *getattr(settings, "CORS_ALLOWED_ORIGINS", [])]
+    if origin in trusted:
+        return True
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = [".localhost", "127.0.0.1", "[::1]"]  # As Django's own host check
+    host = urlsplit(origin).hostname
+    return bool(host) and validate_host(host, allowed_hosts)
+
+
+def _user_type_for_scope(scope):
+    """Resolve the logged-in user's type from the session cookie (or None)."""
+    from django.contrib.auth import get_user
+
+    cookies = SimpleCookie()
+    for name, value in scope.get("headers", []):
+        if name == b"cookie":
+            cookies.load(value.decode("latin-1"))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if not morsel:
+        return None
+
+    session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    user = get_user(SimpleNamespace(session=session))
+    if not user.is_authenticated or not hasattr(user, "userprofile"):
+        return None
+    return user.userprofile.user_type
+
+
+async def run_socket(receive, send, groups, layer=None):
+    """Pump channel layer events to an accepted socket until the client disconnects."""
+    layer = layer or get_channel_layer()
+    channel = layer.new_channel()
+    for group in groups:
+        layer.group_add(group, channel)
+
+    async def pump_events():
+        while True:
+            message = await layer.receive(channel)
+            await send({"type": "websocket.send", "text": json.dumps(message)})
+
+    pump = asyncio.ensure_future(pump_events())
+    try:
+        while True:
+            event = await receive()
+            if event["type"] == "websocket.disconnect":
+                break
+            if event["type"] == "websocket.receive" and event.get("text"):
+                try:
+                    payload = json.loads(event["text"])
+                except ValueError:
+                    continue
+                if isinstance(payload, dict) and payload.get("action") == "ping":
+                    await send({"type": "websocket.send", "text": json.dumps({"type": "pong", "sent_at": time.time()})})
+    finally:
+        pump.cancel()
+        layer.remove_channel(channel)
+
+
+async def websocket_application(scope, receive, send):
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+
+    if scope.get("path") != WEBSOCKET_PATH:
+        await send({"type": "websocket.close", "code": 4004})
+        return
+
+    if not _origin_allowed(scope):
+        # Another site's page would otherwise read the feed with the visitor's cookie
+        await send({"type": "websocket.close", "code": 4003})
+        return
+
+    user_type = await sync_to_async(_user_type_for_scope)(scope)
+    groups = GROUPS_BY_USER_TYPE.get(user_type)
+    if not groups:
+        # Only drivers and managers take part in bidding
+        await send({"type": "websocket.close", "code": 4003})
+        return
+
+    await send({"type": "websocket.accept"})
+    await run_socket(receive, send, groups)
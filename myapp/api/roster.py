@@ -0,0 +1,34 @@
+"""
+Employee roster read model for the manager screens.
+
+Each roster is one query: usernames come in through select_related and the
+delivered / active / total order counts are conditional aggregates, so the
+query count does not grow with the number of staff.
+"""
+from django.db.models import Count, Q
+
+from .delivery_assignment import ACTIVE_STATUSES
+from .models import Chef, DeliveryPerson
+
+
+def delivery_roster():
+    """Delivery persons annotated with delivered_count, active_count and total_count."""
+    return DeliveryPerson.objects.select_related('user_profile__user').annotate(
+        delivered_count=Count('deliveries', filter=Q(deliveries__status="delivered")),
+        active_count=Count('deliveries', filter=Q(deliveries__status__in=ACTIVE_STATUSES)),
+        total_count=Count('deliveries'),
+    ).order_by('id')
+
+
+def chef_roster():
+    """
+    Chefs annotated with menu_items_count and the delivered / active / total
+    number of orders containing their dishes.
+    """
+    orders = 'menu_items__orderitem__order'
+    return Chef.objects.select_related('user_profile__user').annotate(
+        menu_items_count=Count('menu_items', distinct=True),
+        delivered_count=Count(orders, distinct=True, filter=Q(**{f"{orders}__status": "delivered"})),
+        active_count=Count(orders, distinct=True, filter=Q(**{f"{orders}__status__in": ACTIVE_STATUSES})),
+        total_count=Count(orders, distinct=True),
+    ).order_by('id')
@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from .models import MenuItem, DiscussionTopic, DiscussionPost, Order, OrderItem, FoodRating, DeliveryBid, DeliveryAssignment, DeliveryRating, Complaint, Compliment, UserProfile, CustomerProfile, Chef, DeliveryPerson, RegistrationRequest
 
@@ -86,6 +88,12 @@ class OrderWithBidsSerializer(serializers.ModelSerializer):
     #     return obj.delivery_person.userprofile.average_rating
 
 
+class BidBoardOrderSerializer(OrderWithBidsSerializer):
+    """Manager bid board row. Expects the annotated/prefetched queryset from get_delivery_bids."""
+    lowest_bid = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    bid_count = serializers.IntegerField(read_only=True)
+
+
 class ComplaintSerializer(serializers.ModelSerializer):
     complainant = serializers.CharField(source='complainant.username', read_only=True)
     target = serializers.CharField(source='target_user.username', read_only=True)
@@ -97,13 +105,25 @@ class ComplaintSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'complainant', 'target', 'target_type', 'description',
             'status', 'dispute_text', 'manager_decision', 'weight',
-            'is_vip', 'created_at'
+            'is_vip', 'created_at', 'duplicate_of'
         ]
 
     def get_is_vip(self, obj):
         return obj.weight == 2
 
 
+class ComplaintClusterSerializer(ComplaintSerializer):
+    """Root complaint of a near-duplicate cluster"""
+    duplicate_count = serializers.IntegerField(read_only=True)
+    duplicate_ids = serializers.SerializerMethodField()
+
+    class Meta(ComplaintSerializer.Meta):
+        fields = ComplaintSerializer.Meta.fields + ['duplicate_count', 'duplicate_ids']
+
+    def get_duplicate_ids(self, obj):
+        return [c.id for c in obj.duplicates.all()]
+
+
 class ComplimentSerializer(serializers.ModelSerializer):
     author = serializers.CharField(source='author.username', read_only=True)
     target = serializers.CharField(source='target_user.username', read_only=True)
@@ -205,14 +225,21 @@ class ChefListSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source="user_profile.user.username")
     email = serializers.EmailField(source="user_profile.user.email")
     menu_items_count = serializers.SerializerMethodField()
+    delivered_count = serializers.IntegerField(read_only=True, default=None)
+    active_count = serializers.IntegerField(read_only=True, default=None)
+    total_count = serializers.IntegerField(read_only=True, default=None)
 
     class Meta:
         model = Chef
         fields = ["id", "username", "email", "salary", "average_rating",
                   "complaint_count", "compliment_count", "demotion_count",
-                  "hired_at", "menu_items_count", "eligible_for_bonus"]
+                  "hired_at", "menu_items_count", "eligible_for_bonus",
+                  "delivered_count", "active_count", "total_count"]
 
     def get_menu_items_count(self, obj):
+        # Annotated by roster.chef_roster(); fall back to a query otherwise
+        if hasattr(obj, "menu_items_count"):
+            return obj.menu_items_count
         return obj.menu_items.count()
 
 
@@ -220,14 +247,20 @@ class DeliveryPersonListSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source="user_profile.user.username")
     email = serializers.EmailField(source="user_profile.user.email")
     deliveries_count = serializers.SerializerMethodField()
+    delivered_count = serializers.IntegerField(read_only=True, default=None)
+    active_count = serializers.IntegerField(read_only=True, default=None)
 
     class Meta:
         model = DeliveryPerson
         fields = ["id", "username", "email", "salary", "average_rating",
                   "complaint_count", "compliment_count", "demotion_count",
-                  "hired_at", "deliveries_count", "eligible_for_bonus"]
+                  "hired_at", "deliveries_count", "eligible_for_bonus",
+                  "delivered_count", "active_count"]
 
     def get_deliveries_count(self, obj):
+        # Annotated by roster.delivery_roster(); fall back to a query otherwise
+        if hasattr(obj, "total_count"):
+            return obj.total_count
         return obj.deliveries.count()
 
 
@@ -303,6 +336,11 @@ class AvailableOrderSerializer(serializers.ModelSerializer):
         return ", ".join([f"{item.quantity}x {item.menu_item.name}" for item in obj.items.all()])
 
     def get_my_bid(self, obj):
+        # get_available_orders annotates the driver's bid; fall back to a query otherwise
+        if hasattr(obj, "my_bid_id"):
+            if not obj.my_bid_id:
+                return None
+            return {"id": obj.my_bid_id, "amount": str(Decimal(obj.my_bid_amount).quantize(Decimal("0.01")))}
         delivery_person = self.context.get('delivery_person')
         if delivery_person:
             bid = obj.bids.filter(delivery_person=delivery_person).first()
@@ -0,0 +1,148 @@
+"""
+Single-flight coalescing of identical LLM generations for chat_with_ai.
+
+When many people ask the same question at once, only the first request
+(the leader) calls the model and stores a KnowledgeBaseEntry; identical
+requests arriving while it runs wait for it and share its answer and
+entry_id. Requests are keyed by the normalized question (llm_cache's
+normalize_question), and only questions asked without conversation history
+are coalesced, since only those produce the same prompt.
+
+Within a process, waiting is done on a threading.Event. With
+CHAT_SINGLE_FLIGHT_SHARED = True the leader also takes a lock in the Django
+cache (cache.add) and publishes its result there for RESULT_TTL seconds, so
+leaders in other processes poll for that result instead of generating their
+own. This needs a shared cache backend (e.g. Redis or Memcached).
+
+If a leader fails with an LLMGatewayError its waiters get the same error;
+if it goes away without a result (e.g. a streaming client disconnected)
+they run the generation themselves.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .llm_cache import normalize_question
+from .llm_gateway import LLMGatewayError
+
+SHARED = getattr(settings, "CHAT_SINGLE_FLIGHT_SHARED", False)
+WAIT_TIMEOUT = getattr(settings, "LLM_TIMEOUT", 120) + getattr(settings, "LLM_QUEUE_TIMEOUT", 10)
+RESULT_TTL = 30  # seconds a shared result stays readable by other processes
+POLL_INTERVAL = 0.1
+
+
+class LeaderGone(Exception):
+    """The leader finished without a result or an LLM error to share."""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+def flight_key(question):
+    return hashlib.sha1(normalize_question(question).encode()).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self, shared=SHARED, wait_timeout=WAIT_TIMEOUT):
+        self.shared = shared
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "followers": 0, "remote_results": 0, "leader_failures": 0}
+
+    # ---------- in-process ----------
+
+    def join(self, key):
+        """(call, is_leader). The leader must call finish(); others wait()."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.stats["followers"] += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.stats["leaders"] += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        if result is None:
+            self.stats["leader_failures"] += 1
+            # Only model errors are shared; anything else and waiters retry themselves
+            error = error if isinstance(error, LLMGatewayError) else LeaderGone()
+        call.result, call.error = result, error
+        call.done.set()
+
+    def wait(self, call):
+        """The leader's result. Raises its LLMGatewayError, or LeaderGone."""
+        if not call.done.wait(self.wait_timeout):
+            raise LeaderGone()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    # ---------- entry point ----------
+
+    def do(self, key, generate):
+        """
+        Run generate() once per key at a time and share its (picklable) result.
+        Returns (result, shared): shared is False only for the request that generated it.
+        """
+        call, leader = self.join(key)
+        if not leader:
+            try:
+                return self.wait(call), True
+            except LeaderGone:
+                return generate(), False
+
+        result = None
+        try:
+            result, shared = self._lead(key, generate)
+            return result, shared
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        finally:
+            if result is not None:
+                self.finish(key, call, result=result)
+
+    def _lead(self, key, generate):
+        if not self.shared:
+            return generate(), False
+
+        # Cross-process: whoever holds the cache lock generates, the others poll for its result
+        lock_key, result_key = f"single_flight:lock:{key}", f"single_flight:result:{key}"
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            result = cache.get(result_key)
+            if result is not None:
+                self.stats["remote_results"] += 1
+                return result, True
+            if cache.add(lock_key, 1, timeout=self.wait_timeout):
+                try:
+                    result = generate()
+                    cache.set(result_key, result, timeout=RESULT_TTL)
+                    return result, False
+                finally:
+                    cache.delete(lock_key)
+            if time.monotonic() > deadline:
+                return generate(), False
+            time.sleep(POLL_INTERVAL)
+
+    def metrics(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {**self.stats, "in_flight": in_flight, "shared_mode": self.shared}
+
+
+llm_flight = SingleFlight()
@@ -1,3 +1,1556 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import ProtectedError
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from . import chat_memory, content_versions, discussion_summaries, kb_search, kb_vectors, ledger, llm_cache, llm_gateway
+from .complaint_dedup import find_duplicate, index_complaint, minhash_signature
+from .delivery_assignment import BidCandidate, close_expired_bid_windows, run_assignment_sweep, solve_assignment
+from .discussion_summaries import refresh_stale_summaries
+from .kb_search import BM25Index
+from . import geocoding
+from .geocoding import build_delivery_batches, normalize_address
+from .kb_retention import merge_duplicates, purge_expired
+from .fake_ollama import FakeOllamaConfig, start_in_background
+from .llm_gateway import CircuitOpen, GatewayBusy, GatewayTimeout, LLMCallFailed, LLMGateway, gateway, user_key_for
+from .models import (
+    UserProfile, MenuItem, Order, OrderItem, DeliveryBid, DeliveryAssignment, DiscussionTopic, DiscussionPost, KnowledgeBaseEntry,
+    KnowledgeBaseRating, Chef, Complaint, CustomerProfile, LedgerEntry, LedgerSnapshot, Transaction, DeliveryBatch,
+)
+from .prompt_context import build_chat_prompt, estimate_tokens
+from .realtime import InMemoryChannelLayer, _user_type_for_scope, run_socket, websocket_application
+from .single_flight import SingleFlight
+
+
+_vector_dir = None
+
+
+def setUpModule():
+    # Chat tests in "auto" mode build the semantic index; keep it out of the real KB_VECTOR_DIR
+    global _vector_dir
+    scratch = tempfile.TemporaryDirectory()
+    _vector_dir = (scratch, override_settings(KB_VECTOR_DIR=scratch.name))
+    _vector_dir[1].enable()
+    kb_vectors._state.clear()
+
+
+def tearDownModule():
+    scratch, settings_override = _vector_dir
+    settings_override.disable()
+    kb_vectors._state.clear()
+    scratch.cleanup()
+
+
+def make_user(username, user_type):
+    user = User.objects.create_user(username=username, password="pass1234")
+    UserProfile.objects.create(user=user, user_type=user_type)
+    return user
+
+
+class BidBoardTests(TestCase):
+    def setUp(self):
+        self.manager = make_user("manager", "manager")
+        self.customer = make_user("customer", "registered").userprofile.customerprofile
+        self.drivers = [make_user(f"driver{i}", "delivery").userprofile.deliveryperson for i in range(3)]
+        chef = make_user("chef", "chef").userprofile.chef
+        self.dish = MenuItem.objects.create(name="Lamb Kabsa", price=Decimal("15.99"), chef=chef)
+        self.client.force_login(self.manager)
+
+    def add_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(customer=self.customer, total_price=Decimal("20.00"))
+            OrderItem.objects.create(order=order, menu_item=self.dish, quantity=1, price_at_time=self.dish.price)
+            for i, driver in enumerate(self.drivers):
+                DeliveryBid.objects.create(order=order, delivery_person=driver, bid_amount=Decimal(5 + i))
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/bids/")
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_query_count_constant_as_orders_grow(self):
+        self.add_orders(2)
+        small, _ = self.count_queries()
+
+        self.add_orders(10)
+        large, data = self.count_queries()
+
+        self.assertEqual(small, large)
+        self.assertEqual(data["count"], 12)
+
+    def test_lowest_bid_and_count_annotated(self):
+        self.add_orders(1)
+        _, data = self.count_queries()
+
+        order = data["orders"][0]
+        self.assertEqual(order["bid_count"], 3)
+        self.assertEqual(order["lowest_bid"], "5.00")
+        self.assertEqual(order["customer_name"], "customer")
+        self.assertEqual(len(order["bids"]), 3)
+
+    def test_pagination(self):
+        self.add_orders(5)
+        response = self.client.get("/api/bids/", {"page": 2, "page_size": 2})
+        data = response.json()
+        self.assertEqual(data["page"], 2)
+        self.assertEqual(data["total_pages"], 3)
+        self.assertEqual(len(data["orders"]), 2)
+
+    def test_whole_board_without_page(self):
+        self.add_orders(55)
+        _, data = self.count_queries()
+        self.assertEqual(len(data["orders"]), 55)
+        self.assertEqual(data["total_pages"], 1)
+
+
+class AvailableOrdersFeedTests(TestCase):
+    def setUp(self):
+        self.customer = make_user("customer", "registered").userprofile.customerprofile
+        self.driver_user = make_user("driver", "delivery")
+        self.driver = self.driver_user.userprofile.deliveryperson
+        self.other_driver = make_user("other", "delivery").userprofile.deliveryperson
+        chef = make_user("chef", "chef").userprofile.chef
+        self.dish = MenuItem.objects.create(name="Maqluba", price=Decimal("14.99"), chef=chef)
+        self.client.force_login(self.driver_user)
+
+    def add_order(self):
+        order = Order.objects.create(customer=self.customer, total_price=Decimal("20.00"))
+        OrderItem.objects.create(order=order, menu_item=self.dish, quantity=2, price_at_time=self.dish.price)
+        DeliveryBid.objects.create(order=order, delivery_person=self.other_driver, bid_amount=Decimal("4.00"))
+        return order
+
+    def test_my_bid_and_items_without_per_order_queries(self):
+        first = self.add_order()
+        DeliveryBid.objects.create(order=first, delivery_person=self.driver, bid_amount=Decimal("6.50"))
+        with CaptureQueriesContext(connection) as small:
+            self.client.get("/api/delivery/available/")
+        for _ in range(5):
+            self.add_order()
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get("/api/delivery/available/")
+
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        orders = {o["id"]: o for o in response.json()["orders"]}
+        self.assertEqual(orders[first.id]["my_bid"]["amount"], "6.50")
+        self.assertEqual(orders[first.id]["items_summary"], "2x Maqluba")
+        self.assertEqual(len([o for o in orders.values() if o["my_bid"]]), 1)
+
+    def test_since_returns_only_changed_and_removed_orders(self):
+        old = self.add_order()
+        taken = self.add_order()
+        server_time = self.client.get("/api/delivery/available/").json()["server_time"]
+
+        new = self.add_order()
+        taken.delivery_person = self.other_driver
+        taken.status = "preparing"
+        taken.save()
+
+        data = self.client.get("/api/delivery/available/", {"since": server_time}).json()
+        self.assertEqual([o["id"] for o in data["orders"]], [new.id])
+        self.assertEqual(data["removed_ids"], [taken.id])
+        self.assertNotIn(old.id, [o["id"] for o in data["orders"]])
+
+
+class RealtimeTests(TestCase):
+    def scope_for(self, user=None, path="/ws/bidding/", origin="http://localhost:3000"):
+        headers = [(b"origin", origin.encode())] if origin else []
+        if user is not None:
+            self.client.force_login(user)
+            cookie = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+            headers.append((b"cookie", f"{settings.SESSION_COOKIE_NAME}={cookie}".encode()))
+        return {"type": "websocket", "path": path, "headers": headers}
+
+    def connect(self, scope):
+        """Run websocket_application for a client that connects and then leaves."""
+        events = [{"type": "websocket.connect"}, {"type": "websocket.disconnect"}]
+        sent = []
+
+        async def receive():
+            return events.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        async_to_sync(websocket_application)(scope, receive, send)
+        return sent
+
+    def test_run_socket_delivers_group_events_and_answers_ping(self):
+        layer = InMemoryChannelLayer()
+
+        async def scenario():
+            incoming = asyncio.Queue()
+            sent = []
+
+            async def send(message):
+                sent.append(json.loads(message["text"]))
+
+            socket = asyncio.ensure_future(run_socket(incoming.get, send, ["drivers"], layer))
+            await asyncio.sleep(0)
+            subscribed = layer.group_size("drivers")
+            layer.group_send("drivers", {"type": "bid.created", "data": {"order_id": 1}})
+            layer.group_send("managers", {"type": "order.assigned", "data": {}})
+            await incoming.put({"type": "websocket.receive", "text": json.dumps({"action": "ping"})})
+            await incoming.put({"type": "websocket.receive", "text": "not json"})
+            await asyncio.sleep(0.05)
+            await incoming.put({"type": "websocket.disconnect"})
+            await socket
+            return subscribed, sent
+
+        subscribed, sent = async_to_sync(scenario)()
+        self.assertEqual(subscribed, 1)
+        self.assertEqual(sorted(message["type"] for message in sent), ["bid.created", "pong"])
+        self.assertEqual(layer.group_size("drivers"), 0)
+
+    def test_user_type_from_session_cookie(self):
+        driver = make_user("driver", "delivery")
+        self.assertEqual(_user_type_for_scope(self.scope_for(driver)), "delivery")
+        self.assertIsNone(_user_type_for_scope(self.scope_for()))
+        self.assertIsNone(_user_type_for_scope({"headers": [(b"cookie", f"{settings.SESSION_COOKIE_NAME}=bogus".encode())]}))
+
+    def test_only_drivers_and_managers_are_accepted(self):
+        customer = make_user("customer", "registered")
+        self.assertEqual(self.connect(self.scope_for(customer)), [{"type": "websocket.close", "code": 4003}])
+        self.assertEqual(self.connect(self.scope_for()), [{"type": "websocket.close", "code": 4003}])
+
+        manager = make_user("manager", "manager")
+        self.assertEqual(self.connect(self.scope_for(manager, path="/ws/other/")), [{"type": "websocket.close", "code": 4004}])
+        self.assertEqual(self.connect(self.scope_for(manager)), [{"type": "websocket.accept"}])
+
+    def test_sockets_from_other_sites_are_refused(self):
+        manager = make_user("manager", "manager")
+        refused = [{"type": "websocket.close", "code": 4003}]
+        with override_settings(ALLOWED_HOSTS=["eats.example.com"]):
+            self.assertEqual(self.connect(self.scope_for(manager, origin="https://evil.example")), refused)
+            self.assertEqual(self.connect(self.scope_for(manager, origin=None)), refused)
+            self.assertEqual(self.connect(self.scope_for(manager)), [{"type": "websocket.accept"}])  # Trusted origin
+            self.assertEqual(
+                self.connect(self.scope_for(manager, origin="https://eats.example.com")), [{"type": "websocket.accept"}]
+            )
+            self.assertEqual(self.connect(self.scope_for(manager, origin="https://eats.example.com.evil.example")), refused)
+
+
+class AssignmentSolverTests(SimpleTestCase):
+    def solve(self, bids, loads=None, max_load=3):
+        candidates = [BidCandidate(i, order, driver, Decimal(amount), rating)
+                      for i, (order, driver, amount, rating) in enumerate(bids, start=1)]
+        decisions = solve_assignment(candidates, loads or {}, max_load=max_load)
+        return {d.bid.order_id: d for d in decisions}
+
+    def test_rating_outweighs_a_small_premium(self):
+        decisions = self.solve([(1, "cheap", "5.00", 1.0), (1, "good", "5.50", 5.0)])
+        self.assertEqual(decisions[1].bid.delivery_person_id, "good")
+        self.assertEqual(decisions[1].lowest_bid.delivery_person_id, "cheap")
+
+    def test_equal_bids_go_to_the_earliest_then_spread_by_load(self):
+        decisions = self.solve([(1, "a", "5.00", 5.0), (1, "b", "5.00", 5.0), (2, "a", "5.00", 5.0), (2, "b", "5.00", 5.0)])
+        self.assertEqual(decisions[1].bid.bid_id, 1)  # Tie on cost: lowest bid id
+        self.assertEqual(decisions[2].bid.delivery_person_id, "b")  # "a" now carries one more order
+
+    def test_load_cap(self):
+        decisions = self.solve([(1, "a", "5.00", 5.0), (2, "a", "5.00", 5.0), (2, "b", "9.00", 5.0)], max_load=1)
+        self.assertEqual(decisions[1].bid.delivery_person_id, "a")
+        self.assertEqual(decisions[2].bid.delivery_person_id, "b")
+        self.assertTrue(decisions[2].lowest_bidder_full)
+
+        decisions = self.solve([(1, "a", "5.00", 5.0)], loads={"a": 1}, max_load=1)
+        self.assertEqual(decisions, {})  # Already full before the sweep
+
+
+class AssignmentSweepTests(TestCase):
+    def setUp(self):
+        self.customer = make_user("customer", "registered").userprofile.customerprofile
+        self.drivers = [make_user(f"driver{i}", "delivery").userprofile.deliveryperson for i in range(2)]
+
+    def add_order(self, *amounts, age_minutes=0):
+        order = Order.objects.create(customer=self.customer, total_price=Decimal("20.00"))
+        if age_minutes:
+            Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(minutes=age_minutes))
+        for driver, amount in zip(self.drivers, amounts):
+            DeliveryBid.objects.create(order=order, delivery_person=driver, bid_amount=Decimal(amount))
+        return order
+
+    def test_sweep_assigns_every_order_with_bids(self):
+        first, second = self.add_order("5.00", "6.00"), self.add_order("7.00", "6.00")
+        unbid = self.add_order()
+
+        self.assertEqual(run_assignment_sweep(dry_run=True)["assigned"], 0)
+        self.assertFalse(DeliveryAssignment.objects.exists())
+
+        summary = run_assignment_sweep()
+        self.assertEqual(summary["assigned"], 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.delivery_person, first.status, first.delivery_bid_price),
+                         (self.drivers[0], "preparing", Decimal("5.00")))
+        self.assertEqual(second.delivery_person, self.drivers[1])
+        self.assertEqual(second.assignment.winning_bid.bid_amount, Decimal("6.00"))
+        self.assertEqual(Order.objects.get(id=unbid.id).status, "pending")
+        self.assertEqual(run_assignment_sweep()["assigned"], 0)  # Nothing left to assign
+
+    def test_expired_bid_windows_close_to_the_lowest_bid(self):
+        expired = [self.add_order("6.00", "5.00", age_minutes=20), self.add_order("4.00", "8.00", age_minutes=30)]
+        expired_unbid = self.add_order(age_minutes=20)
+        fresh = self.add_order("3.00", "3.00", age_minutes=5)
+
+        self.assertEqual(close_expired_bid_windows(window_minutes=15, batch_size=1), 2)  # Two batches
+        winners = {o.id: (o.delivery_person, o.delivery_bid_price) for o in Order.objects.filter(id__in=[e.id for e in expired])}
+        self.assertEqual(winners, {
+            expired[0].id: (self.drivers[1], Decimal("5.00")),
+            expired[1].id: (self.drivers[0], Decimal("4.00")),
+        })
+        self.assertIn("Bid window closed", DeliveryAssignment.objects.get(order=expired[0]).justification_memo)
+        self.assertEqual(Order.objects.get(id=expired_unbid.id).status, "pending")  # Left for the manager
+        self.assertEqual(Order.objects.get(id=fresh.id).status, "pending")
+        self.assertEqual(close_expired_bid_windows(window_minutes=15), 0)
+
+
+class GeocodingTests(SimpleTestCase):
+    def test_units_dropped_and_abbreviations_expanded(self):
+        self.assertEqual(normalize_address("45 Stewart Ave. Apt 3"), "45 stewart avenue")
+        self.assertEqual(normalize_address("12 W 5th St, Suite 200"), "12 west 5 street")
+        self.assertEqual(normalize_address("7 Main St #4B"), "7 main street")
+        self.assertEqual(normalize_address("7 Main St Fl. 2"), "7 main street")
+
+    def test_street_names_that_start_like_unit_words_are_kept(self):
+        self.assertEqual(normalize_address("123 Flatbush Ave"), "123 flatbush avenue")
+        self.assertEqual(normalize_address("45 Stewart Avenue Apt 3"), "45 stewart avenue")
+        self.assertEqual(normalize_address("9 Sterling Pl"), "9 sterling place")
+        self.assertEqual(normalize_address("3 Roomy Ln"), "3 roomy lane")
+
+
+class DeliveryBatchTests(TestCase):
+    GAZETTEER = "address,lat,lng\n10 Flatbush Ave,40.6900,-73.9800\n12 Flatbush Ave,40.6901,-73.9801\nSterling Pl,40.6750,-73.9700\n"
+
+    def setUp(self):
+        gazetteer = tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False)
+        gazetteer.write(self.GAZETTEER)
+        gazetteer.close()
+        self.addCleanup(os.unlink, gazetteer.name)
+        patcher = mock.patch.object(geocoding, "GAZETTEER_PATH", gazetteer.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        geocoding.load_gazetteer.cache_clear()
+        self.addCleanup(geocoding.load_gazetteer.cache_clear)
+
+        self.customer = make_user("customer", "registered").userprofile.customerprofile
+        self.driver_user = make_user("driver", "delivery")
+        self.driver = self.driver_user.userprofile.deliveryperson
+
+    def add_order(self, address, status="pending"):
+        return Order.objects.create(
+            customer=self.customer, delivery_address=address, total_price=Decimal("20.00"), status=status
+        )
+
+    def test_nearby_orders_batched_and_lone_orders_left_alone(self):
+        first = self.add_order("10 Flatbush Ave, Apt 2")
+        second = self.add_order("12 Flatbush Avenue", status="ready")
+        lone = self.add_order("9 Sterling Pl")  # Resolved by its street
+
+        self.assertEqual(build_delivery_batches(), 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        lone.refresh_from_db()
+        self.assertIsNotNone(first.delivery_batch_id)
+        self.assertEqual(first.delivery_batch_id, second.delivery_batch_id)
+        self.assertIsNone(lone.delivery_batch_id)
+        self.assertEqual(lone.geocode.source, "street")
+
+        # A later order in the same cell and window joins the open batch
+        third = self.add_order("10 Flatbush Ave Unit 5")
+        self.assertEqual(build_delivery_batches(), 1)
+        third.refresh_from_db()
+        self.assertEqual(third.delivery_batch_id, first.delivery_batch_id)
+
+    def test_batch_bid_covers_every_listed_order(self):
+        self.add_order("10 Flatbush Ave")
+        self.add_order("12 Flatbush Ave", status="preparing")
+        build_delivery_batches()
+        self.client.force_login(self.driver_user)
+
+        listed = self.client.get("/api/delivery/batches/").json()["batches"][0]
+        response = self.client.post("/api/delivery/batches/bid/", {"batch_id": listed["batch_id"], "bid_amount": "9.00"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            sorted(b["order_id"] for b in response.json()["bids"]),
+            sorted(o["order_id"] for o in listed["orders"]),
+        )
+        self.assertEqual(sum(Decimal(b["bid_amount"]) for b in response.json()["bids"]), Decimal("9.00"))
+
+    def test_batches_close_once_their_orders_are_assigned(self):
+        orders = [self.add_order("10 Flatbush Ave"), self.add_order("12 Flatbush Ave")]
+        build_delivery_batches()
+        batch = DeliveryBatch.objects.get()
+        Order.objects.filter(id__in=[o.id for o in orders]).update(delivery_person=self.driver, status="preparing")
+
+        build_delivery_batches()
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, "closed")
+        self.client.force_login(self.driver_user)
+        response = self.client.post("/api/delivery/batches/bid/", {"batch_id": batch.id, "bid_amount": "9.00"})
+        self.assertEqual(response.status_code, 404)
+
+
+class RosterTests(TestCase):
+    def setUp(self):
+        self.manager = make_user("manager", "manager")
+        self.customer = make_user("customer", "registered").userprofile.customerprofile
+        self.client.force_login(self.manager)
+        self.staff = 0
+
+    def add_staff(self, count):
+        for _ in range(count):
+            self.staff += 1
+            chef = make_user(f"chef{self.staff}", "chef").userprofile.chef
+            driver = make_user(f"driver{self.staff}", "delivery").userprofile.deliveryperson
+            dish = MenuItem.objects.create(name=f"Dish {self.staff}", price=Decimal("10.00"), chef=chef)
+            for status in ["delivered", "delivered", "delivering"]:
+                order = Order.objects.create(
+                    customer=self.customer, total_price=Decimal("10.00"), status=status, delivery_person=driver
+                )
+                OrderItem.objects.create(order=order, menu_item=dish, quantity=2, price_at_time=dish.price)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_query_count_constant_as_staff_grows(self):
+        for url in ["/api/manager/delivery-persons/", "/api/hr/employees/"]:
+            self.add_staff(1)
+            small, _ = self.count_queries(url)
+            self.add_staff(5)
+            large, _ = self.count_queries(url)
+            self.assertEqual(small, large, url)
+
+    def test_counts(self):
+        self.add_staff(1)
+        _, data = self.count_queries("/api/hr/employees/")
+        chef, driver = data["chefs"][0], data["delivery_persons"][0]
+        self.assertEqual((chef["menu_items_count"], chef["delivered_count"], chef["active_count"], chef["total_count"]), (1, 2, 1, 3))
+        self.assertEqual((driver["delivered_count"], driver["active_count"], driver["deliveries_count"]), (2, 1, 3))
+
+        _, data = self.count_queries("/api/manager/delivery-persons/")
+        self.assertEqual(data["delivery_persons"][0]["total_deliveries"], 2)
+        self.assertEqual(data["delivery_persons"][0]["active_deliveries"], 1)
+
+
+class DiscussionSummaryTests(TestCase):
+    def setUp(self):
+        self.manager = make_user("manager", "manager")
+        self.customer = make_user("customer", "registered")
+        self.client.force_login(self.manager)
+        self.topics = [
+            DiscussionTopic.objects.create(title=f"Topic {i}", author=self.customer, topic_type="general")
+            for i in range(3)
+        ]
+        for topic in self.topics:
+            DiscussionPost.objects.create(topic=topic, author=self.customer, content="Great food")
+
+    def refresh(self):
+        reply = {"message": {"content": "People like the food."}}
+        with mock.patch.object(gateway, "chat", return_value=reply) as chat:
+            refreshed, failed = refresh_stale_summaries(workers=1)
+        self.assertEqual(failed, [])
+        self.assertEqual(refreshed, chat.call_count)
+        return refreshed
+
+    def test_only_changed_topics_are_resummarized(self):
+        self.assertEqual(self.refresh(), 3)
+        self.assertEqual(self.refresh(), 0)
+
+        DiscussionPost.objects.create(topic=self.topics[1], author=self.customer, content="Too salty")
+        self.assertEqual(self.refresh(), 1)
+
+        self.topics[2].posts.all().delete()
+        self.assertEqual(self.refresh(), 0)
+        self.assertFalse(hasattr(DiscussionTopic.objects.get(id=self.topics[2].id), "summary"))
+
+    def test_new_posts_queue_one_background_refresh_per_topic(self):
+        topic = self.topics[0]
+        with mock.patch.object(discussion_summaries._pool, "submit") as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                DiscussionPost.objects.create(topic=topic, author=self.customer, content="Too salty")
+                DiscussionPost.objects.create(topic=topic, author=self.customer, content="Agreed")
+            submit.assert_called_once_with(discussion_summaries._refresh_queued, topic.id)
+
+            reply = {"message": {"content": "Mixed feelings about the salt."}}
+            with mock.patch.object(gateway, "chat", return_value=reply), \
+                    mock.patch.object(discussion_summaries.connections, "close_all"):
+                discussion_summaries._refresh_queued(topic.id)  # What the worker thread runs
+            self.assertEqual(topic.summary.summary, "Mixed feelings about the salt.")
+            self.assertEqual(topic.summary.post_count, 3)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                topic.posts.first().delete()
+            self.assertEqual(submit.call_count, 2)  # Queued again once the first run started
+
+    def test_endpoint_is_a_single_read(self):
+        self.refresh()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/discussion_summary/")
+        self.assertEqual(response.status_code, 200)
+        summaries = response.json()["ai_summaries"]
+        self.assertEqual([s["topic_title"] for s in summaries], ["Topic 2", "Topic 1", "Topic 0"])
+        self.assertEqual(summaries[0]["post_count"], 1)
+        # Session, user and profile lookups, then the summaries themselves
+        self.assertEqual(sum("api_discussionsummary" in q["sql"] for q in ctx.captured_queries), 1)
+
+
+class PromptContextTests(TestCase):
+    def setUp(self):
+        employee = make_user("employee", "chef")
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(20):
+                KnowledgeBaseEntry.objects.create(
+                    author=employee, author_type="employee",
+                    question=f"Question {i} about catering", answer="We cater events of any size. " * 5,
+                )
+            self.refund = KnowledgeBaseEntry.objects.create(
+                author=employee, author_type="employee",
+                question="How do refunds work?", answer="Refunds go back to your deposit balance.",
+            )
+            MenuItem.objects.create(name="Lamb Kabsa", price=Decimal("15.99"), chef=employee.userprofile.chef,
+                                    description="Rice with tender lamb")
+
+    def test_only_relevant_entries_are_included(self):
+        prompt = build_chat_prompt("how do refunds work for my kabsa")
+        self.assertEqual(prompt.kb_ids, [self.refund.id])
+        self.assertEqual(len(prompt.menu_ids), 1)
+        self.assertIn("Refunds go back", prompt.text)
+        self.assertNotIn("catering", prompt.text)
+
+    def test_context_fits_the_budget(self):
+        prompt = build_chat_prompt("do you do catering", budget=100)
+        self.assertLessEqual(prompt.context_tokens, 100)
+        self.assertGreater(prompt.dropped, 0)
+        self.assertEqual(prompt.tokens, estimate_tokens(prompt.text))
+
+
+class ChatMemoryTests(TestCase):
+    def setUp(self):
+        self.key = chat_memory.session_key(None, "test-session-1")
+
+    def tearDown(self):
+        chat_memory.clear(self.key)
+
+    def ask(self, message, answer, mode="auto"):
+        reply = {"message": {"content": answer}}
+        with mock.patch.object(gateway, "chat", return_value=reply) as chat:
+            response = self.client.post(
+                "/api/chat/", {"message": message, "session_id": "test-session-1", "mode": mode},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        return chat.call_args.args[0]
+
+    def test_follow_up_sees_earlier_turns(self):
+        first = self.ask("Do you deliver to zorbleton street?", "Yes, we deliver there.")
+        self.assertEqual([m["role"] for m in first], ["system", "user"])
+
+        follow_up = self.ask("How long does that take?", "About 30 minutes.")
+        self.assertEqual([m["role"] for m in follow_up], ["system", "user", "assistant", "user"])
+        self.assertEqual(follow_up[1]["content"], "Do you deliver to zorbleton street?")
+
+    def test_follow_up_skips_cached_answers_and_weak_kb_matches(self):
+        kb_search._index = None
+        KnowledgeBaseEntry.objects.create(
+            author_type="employee", question="Delivery hours on weekends", answer="10am to 11pm"
+        )
+        cached = KnowledgeBaseEntry.objects.create(author_type="customer", question="How long does that take?", answer="A day")
+        llm_cache.answer_cache.put("How long does that take?", "A day", cached.id)
+        self.addCleanup(llm_cache.answer_cache.discard, cached.id)
+
+        self.ask("Can I order catering for zorbleton street?", "Yes, with a day's notice.", "keyword")
+        # Would be served from the cache or the weekend entry without the earlier turns
+        self.assertEqual(self.ask("How long does that take?", "Two hours.", "keyword")[-1]["content"], "How long does that take?")
+        self.assertEqual(self.ask("And on weekends?", "Same.", "keyword")[-1]["content"], "And on weekends?")
+
+        reply = self.client.post("/api/chat/", {
+            "message": "What are the delivery hours on weekends?", "session_id": "test-session-1", "mode": "keyword",
+        }, content_type="application/json").json()
+        self.assertEqual(reply["source"], "knowledge_base")
+
+    def test_memory_is_bounded(self):
+        for i in range(50):
+            chat_memory.append(self.key, f"question {i} " + "x" * 5000, "answer")
+        turns = chat_memory.get_turns(self.key)
+        self.assertEqual(len(turns), chat_memory.MAX_TURNS)
+        self.assertTrue(all(len(text) <= chat_memory.MAX_CHARS for _, text in turns))
+        self.assertTrue(turns[-2][1].startswith("question 49"))
+
+        history = chat_memory.history_messages(self.key, budget=300)
+        self.assertLessEqual(sum(len(m["content"]) for m in history) // 4, 300)
+        self.assertEqual(history[0]["role"], "user")
+
+    def test_session_ids_are_validated_and_scoped(self):
+        self.assertIsNone(chat_memory.session_key(None, None))
+        self.assertIsNone(chat_memory.session_key(None, "../../etc"))
+        user = make_user("customer", "registered")
+        self.assertNotEqual(chat_memory.session_key(user, "test-session-1"), self.key)
+
+
+class LoadTestChatCommandTests(TransactionTestCase):
+    def run_command(self, **options):
+        out = StringIO()
+        with mock.patch.dict("os.environ"):  # The command points OLLAMA_HOST at its fake
+            call_command(
+                "load_test_chat", requests=8, concurrency=2, summary_share=0, kb_share=0, repeat_share=0,
+                latency=0, tokens=3, tokens_per_second=1000, mode="keyword", stdout=out, stderr=StringIO(), **options,
+            )
+        return out.getvalue()
+
+    def test_refuses_a_remote_database_unless_named(self):
+        remote = {"ENGINE": "django.db.backends.postgresql", "HOST": "db.internal", "NAME": "restaurant"}
+        with mock.patch.dict(connection.settings_dict, remote):
+            with self.assertRaises(CommandError):
+                self.run_command()
+            with self.assertRaises(CommandError):
+                self.run_command(database="other")
+
+    def test_runs_with_the_real_allowed_hosts(self):
+        # The test runner adds "testserver" to ALLOWED_HOSTS; a real run does not have it
+        for allowed, debug in ((["chat.example.com"], False), ([], True)):
+            with self.subTest(allowed=allowed), override_settings(ALLOWED_HOSTS=allowed, DEBUG=debug):
+                self.assertIn("Removed 8 KB entries", self.run_command())
+        with override_settings(ALLOWED_HOSTS=[], DEBUG=False), self.assertRaises(CommandError):
+            self.run_command()
+
+    def test_cleanup_only_removes_entries_the_run_created(self):
+        existing = KnowledgeBaseEntry.objects.create(
+            author_type="visitor", question="Real visitor question", answer="Real answer", is_generated=True
+        )
+        output = self.run_command()
+        self.assertIn("Removed 8 KB entries", output)
+        self.assertEqual(list(KnowledgeBaseEntry.objects.values_list("id", flat=True)), [existing.id])
+
+
+def start_fake_gateway(test, limits=None, **fake_options):
+    """A fresh LLMGateway talking to a fake Ollama server, both stopped when the test ends."""
+    fake = FakeOllamaConfig(**{"latency": 0.2, "tokens": 3, "tokens_per_second": 1000, "jitter": 0, **fake_options})
+    server, url = start_in_background(config=fake)
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    for name, value in (limits or {}).items():
+        patcher = mock.patch.object(llm_gateway, name, value)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+    fresh = LLMGateway()
+    with mock.patch.dict("os.environ", {"OLLAMA_HOST": url}):
+        fresh._ensure_started()
+    test.addCleanup(lambda: fresh._loop.call_soon_threadsafe(fresh._loop.stop))
+    return fresh, fake
+
+
+class LLMGatewayTests(SimpleTestCase):
+    """A fresh gateway per test against the fake Ollama server."""
+    MESSAGES = [{"role": "user", "content": "Is the kabsa spicy?"}]
+
+    def start(self, limits=None, **fake_options):
+        self.gateway, self.fake = start_fake_gateway(self, limits, **fake_options)
+        return self.gateway
+
+    def call_all(self, user_keys, stagger=0.0):
+        """Call the gateway once per user key from separate threads; returns each result or exception."""
+        def call(user_key):
+            try:
+                return self.gateway.chat(self.MESSAGES, user_key=user_key)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(len(user_keys)) as pool:
+            futures = []
+            for user_key in user_keys:
+                futures.append(pool.submit(call, user_key))
+                time.sleep(stagger)
+            return [future.result() for future in futures]
+
+    def test_per_user_limit(self):
+        self.start({"PER_USER_CONCURRENCY": 1})
+        results = self.call_all(["user:1"] * 3 + ["user:2"] * 3)
+        self.assertFalse([r for r in results if isinstance(r, Exception)])
+        self.assertEqual(self.fake.stats["max_in_flight"], 2)
+        self.assertEqual(self.gateway._user_limits, {})
+
+    def test_global_limit(self):
+        self.start({"MAX_CONCURRENCY": 2})
+        results = self.call_all([f"user:{i}" for i in range(6)])
+        self.assertFalse([r for r in results if isinstance(r, Exception)])
+        self.assertEqual(self.fake.stats["max_in_flight"], 2)
+        self.assertEqual(self.gateway.stats["succeeded"], 6)
+
+    def test_full_queue_sheds_with_busy(self):
+        self.start({"MAX_CONCURRENCY": 1, "MAX_QUEUE": 1}, latency=0.3)
+        results = self.call_all(["user:1", "user:2", "user:3"], stagger=0.05)
+        self.assertNotIsInstance(results[0], Exception)
+        self.assertNotIsInstance(results[1], Exception)  # Waited in the queue
+        self.assertIsInstance(results[2], GatewayBusy)
+        self.assertEqual(results[2].status, 429)
+        self.assertEqual(self.gateway.stats["shed"], 1)
+
+    def test_queue_wait_is_bounded(self):
+        self.start({"MAX_CONCURRENCY": 1, "QUEUE_TIMEOUT": 0.1}, latency=0.5)
+        results = self.call_all(["user:1", "user:2"], stagger=0.05)
+        self.assertNotIsInstance(results[0], Exception)
+        self.assertIsInstance(results[1], GatewayBusy)
+        self.assertEqual(self.fake.stats["requests"], 1)
+
+    def test_slow_model_times_out(self):
+        self.start(latency=0.5)
+        with mock.patch.object(llm_gateway, "TIMEOUT", 0.1):
+            with self.assertRaises(GatewayTimeout) as raised:
+                self.gateway.chat(self.MESSAGES)
+        self.assertEqual(raised.exception.status, 504)
+        self.assertEqual(self.gateway.stats["timeouts"], 1)
+        self.assertEqual(self.gateway.stats["in_flight"], 0)
+
+    def test_circuit_opens_after_failures_and_recovers(self):
+        self.start({"BREAKER_FAILURES": 2, "BREAKER_COOLDOWN": 0.3}, latency=0, error_rate=1.0)
+        for _ in range(2):
+            with self.assertRaises(LLMCallFailed):
+                self.gateway.chat(self.MESSAGES)
+        with self.assertRaises(CircuitOpen):
+            self.gateway.chat(self.MESSAGES)
+        self.assertEqual(self.fake.stats["requests"], 2)  # Failed fast without calling the model
+        self.assertEqual(self.gateway.metrics()["circuit"], "open")
+
+        self.fake.error_rate = 0.0
+        time.sleep(0.35)
+        self.assertEqual(self.gateway.chat(self.MESSAGES)["message"]["role"], "assistant")  # Trial call
+        self.assertEqual(self.gateway.metrics()["circuit"], "closed")
+
+    def test_cancelled_stream_does_not_reset_the_breaker(self):
+        self.start({"BREAKER_FAILURES": 2}, latency=0, error_rate=1.0, tokens=50, tokens_per_second=20)
+        with self.assertRaises(LLMCallFailed):
+            self.gateway.chat(self.MESSAGES)
+
+        self.fake.error_rate = 0.0
+
+        async def read_one_chunk():
+            stream = self.gateway.astream(self.MESSAGES)
+            await stream.__anext__()
+            await stream.aclose()  # As when the browser disconnects
+
+        async_to_sync(read_one_chunk)()
+        deadline = time.monotonic() + 2
+        while self.gateway.stats["cancelled"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.gateway.stats["cancelled"], 1)
+        self.assertEqual(self.gateway.stats["succeeded"], 0)
+
+        self.fake.error_rate = 1.0
+        with self.assertRaises(LLMCallFailed):
+            self.gateway.chat(self.MESSAGES)
+        self.assertEqual(self.gateway.metrics()["circuit"], "open")  # Still two failures in a row
+
+    def test_visitor_key_uses_forwarded_address_behind_trusted_proxies(self):
+        request = RequestFactory().get("/", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="6.6.6.6, 203.0.113.7")
+        self.assertEqual(user_key_for(request), "ip:10.0.0.1")
+        with mock.patch.object(llm_gateway, "TRUSTED_PROXY_COUNT", 1):
+            self.assertEqual(user_key_for(request), "ip:203.0.113.7")  # Not the client-supplied 6.6.6.6
+            self.assertEqual(user_key_for(RequestFactory().get("/", REMOTE_ADDR="10.0.0.1")), "ip:10.0.0.1")
+
+
+class ChatStreamTests(TestCase):
+    def start(self, limits=None, **fake_options):
+        self.gateway, self.fake = start_fake_gateway(self, limits, latency=0, **fake_options)
+        patcher = mock.patch("api.views.gateway", self.gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, message, **data):
+        """POST to chat/stream/; returns the response and its (event, data) pairs."""
+        async def post():
+            response = await self.async_client.post(
+                "/api/chat/stream/", {"message": message, "mode": "keyword", **data}, content_type="application/json"
+            )
+            if not response.streaming:
+                return response, []
+            body = b"".join([chunk async for chunk in response.streaming_content]).decode()
+            return response, body
+
+        response, body = async_to_sync(post)()
+        events = []
+        for frame in body.split("\n\n") if body else []:
+            if not frame:
+                continue
+            lines = dict(line.split(": ", 1) for line in frame.split("\n"))
+            events.append((lines["event"], json.loads(lines["data"])))
+        return response, events
+
+    def test_llm_answer_streams_tokens_then_done(self):
+        self.start(tokens=5)
+        response, events = self.stream("Do you cater weddings in zorbleton?")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+
+        names = [event for event, _ in events]
+        self.assertEqual(names, ["token"] * 5 + ["done"])
+        answer = "".join(data["content"] for event, data in events if event == "token")
+        entry = KnowledgeBaseEntry.objects.get(id=events[-1][1]["entry_id"])
+        self.assertEqual(entry.answer, answer)
+        self.assertEqual(answer, "(simulated answer to: Do you ")
+
+    def test_kb_answer_is_sent_whole(self):
+        self.start()
+        kb_search._index = None
+        entry = KnowledgeBaseEntry.objects.create(
+            author_type="employee", question="Do you cater weddings", answer="Yes, up to 200 guests"
+        )
+        _, events = self.stream("Do you cater weddings?")
+        self.assertEqual(events, [("answer", mock.ANY)])
+        self.assertEqual(events[0][1]["entry_id"], entry.id)
+        self.assertEqual(events[0][1]["source"], "knowledge_base")
+        self.assertEqual(self.fake.stats["requests"], 0)
+
+    def test_failure_mid_stream_is_an_error_event_and_nothing_is_saved(self):
+        self.start({"TIMEOUT": 0.3}, tokens=50, tokens_per_second=20)
+        _, events = self.stream("Do you cater weddings in zorbleton?")
+        self.assertEqual(events[0][0], "token")
+        self.assertEqual(events[-1][0], "error")
+        self.assertIn("too long", events[-1][1]["error"])
+        self.assertNotIn("done", [event for event, _ in events])
+        self.assertFalse(KnowledgeBaseEntry.objects.exists())
+
+    def test_empty_answer_is_an_error_and_not_saved(self):
+        self.start(tokens=0)
+        _, events = self.stream("Do you cater weddings in zorbleton?")
+        self.assertEqual([event for event, _ in events], ["error"])
+        self.assertFalse(KnowledgeBaseEntry.objects.exists())
+        self.assertIsNone(llm_cache.answer_cache.get("Do you cater weddings in zorbleton?"))
+
+        response = self.client.post("/api/chat/", {"message": "Do you cater weddings in zorbleton?", "mode": "keyword"})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(KnowledgeBaseEntry.objects.exists())
+
+    def test_failure_before_the_first_token_is_a_plain_error_response(self):
+        self.start(error_rate=1.0)
+        response, events = self.stream("Do you cater weddings in zorbleton?")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(events, [])
+        self.assertIn("error", json.loads(response.content))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def run_concurrently(self, flights, generate, count=10):
+        started = threading.Barrier(count)
+
+        def request(i):
+            started.wait()
+            return flights[i % len(flights)].do("key", generate)
+
+        with ThreadPoolExecutor(count) as pool:
+            return list(pool.map(request, range(count)))
+
+    def slow_generate(self, calls):
+        def generate():
+            calls.append(1)
+            threading.Event().wait(0.3)
+            return {"response": "answer", "entry_id": 7}
+        return generate
+
+    def test_identical_requests_share_one_generation(self):
+        calls = []
+        results = self.run_concurrently([SingleFlight()], self.slow_generate(calls))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({r["entry_id"] for r, _ in results}, {7})
+        self.assertEqual(sum(1 for _, shared in results if not shared), 1)
+
+    def test_shared_mode_coalesces_across_processes(self):
+        calls = []
+        # Two instances stand in for two worker processes sharing the cache
+        results = self.run_concurrently([SingleFlight(shared=True), SingleFlight(shared=True)], self.slow_generate(calls))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 10)
+
+    def test_leader_errors_are_shared(self):
+        def generate():
+            threading.Event().wait(0.2)
+            raise GatewayTimeout("too slow")
+
+        flight = SingleFlight()
+        with ThreadPoolExecutor(4) as pool:
+            futures = [pool.submit(flight.do, "key", generate) for _ in range(4)]
+        for future in futures:
+            self.assertIsInstance(future.exception(), GatewayTimeout)
+        self.assertEqual(flight.stats["leader_failures"], 1)
+
+
+class KBRetentionTests(TestCase):
+    def setUp(self):
+        self.customer = make_user("customer", "registered")
+        self.raters = [make_user(f"rater{i}", "registered") for i in range(3)]
+
+    def entry(self, question, days_old=0, ratings=(), generated=True):
+        entry = KnowledgeBaseEntry.objects.create(
+            author=self.customer, author_type="customer", question=question, answer="An answer",
+            is_generated=generated,
+        )
+        for user, rating in zip(self.raters, ratings):
+            KnowledgeBaseRating.objects.create(entry=entry, user=user, rating=rating)
+        KnowledgeBaseEntry.objects.filter(id=entry.id).update(
+            created_at=timezone.now() - timedelta(days=days_old),
+            rating_sum=sum(ratings), rating_count=len(ratings),
+        )
+        return entry
+
+    def test_purges_only_expired_unrated_or_low_rated_generated_entries(self):
+        keep = [
+            self.entry("recent", days_old=1),
+            self.entry("well rated", days_old=90, ratings=[5, 4]),
+            self.entry("curated", days_old=90, generated=False),
+        ]
+        self.entry("unrated", days_old=90)
+        self.entry("low rated", days_old=90, ratings=[1, 2])
+
+        self.assertEqual(purge_expired(ttl_days=30, min_rating=3, chunk=1), 2)
+        self.assertEqual(set(KnowledgeBaseEntry.objects.values_list("id", flat=True)), {e.id for e in keep})
+
+    def test_duplicates_merge_into_best_rated_with_their_ratings(self):
+        best = self.entry("Is the kabsa spicy?", ratings=[5])
+        other = self.entry("  is the KABSA spicy?", ratings=[3, 4])
+        KnowledgeBaseRating.objects.filter(entry=other, user=self.raters[0]).delete()
+        curated = self.entry("Is the kabsa spicy?", generated=False)
+
+        self.assertEqual(merge_duplicates(), 1)
+        self.assertFalse(KnowledgeBaseEntry.objects.filter(id=other.id).exists())
+        best.refresh_from_db()
+        self.assertEqual((best.rating_sum, best.rating_count), (9, 2))
+        self.assertEqual(best.ratings.count(), 2)
+        self.assertTrue(KnowledgeBaseEntry.objects.filter(id=curated.id).exists())
+
+
+class BM25IndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.add(1, "How long does delivery take to campus")
+        self.index.add(2, "Delivery fees for orders over twenty dollars")
+        self.index.add(3, "Vegan options on the menu")
+        self.index.add(4, "Delivery hours on weekends")
+
+    def ids(self, query, **kwargs):
+        return [entry_id for _, _, entry_id in self.index.search(kb_search.tokenize(query), **kwargs)]
+
+    def test_rare_terms_outrank_common_ones(self):
+        self.assertEqual(self.ids("delivery campus")[0], 1)
+        self.assertEqual(self.ids("vegan delivery")[0], 3)
+
+    def test_min_matches(self):
+        self.assertEqual(self.ids("delivery campus", min_matches=2), [1])
+        self.assertEqual(self.ids("vegan campus", min_matches=2), [])
+        self.assertEqual(sorted(self.ids("delivery", min_matches=1)), [1, 2, 4])
+
+    def test_readding_replaces_and_remove_drops_postings(self):
+        self.index.add(3, "Gluten free options")
+        self.assertEqual(self.ids("vegan"), [])
+        self.assertEqual(self.ids("gluten"), [3])
+
+        self.index.remove(1)
+        self.assertNotIn("campus", self.index.postings)
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.total_length, sum(self.index.doc_lengths.values()))
+
+    def test_rating_boost_breaks_ties(self):
+        self.index.add(5, "Delivery hours on holidays", average_rating=5)
+        self.assertEqual(self.ids("delivery hours", k=1), [5])
+
+    def test_pruned_search_matches_full_scoring(self):
+        words = ["kabsa", "mansaf", "falafel", "hummus", "delivery", "spicy", "vegan", "rice", "lamb", "late"]
+        index = BM25Index()
+        for entry_id in range(1, 200):
+            index.add(entry_id, " ".join(words[(entry_id * j) % len(words)] for j in range(1, 1 + entry_id % 7)),
+                      average_rating=entry_id % 6 or None)
+        query = ["lamb", "rice", "delivery", "late"]
+        full = index.search(query, k=len(index))
+        self.assertEqual(index.search(query, k=5), full[:5])
+
+
+class KBSearchIndexTests(TestCase):
+    def setUp(self):
+        kb_search._index = kb_search._index_version = None
+        kb_search.cache.delete(kb_search.KB_INDEX_VERSION_KEY)
+        self.addCleanup(setattr, kb_search, "_index", None)
+        for name in ("entry_changed", "remove_entry"):  # Vector index is covered separately
+            patcher = mock.patch.object(kb_vectors, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add(self, question, answer, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return KnowledgeBaseEntry.objects.create(author_type="employee", question=question, answer=answer, **fields)
+
+    def test_signals_update_the_index_in_place(self):
+        hours = self.add("What are your opening hours", "We open at noon")
+        index = kb_search.get_index()
+        self.assertEqual(kb_search.find_answer("opening hours today").id, hours.id)
+
+        refunds = self.add("How do refunds work", "Refunds go back to your deposit")
+        self.assertEqual(kb_search.find_answer("refunds deposit").id, refunds.id)
+
+        hours.answer = "We open at eleven on weekends"
+        with self.captureOnCommitCallbacks(execute=True):
+            hours.save()
+        self.assertEqual(kb_search.find_answer("weekends eleven").id, hours.id)
+        self.assertIsNone(kb_search.find_answer("noon"))
+
+        hours.is_removed = True
+        with self.captureOnCommitCallbacks(execute=True):
+            hours.save()
+        self.assertIsNone(kb_search.find_answer("opening hours"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            refunds.delete()
+        self.assertIsNone(kb_search.find_answer("refunds deposit"))
+        self.assertIs(kb_search.get_index(), index)
+        self.assertEqual(len(index), 0)
+
+    def test_rating_changes_the_ranking(self):
+        first = self.add("Do you deliver to campus", "Yes, every dorm")
+        second = self.add("Do you deliver to campus", "Yes, late nights")
+        self.assertEqual(kb_search.find_answer("deliver campus").id, first.id)
+
+        self.client.force_login(make_user("customer", "registered"))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/chat/rate/", {"entry_id": second.id, "rating": 5}, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(kb_search.find_answer("deliver campus").id, second.id)
+
+    def test_one_matching_keyword_is_enough_when_it_scores_high(self):
+        for i in range(30):
+            self.add(f"Order question {i}", f"Answer about your order number {i}")
+        refund = self.add("How do I get a refund", "Email us within a week")
+
+        self.assertEqual(kb_search.find_answer("refund?").id, refund.id)  # Only keyword
+        # Rare term: matching it alone is specific enough
+        self.assertEqual(kb_search.find_answer("Refund for my catering tray?").id, refund.id)
+        # A term nearly every entry has is not
+        self.assertIsNone(kb_search.find_answer("order tracking"))
+        self.assertIsNone(kb_search.find_answer("Refund for my catering tray?", strict=True))
+
+        # ...unless the entry is well rated, as in the old keyword-count rule
+        rated = self.add("Where is my order", "Check the tracker", rating_sum=5, rating_count=1)
+        self.assertEqual(kb_search.find_answer("order tracking").id, rated.id)
+        with mock.patch.object(kb_search, "SINGLE_TERM_MIN_SCORE", None):
+            self.assertIsNone(kb_search.find_answer("Refund for my catering tray?"))
+
+    def test_customer_entries_are_not_indexed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            KnowledgeBaseEntry.objects.create(author_type="customer", question="Secret menu", answer="Ask the chef")
+        self.assertIsNone(kb_search.find_answer("secret menu"))
+
+    def test_rebuilds_when_another_process_changed_the_kb(self):
+        self.add("Parking near the restaurant", "Street parking only")
+        index = kb_search.get_index()
+        kb_search.cache.incr(kb_search.KB_INDEX_VERSION_KEY)
+        self.assertIsNot(kb_search.get_index(), index)
+        self.assertIsNotNone(kb_search.find_answer("parking restaurant"))
+
+
+class KBVectorTests(TestCase):
+    DISHES = ["kabsa", "mansaf", "falafel", "hummus", "shawarma", "maqluba", "musakhan", "knafeh", "baklava", "fattoush"]
+    TOPICS = ["spicy", "vegan", "price", "portion", "delivery", "allergens", "halal", "reheating", "catering", "leftovers"]
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        settings_override = override_settings(KB_VECTOR_DIR=scratch.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        kb_vectors._state.clear()
+        self.addCleanup(kb_vectors._state.clear)
+
+        # More entries than LSA_DIM, so changes go to the existing basis instead of refitting
+        KnowledgeBaseEntry.objects.bulk_create([
+            KnowledgeBaseEntry(
+                author_type="employee",
+                question=f"Is the {dish} {topic}",
+                answer=f"Our {dish} {topic} answer, version {version}",
+            )
+            for version in range(2) for dish in self.DISHES for topic in self.TOPICS
+        ])
+        self.assertGreater(kb_vectors.rebuild(), kb_vectors.LSA_DIM)
+
+    def row_of(self, entry_id):
+        _, vectors, ids = kb_vectors._load()
+        rows = np.nonzero(ids == entry_id)[0]
+        return vectors[rows], len(ids)
+
+    def test_files_go_to_the_configured_directory(self):
+        self.assertTrue(os.path.exists(os.path.join(kb_vectors.vector_dir(), "vectors.f32")))
+        self.assertNotEqual(os.path.abspath(kb_vectors.vector_dir()), os.path.abspath(settings.BASE_DIR / "data" / "kb_vectors"))
+
+    def test_search_finds_the_closest_entry(self):
+        best = kb_vectors.search("is the mansaf halal", k=1)[0][1]
+        self.assertEqual(KnowledgeBaseEntry.objects.get(id=best).question, "Is the mansaf halal")
+
+    def test_edited_entry_is_reembedded_in_place(self):
+        entry = KnowledgeBaseEntry.objects.filter(question="Is the kabsa spicy").first()
+        _, rows_before = self.row_of(entry.id)
+
+        entry.question, entry.answer = "Is the knafeh vegan", "Our knafeh vegan answer"
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.save()
+
+        rows, rows_after = self.row_of(entry.id)
+        model = kb_vectors._load()[0]
+        self.assertEqual(rows_after, rows_before)
+        self.assertEqual(len(rows), 1)
+        np.testing.assert_allclose(rows[0], model.embed([kb_vectors._text(entry)])[0], atol=1e-5)
+        self.assertNotIn(entry.id, [entry_id for _, entry_id in kb_vectors.search("is the kabsa spicy", k=2)])
+
+    @skipIf(kb_vectors.fcntl is None, "needs fcntl")
+    def test_writers_wait_for_another_process_holding_the_file_lock(self):
+        entry = KnowledgeBaseEntry.objects.filter(question="Is the hummus vegan").first()
+        done = threading.Event()
+        with open(os.path.join(kb_vectors.vector_dir(), ".lock"), "a") as other_process:
+            kb_vectors.fcntl.flock(other_process, kb_vectors.fcntl.LOCK_EX)
+            writer = threading.Thread(target=lambda: (kb_vectors.remove_entry(entry.id), done.set()))
+            writer.start()
+            self.assertFalse(done.wait(0.2))
+            kb_vectors.fcntl.flock(other_process, kb_vectors.fcntl.LOCK_UN)
+        writer.join(5)
+        self.assertTrue(done.is_set())
+        self.assertEqual(len(self.row_of(entry.id)[0]), 0)
+
+    def test_removed_entries_are_tombstoned_and_come_back_on_restore(self):
+        entry = KnowledgeBaseEntry.objects.filter(question="Is the falafel price").first()
+        entry.is_removed = True
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.save()
+        self.assertEqual(len(self.row_of(entry.id)[0]), 0)
+        self.assertNotIn(entry.id, [entry_id for _, entry_id in kb_vectors.search("is the falafel price", k=5)])
+
+        entry.is_removed = False
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.save()
+        self.assertEqual(len(self.row_of(entry.id)[0]), 1)
+
+
+class AnswerCacheTests(SimpleTestCase):
+    def make_cache(self, **kwargs):
+        return llm_cache.AnswerCache(**{"capacity": 10, "ttl": 60, "similarity": 0.6, **kwargs})
+
+    def test_exact_hit_ignores_case_and_punctuation(self):
+        cache = self.make_cache(similarity=None)
+        cache.put("What time do you open?", "At noon", entry_id=7)
+        self.assertEqual(cache.get("what time do you OPEN").answer, "At noon")
+        self.assertIsNone(cache.get("When do you open on weekends"))
+        self.assertEqual((cache.stats["hits"], cache.stats["misses"]), (1, 1))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = self.make_cache(capacity=2, similarity=None)
+        cache.put("first question", "1", None)
+        cache.put("second question", "2", None)
+        cache.get("first question")
+        cache.put("third question", "3", None)
+        self.assertIsNone(cache.get("second question"))
+        self.assertIsNotNone(cache.get("first question"))
+        self.assertEqual(cache.stats["evictions"], 1)
+
+    def test_entries_expire(self):
+        cache = self.make_cache(ttl=60)
+        with mock.patch.object(llm_cache.time, "monotonic", return_value=1000.0):
+            cache.put("is the kabsa spicy", "Mildly", None)
+        with mock.patch.object(llm_cache.time, "monotonic", return_value=1061.0):
+            self.assertIsNone(cache.get("is the kabsa spicy"))
+        self.assertEqual(cache.stats["expirations"], 1)
+
+    def test_content_changes_empty_the_cache(self):
+        cache = self.make_cache()
+        cache.put("is the kabsa spicy", "Mildly", None)
+        content_versions.bump("menu")
+        self.assertIsNone(cache.get("is the kabsa spicy"))
+        self.assertEqual(cache.stats["invalidations"], 1)
+
+    def test_similar_questions_hit_but_negations_do_not(self):
+        cache = self.make_cache()
+        cache.put("Is the lamb kabsa spicy?", "Mildly", None)
+        self.assertEqual(cache.get("how spicy is the lamb kabsa").answer, "Mildly")
+        self.assertEqual(cache.stats["similar_hits"], 1)
+        self.assertIsNone(cache.get("is the lamb kabsa not spicy"))
+        self.assertIsNone(cache.get("lamb kabsa without spicy sauce"))
+        self.assertIsNone(cache.get("why isn't the lamb kabsa spicy"))
+
+    def test_discard_drops_answers_backed_by_an_entry(self):
+        cache = self.make_cache()
+        cache.put("refund policy", "Within a day", entry_id=3)
+        cache.discard(3)
+        self.assertIsNone(cache.get("refund policy"))
+
+
+class KBRatingTests(TestCase):
+    def setUp(self):
+        self.user = make_user("customer", "registered")
+        self.client.force_login(self.user)
+        self.entries = [
+            KnowledgeBaseEntry.objects.create(author_type="employee", question=f"Q{i}", answer="A") for i in range(2)
+        ]
+
+    def rate(self, entry_id, rating):
+        return self.client.post("/api/chat/rate/", {"entry_id": entry_id, "rating": rating}, content_type="application/json")
+
+    def test_a_user_rates_an_entry_once(self):
+        self.assertEqual(self.rate(self.entries[0].id, 4).status_code, 200)
+        self.assertEqual(self.rate(self.entries[0].id, 1).status_code, 409)
+        entry = KnowledgeBaseEntry.objects.get(id=self.entries[0].id)
+        self.assertEqual((entry.rating_sum, entry.rating_count, entry.ratings.count()), (4, 1, 1))
+
+        self.assertEqual(self.rate(self.entries[0].id, 9).status_code, 400)
+        self.assertEqual(self.rate(999999, 3).status_code, 404)
+
+    def test_bulk(self):
+        response = self.client.post("/api/chat/rate/bulk/", {"ratings": [
+            {"entry_id": self.entries[0].id, "rating": 5},
+            {"entry_id": self.entries[1].id, "rating": 0},
+            {"entry_id": self.entries[0].id, "rating": 3},
+            {"entry_id": 999999, "rating": 3},
+            {"entry_id": self.entries[1].id, "rating": "x"},
+        ]}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        statuses = [r["status"] for r in response.json()["results"]]
+        self.assertEqual(statuses, ["rated", "rated", "duplicate", "not_found", "invalid"])
+        self.assertTrue(KnowledgeBaseEntry.objects.get(id=self.entries[1].id).is_flagged)
+
+
+class KBRatingConcurrencyTests(TransactionTestCase):
+    """Concurrent raters through separate connections; needs a database that allows concurrent writers."""
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("in-memory SQLite cannot take writes from several connections")
+        self.users = [make_user(f"rater{i}", "registered") for i in range(20)]
+        self.entry = KnowledgeBaseEntry.objects.create(author_type="employee", question="Q", answer="A")
+
+    def hammer(self, users, attempts_per_user=1):
+        started = threading.Barrier(len(users) * attempts_per_user)
+
+        def rate(user):
+            from .kb_ratings import rate_entry
+            try:
+                started.wait()
+                return rate_entry(user, self.entry.id, 4)["status"]
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(len(users) * attempts_per_user) as pool:
+            return list(pool.map(rate, [u for u in users for _ in range(attempts_per_user)]))
+
+    def test_no_lost_updates_and_no_double_ratings(self):
+        statuses = self.hammer(self.users, attempts_per_user=2)
+        self.assertEqual(statuses.count("rated"), len(self.users))
+        self.assertEqual(statuses.count("duplicate"), len(self.users))
+
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.rating_count, len(self.users))
+        self.assertEqual(self.entry.rating_sum, 4 * len(self.users))
+        self.assertEqual(KnowledgeBaseRating.objects.filter(entry=self.entry).count(), len(self.users))
+
+
+class DiscussionListingTests(TestCase):
+    def setUp(self):
+        self.customer = make_user("customer", "registered")
+        self.client.force_login(self.customer)
+        self.topics = [
+            DiscussionTopic.objects.create(title=f"Topic {i}", author=make_user(f"author{i}", "registered"), topic_type="general")
+            for i in range(7)
+        ]
+
+    def reply(self, topic):
+        response = self.client.post("/api/reply/", {"topic_id": topic.id, "body": "Agreed"}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+
+    def listing(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/discussion_board/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), sum("api_discussion" in q["sql"] for q in ctx.captured_queries)
+
+    def test_counters_and_activity_sort(self):
+        self.reply(self.topics[0])
+        self.reply(self.topics[0])
+        self.reply(self.topics[3])
+
+        data, queries = self.listing(sort="activity")
+        self.assertEqual(queries, 1)
+        self.assertEqual([t["title"] for t in data["titles"][:2]], ["Topic 3", "Topic 0"])
+        self.assertEqual(data["titles"][1]["post_count"], 2)
+        self.assertEqual(data["titles"][1]["author_name"], "author0")
+
+        DiscussionPost.objects.filter(topic=self.topics[0]).first().delete()
+        self.topics[0].refresh_from_db()
+        self.assertEqual(self.topics[0].post_count, 1)
+
+    def test_counters_follow_posts_created_outside_the_view(self):
+        topic = self.topics[2]
+        post = DiscussionPost.objects.create(topic=topic, author=self.customer, content="From the admin")
+        topic.refresh_from_db()
+        self.assertEqual(topic.post_count, 1)
+        self.assertEqual(topic.last_activity_at, post.created_at)
+
+        post.content = "Edited"
+        post.save()
+        topic.refresh_from_db()
+        self.assertEqual(topic.post_count, 1)
+
+        post.delete()
+        topic.refresh_from_db()
+        self.assertEqual(topic.post_count, 0)
+
+    def test_cursor_paging_visits_every_topic_once(self):
+        seen, cursor = [], None
+        while True:
+            data, queries = self.listing(limit=3, **({"cursor": cursor} if cursor else {}))
+            self.assertEqual(queries, 1)
+            seen += [t["id"] for t in data["titles"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [t.id for t in reversed(self.topics)])
+
+        response = self.client.get("/api/discussion_board/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+
+class DiscussionThreadTests(TestCase):
+    def setUp(self):
+        self.customer = make_user("customer", "registered")
+        self.client.force_login(self.customer)
+        self.topic = DiscussionTopic.objects.create(title="Thread", author=self.customer, topic_type="general")
+        for i in range(5):
+            DiscussionPost.objects.create(topic=self.topic, author=make_user(f"poster{i}", "registered"), content=f"Reply {i}")
+
+    def thread(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/topic/", {"post_id": self.topic.id, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json(), sum("api_discussionpost" in q["sql"] for q in ctx.captured_queries)
+
+    def test_pages_in_order_without_a_query_per_post(self):
+        first, queries = self.thread(limit=3)
+        self.assertEqual(queries, 2)  # The page, authors included, and the newest post for latest_cursor
+        self.assertEqual(first["post"]["title"], "Thread")
+        self.assertEqual([c["body"] for c in first["comments"]], ["Reply 0", "Reply 1", "Reply 2"])
+        self.assertEqual(first["comments"][0]["author"], "poster0")
+
+        second, queries = self.thread(limit=3, cursor=first["next_cursor"])
+        self.assertEqual(queries, 1)  # Last page: its last post is the newest
+        self.assertEqual([c["body"] for c in second["comments"]], ["Reply 3", "Reply 4"])
+        self.assertIsNone(second["next_cursor"])
+        self.assertEqual(first["latest_cursor"], second["latest_cursor"])
+
+    def test_latest_cursor_skips_unloaded_pages(self):
+        first, _ = self.thread(limit=2)
+        self.assertIsNotNone(first["next_cursor"])
+        nothing_new, _ = self.thread(since=first["latest_cursor"])
+        self.assertEqual(nothing_new["comments"], [])  # Pages 2-3 are for next_cursor, not polling
+
+        response = self.client.post("/api/reply/", {"topic_id": self.topic.id, "body": "New one"}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        delta, _ = self.thread(since=first["latest_cursor"])
+        self.assertEqual([c["body"] for c in delta["comments"]], ["New one"])
+
+    def test_since_returns_only_new_replies(self):
+        data, _ = self.thread()
+        latest = data["latest_cursor"]
+
+        nothing_new, _ = self.thread(since=latest)
+        self.assertEqual(nothing_new["comments"], [])
+        self.assertEqual(nothing_new["latest_cursor"], latest)
+        self.assertNotIn("post", nothing_new)
+
+        response = self.client.post("/api/reply/", {"topic_id": self.topic.id, "body": "New one"}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        delta, _ = self.thread(since=latest)
+        self.assertEqual([c["body"] for c in delta["comments"]], ["New one"])
+        self.assertNotEqual(delta["latest_cursor"], latest)
+
+        response = self.client.get("/api/topic/", {"post_id": self.topic.id, "since": "bogus"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ForumSearchTests(TestCase):
+    def setUp(self):
+        self.author = make_user("author", "registered")
+        chef_user = make_user("chefuser", "chef")
+        self.chef = Chef.objects.get(user_profile=chef_user.userprofile)  # Created by the UserProfile signal
+        self.ramen = DiscussionTopic.objects.create(
+            title="Spicy ramen night", author=self.author, topic_type="chef", related_chef=self.chef
+        )
+        self.general = DiscussionTopic.objects.create(title="Opening hours", author=self.author, topic_type="general")
+        DiscussionPost.objects.create(topic=self.general, author=self.author, content="Is the <b>ramen</b> spicy on Sundays?")
+        DiscussionPost.objects.create(topic=self.ramen, author=self.author, content="Loved the broth")
+
+    def search(self, **params):
+        response = self.client.get("/api/discussion_board/search/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ranks_titles_first_and_highlights_escaped(self):
+        results = self.search(q="spicy ramen")["results"]
+        self.assertEqual([(r["type"], r["topic_id"]) for r in results], [("topic", self.ramen.id), ("post", self.general.id)])
+        self.assertEqual(results[0]["highlight"], "<mark>Spicy</mark> <mark>ramen</mark> night")
+        self.assertIn("&lt;b&gt;<mark>ramen</mark>&lt;/b&gt;", results[1]["highlight"])
+        self.assertEqual(results[1]["title"], "Opening hours")
+
+    def test_filters_paging_and_index_sync(self):
+        results = self.search(q="ramen", related_chef=self.chef.id)["results"]
+        self.assertEqual([r["topic_id"] for r in results], [self.ramen.id])
+        results = self.search(q="ramen", topic_type="general")["results"]
+        self.assertEqual([r["type"] for r in results], ["post"])
+
+        first = self.search(q="ramen", limit=1)
+        self.assertTrue(first["has_more"])
+        second = self.search(q="ramen", limit=1, page=2)
+        self.assertFalse(second["has_more"])
+        self.assertNotEqual(first["results"], second["results"])
+
+        # Edits and deletes reach the index through the triggers
+        self.ramen.title = "Noodle night"
+        self.ramen.save()
+        DiscussionPost.objects.filter(topic=self.general).delete()
+        self.assertEqual(self.search(q="ramen")["results"], [])
+        self.assertEqual(len(self.search(q="noodles")["results"]), 1)  # Stemmed
+
+        self.assertEqual(self.client.get("/api/discussion_board/search/").status_code, 400)
+        response = self.client.get("/api/discussion_board/search/", {"q": "ramen", "related_dish": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.manager = make_user("manager", "manager")
+        self.customer = make_user("customer", "registered").userprofile.customerprofile
+        chef = make_user("chef", "chef").userprofile.chef
+        self.dish = MenuItem.objects.create(name="Mansaf", price=Decimal("10.00"), chef=chef)
+
+    def deposit(self, amount):
+        with transaction.atomic():
+            customer = CustomerProfile.objects.select_for_update().get(id=self.customer.id)
+            ledger.record(customer, "deposit", Decimal(amount))
+
+    def test_history_survives_attempts_to_delete_the_customer(self):
+        self.deposit("25.00")
+        with self.assertRaises(ProtectedError):
+            self.customer.user_profile.user.delete()
+        self.assertEqual(LedgerEntry.objects.filter(customer=self.customer).count(), 1)
+
+    def test_orders_refunds_and_closure_are_balanced_postings(self):
+        self.deposit("50.00")
+        self.client.force_login(self.customer.user_profile.user)
+        order = {"items": [{"menu_item_id": self.dish.id, "quantity": 2}], "delivery_address": "1 Main St"}
+        response = self.client.post("/api/order/", order, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        payment = Transaction.objects.get(transaction_type="order_payment")
+        self.assertEqual(payment.amount, Decimal("23.50"))  # 2 x 10.00 plus delivery and driver fees
+        self.assertEqual(payment.balance_after, Decimal("26.50"))
+
+        self.client.force_login(self.manager)
+        refund = self.client.post("/api/ledger/refund/", {"order_id": payment.order_id, "amount": "3.50"},
+                                  content_type="application/json")
+        self.assertEqual(refund.json()["new_balance"], "30.00")
+        too_much = self.client.post("/api/ledger/refund/", {"order_id": payment.order_id, "amount": "20.01"},
+                                    content_type="application/json")
+        self.assertEqual(too_much.status_code, 400)
+
+        response = self.client.post("/api/account/close/", {"customer_id": self.customer.id, "reason": "quit"},
+                                    content_type="application/json")
+        self.assertEqual(response.json()["cleared_deposit"], "30.00")
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.deposit_balance, Decimal("0"))
+        self.assertEqual(
+            list(LedgerEntry.objects.filter(account="customer").order_by("id").values_list("kind", "amount")),
+            [("deposit", Decimal("50.00")), ("order_payment", Decimal("-23.50")), ("refund", Decimal("3.50")),
+             ("withdrawal", Decimal("-30.00"))],
+        )
+        self.assertEqual(ledger.audit(), [])
+
+        CustomerProfile.objects.filter(id=self.customer.id).update(deposit_balance=Decimal("5.00"))
+        self.assertEqual(len(ledger.audit(fix=True)), 1)
+        self.assertEqual(ledger.audit(), [])
+
+    def test_history_reads_start_from_snapshots(self):
+        with mock.patch.object(ledger, "SNAPSHOT_EVERY", 3):
+            for _ in range(8):
+                self.deposit("1.00")
+        self.assertEqual(LedgerSnapshot.objects.filter(customer=self.customer).count(), 2)
+
+        entries = list(ledger.customer_entries(self.customer).order_by("id"))
+        fifth = entries[4]
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(ledger.balance_through(self.customer, fifth.id), Decimal("5.00"))
+        tail_sql = ctx.captured_queries[-1]["sql"]
+        self.assertIn(f'"id" > {entries[2].id}', tail_sql)  # Only entries after the first snapshot
+        self.assertEqual(ledger.balance_as_of(self.customer, entries[0].created_at), Decimal("0"))
+        self.assertEqual(ledger.balance_as_of(self.customer), Decimal("8.00"))
+
+        self.client.force_login(self.customer.user_profile.user)
+        balances, cursor = [], None
+        while True:
+            data = self.client.get("/api/ledger/statement/", {"limit": 3, **({"cursor": cursor} if cursor else {})}).json()
+            self.assertEqual(data["opening_balance"], balances[-1] if balances else "0")
+            balances += [entry["balance"] for entry in data["entries"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(balances, [f"{n}.00" for n in range(1, 9)])
+
+        response = self.client.get("/api/ledger/balance/", {"at": "2000-01-01"})
+        self.assertEqual(response.json()["balance"], "0")
+        self.client.force_login(self.manager)
+        response = self.client.get("/api/ledger/balance/", {"customer_id": self.customer.id})
+        self.assertEqual(response.json()["balance"], "8.00")
+
+
+class ComplaintDedupTests(TestCase):
+    def setUp(self):
+        self.customers = [make_user(f"customer{i}", "registered") for i in range(3)]
+        self.driver = make_user("driver", "delivery")
+
+    def complain(self, complainant, description):
+        complaint = Complaint.objects.create(
+            complainant=complainant, target_user=self.driver, target_type="delivery", description=description
+        )
+        return complaint, index_complaint(complaint)
+
+    def test_near_duplicates_join_the_first_complaint(self):
+        first, root = self.complain(self.customers[0], "Driver was 40 minutes late and the food arrived cold.")
+        self.assertIsNone(root)
+        second, root = self.complain(self.customers[1], "The driver was 40 minutes late, and the food arrived cold!")
+        self.assertEqual(root, first.id)
+        third, root = self.complain(self.customers[2], "driver was 40 minutes late and the food arrived cold")
+        self.assertEqual(root, first.id)  # Points at the root, not at the second complaint
+        second.refresh_from_db()
+        self.assertEqual(second.duplicate_of_id, first.id)
+
+        self.client.force_login(make_user("manager", "manager"))
+        clusters = self.client.get("/api/complaints/", {"collapse": "true"}).json()["complaints"]
+        self.assertEqual([(c["id"], c["duplicate_count"]) for c in clusters], [(first.id, 2)])
+
+    def test_distinct_complaint_starts_its_own_cluster(self):
+        self.complain(self.customers[0], "Driver was 40 minutes late and the food arrived cold.")
+        other, root = self.complain(self.customers[1], "Rude on the phone and refused to come up to the apartment door.")
+        self.assertIsNone(root)
+        self.assertIsNone(Complaint.objects.get(id=other.id).duplicate_of_id)
+        signature = minhash_signature("Completely unrelated text about spilled drinks in the bag")
+        self.assertEqual(find_duplicate(self.driver.id, signature), (None, 0.0))
@@ -1,20 +1,20 @@
 from django.urls import path
 from .views import (
-    index, DishListView, LoginUser, Discussions, create_reply, create_topic,
+    index, DishListView, LoginUser, Discussions, search_discussions, create_reply, create_topic,
     order_food, food_review, add_menu, create_delivery_bid, get_delivery_bids,
-    assign_delivery, delivery_rating, RegisterUser, create_deposit_intent,
+    assign_delivery, auto_assign_deliveries, delivery_rating, RegisterUser, create_deposit_intent,
     confirm_deposit, file_complaint, get_complaints, process_complaint,
     file_compliment, get_compliments, process_compliment, order_history,
-    blacklist_user, get_profile, chat_with_ai, rate_kb_entry, manage_kb,
+    blacklist_user, get_profile, chat_with_ai, chat_with_ai_stream, reset_chat, rate_kb_entry, rate_kb_entries_bulk, manage_kb, chat_cache_stats,
     AIDiscussionReview, dispute_complaint, get_my_complaints,
     hire_employee, fire_employee, update_salary, award_bonus,
     list_employees, list_customers, get_feedback_targets,
     submit_registration_request, get_registration_requests, process_registration_request,
-    close_customer_account, customer_quit, add_kb_entry, my_kb_entries,
+    close_customer_account, customer_quit, ledger_balance, ledger_statement, refund_order, add_kb_entry, my_kb_entries,
     search_menu, get_recommendations, get_top_chefs, get_delivery_persons,
     # Delivery dashboard endpoints
     get_available_orders, get_my_bids, get_my_deliveries,
-    update_delivery_status, get_delivery_stats,
+    update_delivery_status, get_delivery_stats, get_delivery_batches, create_batch_bid,
     # Chef dashboard endpoints
     get_chef_menu, update_menu_item, delete_menu_item,
     get_chef_orders, update_order_status, get_chef_ratings, get_chef_stats
@@ -26,6 +26,7 @@ urlpatterns = [
     path("login/", LoginUser, name="login"),
     path("register/", RegisterUser, name="register"),
     path("discussion_board/", Discussions, name="discussion_board"),
+    path("discussion_board/search/", search_discussions, name="search_discussions"),
     path("reply/", create_reply, name="reply"),
     path("topic/", create_topic, name="topic"),
     path("order/", order_food, name="order"),
@@ -34,6 +35,7 @@ urlpatterns = [
     path("bid/", create_delivery_bid, name="create_bid"),
     path("bids/", get_delivery_bids, name="get_bids"),
     path("assign_delivery/", assign_delivery, name="assign_delivery"),
+    path("assign_delivery/auto/", auto_assign_deliveries, name="auto_assign_delivery"),
     path("review_driver/", delivery_rating, name="review_driver"),
     path("deposit/create/", create_deposit_intent, name="create_deposit"),
     path("deposit/confirm/", confirm_deposit, name="confirm_deposit"),
@@ -49,10 +51,14 @@ urlpatterns = [
     path("blacklist/", blacklist_user, name="blacklist"),
     path("profile/", get_profile, name="profile"),
     path("chat/", chat_with_ai, name="chat_with_ai"),
+    path("chat/stream/", chat_with_ai_stream, name="chat_with_ai_stream"),
+    path("chat/reset/", reset_chat, name="reset_chat"),
     path("chat/rate/", rate_kb_entry, name="rate_kb"),
+    path("chat/rate/bulk/", rate_kb_entries_bulk, name="rate_kb_bulk"),
     path("kb/add/", add_kb_entry, name="add_kb"),
     path("kb/my-entries/", my_kb_entries, name="my_kb_entries"),
     path("kb/manage/", manage_kb, name="manage_kb"),
+    path("kb/cache-stats/", chat_cache_stats, name="chat_cache_stats"),
     path("discussion_summary/", AIDiscussionReview, name="discussion_summary"),
     path("hr/hire/", hire_employee, name="hire_employee"),
     path("hr/fire/", fire_employee, name="fire_employee"),
@@ -65,6 +71,9 @@ urlpatterns = [
     path("registration/process/", process_registration_request, name="process_registration"),
     path("account/close/", close_customer_account, name="close_account"),
     path("account/quit/", customer_quit, name="customer_quit"),
+    path("ledger/balance/", ledger_balance, name="ledger_balance"),
+    path("ledger/statement/", ledger_statement, name="ledger_statement"),
+    path("ledger/refund/", refund_order, name="refund_order"),
     path("search/", search_menu, name="search_menu"),
     path("recommendations/", get_recommendations, name="recommendations"),
     path("top-chefs/", get_top_chefs, name="top_chefs"),
@@ -73,6 +82,8 @@ urlpatterns = [
     # Delivery dashboard routes
     path("delivery/available/", get_available_orders, name="available_orders"),
     path("delivery/my-bids/", get_my_bids, name="my_bids"),
+    path("delivery/batches/", get_delivery_batches, name="delivery_batches"),
+    path("delivery/batches/bid/", create_batch_bid, name="create_batch_bid"),
     path("delivery/my-deliveries/", get_my_deliveries, name="my_deliveries"),
     path("delivery/update-status/", update_delivery_status, name="update_delivery_status"),
     path("delivery/stats/", get_delivery_stats, name="delivery_stats"),
@@ -1,8 +1,9 @@
 from django.shortcuts import render, redirect
 import os
 import ollama
-from ollama import Client
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+import json
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import authenticate, login
 from rest_framework.decorators import api_view
@@ -10,12 +11,13 @@ from rest_framework.response import Response
 from django.contrib.auth.models import User
 from .models import MenuItem, DiscussionTopic, DiscussionPost, OrderItem, DeliveryBid, DeliveryAssignment, Order, FoodRating, DeliveryRating, UserProfile, CustomerProfile, Transaction, Chef, Complaint, DeliveryPerson, Compliment
 import stripe
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from django.conf import settings
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Count
 from rest_framework import status
 
-from .models import KnowledgeBaseEntry
+from .models import KnowledgeBaseEntry, DiscussionSummary
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 from .serializers import(
@@ -29,8 +31,10 @@ from .serializers import(
     DeliveryBidSerializer,
     DeliveryAssignmentSerializer,
     OrderWithBidsSerializer,
+    BidBoardOrderSerializer,
     DeliveryReviewSerializer,
     ComplaintSerializer,
+    ComplaintClusterSerializer,
     ComplimentSerializer,
     UserProfileSerializer,
     HireEmployeeSerializer,
@@ -47,6 +51,20 @@ from .serializers import(
     TopChefSerializer,
 )
 from .models import RegistrationRequest
+from .complaint_dedup import index_complaint
+from .delivery_assignment import lowest_bids, run_assignment_sweep
+from .realtime import broadcast
+from .roster import chef_roster, delivery_roster
+from .cursors import InvalidCursor, encode_cursor, keyset_page
+from . import forum_search, ledger
+from .kb_search import find_answer
+from .kb_vectors import FOLLOW_UP_THRESHOLD, SIMILARITY_THRESHOLD, find_answer as find_semantic_answer
+from .llm_cache import answer_cache
+from .kb_ratings import MAX_BULK as MAX_BULK_RATINGS, parse_rating, rate_entries, rate_entry
+from .prompt_context import build_chat_prompt, prompt_stats
+from . import chat_memory
+from .single_flight import LeaderGone, flight_key, llm_flight
+from .llm_gateway import LLMCallFailed, LLMGatewayError, gateway, user_key_for
 
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -96,25 +114,83 @@ def DishListView(request):
         }
     })
 
+DISCUSSION_SORTS = {"newest": "created_at", "activity": "last_activity_at"}
+
+
 @api_view(["GET"])
 def Discussions(request):
-    topics = DiscussionTopic.objects.all().order_by('-created_at')
-
-    # Build response with post counts and author names
-    titles_data = []
-    for topic in topics:
-        post_count = DiscussionPost.objects.filter(topic=topic).count()
-        titles_data.append({
-            "id": topic.id,
-            "title": topic.title,
-            "author_name": topic.author.username,
-            "topic_type": topic.topic_type,
-            "post_count": post_count,
-            "created_at": topic.created_at.strftime("%Y-%m-%d %H:%M"),
-        })
+    """
+    Topics, one page per request.
+    ?sort=newest (default) or activity (latest reply first), ?limit= (max 100),
+    and ?cursor=<next_cursor from the previous page>.
+    """
+    sort = request.GET.get("sort", "newest")
+    if sort not in DISCUSSION_SORTS:
+        return Response({"error": "sort must be newest or activity"}, status=400)
+    try:
+        limit = min(max(int(request.GET.get("limit", 50)), 1), 100)
+    except ValueError:
+        return Response({"error": "limit must be an integer"}, status=400)
+
+    # Counters are kept on the topic (see create_reply), so this is one query
+    topics = DiscussionTopic.objects.select_related('author').only(
+        'id', 'title', 'topic_type', 'post_count', 'last_activity_at', 'created_at', 'author__username'
+    )
+    try:
+        topics, next_cursor = keyset_page(topics, DISCUSSION_SORTS[sort], request.GET.get("cursor"), limit)
+    except InvalidCursor as e:
+        return Response({"error": str(e)}, status=400)
+
+    titles_data = [{
+        "id": topic.id,
+        "title": topic.title,
+        "author_name": topic.author.username,
+        "topic_type": topic.topic_type,
+        "post_count": topic.post_count,
+        "last_activity_at": topic.last_activity_at.strftime("%Y-%m-%d %H:%M"),
+        "created_at": topic.created_at.strftime("%Y-%m-%d %H:%M"),
+    } for topic in topics]
 
     return Response({
         "titles": titles_data,
+        "sort": sort,
+        "next_cursor": next_cursor,
+    })
+
+@api_view(["GET"])
+def search_discussions(request):
+    """
+    Full-text search over topic titles and replies (see forum_search.py).
+    ?q= (required), optional ?topic_type=, ?related_chef=, ?related_dish=,
+    ?related_delivery= (ids), ?page= and ?limit= (max 50).
+    """
+    q = forum_search.clean_query(request.GET.get("q"))
+    if not q:
+        return Response({"error": "q is required"}, status=400)
+    try:
+        page = min(max(int(request.GET.get("page", 1)), 1), forum_search.MAX_PAGE)
+        limit = min(max(int(request.GET.get("limit", 20)), 1), 50)
+    except ValueError:
+        return Response({"error": "page and limit must be integers"}, status=400)
+
+    filters = {}
+    for name in forum_search.FILTERS:
+        value = request.GET.get(name)
+        if not value:
+            continue
+        if name == "topic_type":
+            if value not in dict(DiscussionTopic.TOPIC_TYPE_CHOICES):
+                return Response({"error": "Invalid topic_type"}, status=400)
+        elif not value.isdigit():
+            return Response({"error": f"{name} must be an id"}, status=400)
+        filters[name] = value if name == "topic_type" else int(value)
+
+    hits, has_more = forum_search.search(q, filters, page, limit)
+    return Response({
+        "query": q,
+        "results": hits,
+        "page": page,
+        "has_more": has_more and page < forum_search.MAX_PAGE,
     })
 
 @api_view(["POST"])
@@ -137,11 +213,13 @@ def create_reply(request):
     except DiscussionTopic.DoesNotExist:
         return Response({"error": "Topic not found"}, status=404)
 
-    post = DiscussionPost.objects.create(
-        topic=topic,
-        author=user,
-        content=body
-    )
+    # Insert and bump the topic's counters (post_save signal in models.py) together
+    with transaction.atomic():
+        post = DiscussionPost.objects.create(
+            topic=topic,
+            author=user,
+            content=body
+        )
 
     return Response({
         "id": post.id,
@@ -154,29 +232,50 @@ def create_reply(request):
 @api_view(["GET", "POST"])
 @csrf_exempt
 def create_topic(request):
-    # GET: Fetch topic details with posts
+    # GET: Fetch topic details with one page of posts, oldest first.
+    # ?limit= (max 200), ?cursor=<next_cursor> for the following page, or
+    # ?since=<latest_cursor> for only the replies added since (no topic details)
     if request.method == "GET":
         post_id = request.GET.get("post_id")
         if not post_id:
             return Response({"error": "post_id is required"}, status=400)
-
         try:
-            topic = DiscussionTopic.objects.get(id=post_id)
-        except DiscussionTopic.DoesNotExist:
-            return Response({"error": "Topic not found"}, status=404)
+            limit = min(max(int(request.GET.get("limit", 50)), 1), 200)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=400)
+        since = request.GET.get("since")
+        cursor = since or request.GET.get("cursor")
+
+        topic = None
+        if since:
+            if not DiscussionTopic.objects.filter(id=post_id).exists():
+                return Response({"error": "Topic not found"}, status=404)
+        else:
+            try:
+                topic = DiscussionTopic.objects.select_related('author').get(id=post_id)
+            except DiscussionTopic.DoesNotExist:
+                return Response({"error": "Topic not found"}, status=404)
 
-        # Get all posts (comments) for this topic
-        posts = DiscussionPost.objects.filter(topic=topic).order_by('created_at')
+        posts = DiscussionPost.objects.filter(topic_id=post_id).select_related('author').only(
+            'id', 'content', 'created_at', 'author__username'
+        )
+        try:
+            posts, next_cursor = keyset_page(posts, 'created_at', cursor, limit, descending=False)
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=400)
+
+        if next_cursor is not None:
+            # Later pages are loaded with next_cursor; polling picks up after the newest post
+            newest = DiscussionPost.objects.filter(topic_id=post_id).only('id', 'created_at').order_by(
+                '-created_at', '-id'
+            ).first()
+            latest_cursor = encode_cursor(newest.created_at, newest.id)
+        elif posts:
+            latest_cursor = encode_cursor(posts[-1].created_at, posts[-1].id)
+        else:
+            latest_cursor = cursor
 
-        return Response({
-            "post": {
-                "id": topic.id,
-                "title": topic.title,
-                "author": topic.author.username,
-                "topic_type": topic.topic_type,
-                "created_at": topic.created_at.strftime("%Y-%m-%d %H:%M"),
-                "body": "",  # Topics don't have body, posts do
-            },
+        data = {
             "comments": [
                 {
                     "id": post.id,
@@ -185,8 +284,22 @@ def create_topic(request):
                     "created_at": post.created_at.strftime("%Y-%m-%d %H:%M"),
                 }
                 for post in posts
-            ]
-        })
+            ],
+            "next_cursor": next_cursor,
+            # Poll with since=latest_cursor to get replies posted after the whole thread
+            "latest_cursor": latest_cursor,
+        }
+        if topic is not None:
+            data["post"] = {
+                "id": topic.id,
+                "title": topic.title,
+                "author": topic.author.username,
+                "topic_type": topic.topic_type,
+                "created_at": topic.created_at.strftime("%Y-%m-%d %H:%M"),
+                "post_count": topic.post_count,
+                "body": "",  # Topics don't have body, posts do
+            }
+        return Response(data)
 
     # POST: Create a new topic
     user = request.user
@@ -332,8 +445,7 @@ def order_food(request):
                     "is_blacklisted": customer_profile.is_blacklisted
                 }, status=status.HTTP_402_PAYMENT_REQUIRED)
 
-            # Deduct money
-            customer_profile.deposit_balance -= grand_total
+            # The money itself is taken by ledger.record once the order exists
             customer_profile.total_spent += grand_total  # Lifetime spending (never resets)
             customer_profile.vip_progress_spent += grand_total  # VIP progress (resets on demotion)
             customer_profile.order_count += 1
@@ -354,6 +466,7 @@ def order_food(request):
                 raise ValueError(str(order_serializer.errors))
             
             order = order_serializer.save()
+            ledger.record(customer_profile, "order_payment", grand_total, order=order)
 
             created_items_data = []
             for menu_item, qty, price in temp_items:
@@ -369,6 +482,14 @@ def order_food(request):
                     "price": str(price)
                 })
 
+            # Tell connected drivers/managers a new order is open for bids (sent on commit)
+            broadcast("order.created", {
+                "order_id": order.id,
+                "total_price": str(grand_total),
+                "delivery_address": delivery_address,
+                "items_summary": ", ".join(f"{i['quantity']}x {i['menu_item']}" for i in created_items_data),
+            })
+
             response_data = {
                 "order_id": order.id,
                 "subtotal": str(subtotal),
@@ -548,7 +669,14 @@ def create_delivery_bid(request):
 
     serializer = DeliveryBidSerializer(data=data)
     if serializer.is_valid():
-        serializer.save()
+        bid = serializer.save()
+        broadcast("bid.created", {
+            "bid_id": bid.id,
+            "order_id": bid.order_id,
+            "bid_amount": str(bid.bid_amount),
+            "delivery_person_id": delivery_profile.id,
+            "delivery_person_name": user.username,
+        })
         return Response(serializer.data, status=201)
 
     return Response(serializer.errors, status=400)
@@ -563,10 +691,50 @@ def get_delivery_bids(request):
     if profile.user_type != "manager":
         return Response({"error": "Only manager personnel can view bids"}, status=403)
 
-    pending_orders = Order.objects.filter(status="pending").exclude(assignment__isnull=False)
-    serializer = OrderWithBidsSerializer(pending_orders, many=True)
+    # Customer names, bids and bidder names are loaded up front and the lowest
+    # bid / bid count are computed in SQL, so the query count does not grow with the board
+    from django.core.paginator import Paginator
+    from django.db.models import Count, Min, Prefetch
+
+    pending_orders = Order.objects.filter(
+        status="pending", assignment__isnull=True
+    ).select_related(
+        'customer__user_profile__user'
+    ).annotate(
+        lowest_bid=Min('bids__bid_amount'),
+        bid_count=Count('bids'),
+    ).prefetch_related(
+        Prefetch('bids', queryset=DeliveryBid.objects.select_related('delivery_person__user_profile__user'))
+    ).order_by('-created_at', '-id')
+
+    # Without ?page= the whole board is returned, as the dashboards expect
+    if "page" not in request.GET:
+        orders = list(pending_orders)
+        return Response({
+            "orders": BidBoardOrderSerializer(orders, many=True).data,
+            "page": 1,
+            "page_size": len(orders),
+            "total_pages": 1,
+            "count": len(orders),
+        })
 
-    return Response({"orders": serializer.data})
+    try:
+        page_size = min(max(int(request.GET.get("page_size", 50)), 1), 200)
+        page_number = max(int(request.GET["page"]), 1)
+    except ValueError:
+        return Response({"error": "page and page_size must be integers"}, status=400)
+
+    paginator = Paginator(pending_orders, page_size)
+    page = paginator.get_page(page_number)
+    serializer = BidBoardOrderSerializer(page.object_list, many=True)
+
+    return Response({
+        "orders": serializer.data,
+        "page": page.number,
+        "page_size": page_size,
+        "total_pages": paginator.num_pages,
+        "count": paginator.count,
+    })
 
 
 @api_view(["GET"])
@@ -581,16 +749,16 @@ def get_delivery_persons(request):
     if profile.user_type != "manager":
         return Response({"error": "Only managers can access this"}, status=403)
 
-    delivery_persons = DeliveryPerson.objects.select_related('user_profile__user').all()
     data = [
         {
             "id": dp.id,
             "username": dp.user_profile.user.username,
             "email": dp.user_profile.user.email,
             "average_rating": dp.average_rating,
-            "total_deliveries": Order.objects.filter(delivery_person=dp, status="delivered").count(),
+            "total_deliveries": dp.delivered_count,
+            "active_deliveries": dp.active_count,
         }
-        for dp in delivery_persons
+        for dp in delivery_roster()
     ]
 
     return Response({"delivery_persons": data})
@@ -641,6 +809,8 @@ def assign_delivery(request):
         order.status = "preparing"
         order.save()
 
+        broadcast("order.assigned", {"assignments": [{"order_id": order.id, "delivery_person_id": delivery_person.id}]})
+
         return Response({"message": "Delivery manually assigned", "order_id": order_id}, status=201)
 
     # Bid-based assignment
@@ -652,10 +822,12 @@ def assign_delivery(request):
     except DeliveryBid.DoesNotExist:
         return Response({"error": "Bid not found"}, status=404)
 
-    lowest_bid = DeliveryBid.objects.filter(order_id=order_id).first()
+    # Same lowest-bid rule the bid-window scheduler uses
+    lowest_bid = lowest_bids([order.id]).get(order.id)
+    not_lowest = lowest_bid is not None and selected_bid.id != lowest_bid.bid_id
 
     # Require justification if not choosing lowest bidder
-    if lowest_bid and selected_bid.id != lowest_bid.id and not justification:
+    if not_lowest and not justification:
         return Response({"error": "Justification memo required when not selecting lowest bidder"}, status=400)
 
     # Create assignment record
@@ -664,7 +836,7 @@ def assign_delivery(request):
         delivery_person=selected_bid.delivery_person,
         assigned_by=user,
         winning_bid=selected_bid,
-        justification_memo=justification if (lowest_bid and selected_bid.id != lowest_bid.id) else None
+        justification_memo=justification if not_lowest else None
     )
 
     # Update order
@@ -673,17 +845,48 @@ def assign_delivery(request):
     order.status = "preparing"
     order.save()
 
+    broadcast("order.assigned", {"assignments": [{"order_id": order.id, "delivery_person_id": selected_bid.delivery_person_id}]})
+
     return Response({"message": "Delivery assigned", "order_id": order_id}, status=201)
 
 
+@api_view(["POST"])
+@csrf_exempt
+def auto_assign_deliveries(request):
+    """
+    Manager runs an assignment sweep over all pending orders with bids.
+    Pass dry_run=true to preview the assignments without saving them.
+    """
+    user = request.user
+
+    if not user.is_authenticated:
+        return Response({"error": "Authentication required"}, status=401)
+
+    profile = user.userprofile
+    if profile.user_type != "manager":
+        return Response({"error": "Only managers can assign deliveries"}, status=403)
+
+    dry_run = str(request.data.get("dry_run", "")).lower() in ["1", "true"]
+    result = run_assignment_sweep(assigned_by=user, dry_run=dry_run)
+
+    return Response(result, status=200 if dry_run else 201)
+
+
 # ============================================
 # DELIVERY DASHBOARD ENDPOINTS
 # ============================================
 
 @api_view(["GET"])
 def get_available_orders(request):
-    """Get orders available for delivery bidding."""
+    """
+    Get orders available for delivery bidding.
+    Pass since=<server_time from the previous response> to only get orders that
+    are new or changed since then, plus the ids of orders that were taken.
+    """
     from .serializers import AvailableOrderSerializer
+    from django.db.models import OuterRef, Prefetch, Q, Subquery
+    from django.utils import timezone
+    from django.utils.dateparse import parse_datetime
 
     user = request.user
     if not user.is_authenticated:
@@ -695,20 +898,56 @@ def get_available_orders(request):
 
     delivery_person = profile.deliveryperson
 
+    since = None
+    if request.GET.get("since"):
+        since = parse_datetime(request.GET["since"])
+        if since is None:
+            return Response({"error": "since must be an ISO 8601 timestamp"}, status=400)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+
+    # Taken before querying so nothing committed in between is missed next time
+    server_time = timezone.now()
+
+    # This driver's own bid, resolved in SQL instead of one query per order
+    my_bids = DeliveryBid.objects.filter(order=OuterRef('pk'), delivery_person=delivery_person)
+    available_filter = Q(status__in=["pending", "preparing", "ready"], delivery_person__isnull=True)
+
     # Get orders without assignment (pending, preparing, or ready)
     available_orders = Order.objects.filter(
-        status__in=["pending", "preparing", "ready"]
-    ).filter(
-        delivery_person__isnull=True
+        available_filter
+    ).select_related(
+        'customer__user_profile__user'
+    ).annotate(
+        my_bid_id=Subquery(my_bids.values('id')[:1]),
+        my_bid_amount=Subquery(my_bids.values('bid_amount')[:1]),
+        my_bid_created_at=Subquery(my_bids.values('created_at')[:1]),
+    ).prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('menu_item'))
     ).order_by('-created_at')
 
+    removed_ids = []
+    if since:
+        available_orders = available_orders.filter(
+            Q(updated_at__gt=since) | Q(my_bid_created_at__gt=since)
+        )
+        # Orders that changed but are no longer open (assigned, cancelled, ...)
+        removed_ids = list(
+            Order.objects.filter(updated_at__gt=since).exclude(available_filter).values_list('id', flat=True)
+        )
+
     serializer = AvailableOrderSerializer(
         available_orders,
         many=True,
         context={'delivery_person': delivery_person}
     )
 
-    return Response({"orders": serializer.data})
+    return Response({
+        "orders": serializer.data,
+        "removed_ids": removed_ids,
+        "server_time": server_time.isoformat(),
+        "delta": since is not None,
+    })
 
 
 @api_view(["GET"])
@@ -739,6 +978,116 @@ def get_my_bids(request):
     return Response({"bids": serializer.data})
 
 
+@api_view(["GET"])
+def get_delivery_batches(request):
+    """Get open multi-drop batches (orders to the same area in the same time window)."""
+    from .geocoding import batchable_orders
+    from .models import DeliveryBatch
+    from django.db.models import Prefetch
+
+    user = request.user
+    if not user.is_authenticated:
+        return Response({"error": "Authentication required"}, status=401)
+
+    profile = user.userprofile
+    if profile.user_type not in ["delivery", "manager"]:
+        return Response({"error": "Only delivery personnel and managers can access this"}, status=403)
+
+    open_orders = batchable_orders().order_by('created_at')
+    batches = DeliveryBatch.objects.filter(
+        status="open", orders__in=open_orders
+    ).distinct().prefetch_related(
+        Prefetch('orders', queryset=open_orders, to_attr='open_orders')
+    ).order_by('window_start', 'id')
+
+    return Response({"batches": [
+        {
+            "batch_id": batch.id,
+            "geohash": batch.geohash,
+            "window_start": batch.window_start,
+            "orders": [
+                {
+                    "order_id": order.id,
+                    "delivery_address": order.delivery_address,
+                    "total_price": str(order.total_price),
+                    "created_at": order.created_at,
+                }
+                for order in batch.open_orders
+            ],
+        }
+        for batch in batches
+    ]})
+
+
+@api_view(["POST"])
+@csrf_exempt
+def create_batch_bid(request):
+    """
+    Bid on every open order of a batch at once.
+    bid_amount is the price for the whole run and is split across the orders.
+    """
+    from .geocoding import batchable_orders
+    from .models import DeliveryBatch
+
+    user = request.user
+    if not user.is_authenticated:
+        return Response({"error": "Authentication required"}, status=401)
+
+    profile = user.userprofile
+    if profile.user_type != "delivery":
+        return Response({"error": "Only delivery personnel can bid"}, status=403)
+
+    try:
+        total = Decimal(str(request.data.get("bid_amount")))
+    except ArithmeticError:
+        return Response({"error": "bid_amount must be a number"}, status=400)
+    if not total.is_finite() or total <= 0:
+        return Response({"error": "bid_amount must be positive"}, status=400)
+
+    try:
+        batch = DeliveryBatch.objects.get(id=request.data.get("batch_id"), status="open")
+    except (DeliveryBatch.DoesNotExist, ValueError, TypeError):
+        return Response({"error": "Batch not found"}, status=404)
+
+    delivery_person = profile.deliveryperson
+    with transaction.atomic():
+        orders = list(
+            batchable_orders().select_for_update(of=("self",)).filter(
+                delivery_batch=batch, assignment__isnull=True
+            ).order_by('id')
+        )
+        if not orders:
+            return Response({"error": "No orders in this batch are open for bidding"}, status=400)
+
+        # Even split; rounding remainder goes on the first order
+        share = (total / len(orders)).quantize(Decimal("0.01"))
+        amounts = [share] * len(orders)
+        amounts[0] += total - share * len(orders)
+        if amounts[0] <= 0:
+            return Response({"error": "bid_amount is too small to split across the batch"}, status=400)
+
+        bids = []
+        for order, amount in zip(orders, amounts):
+            bid, _ = DeliveryBid.objects.update_or_create(
+                order=order, delivery_person=delivery_person,
+                defaults={"bid_amount": amount},
+            )
+            bids.append(bid)
+            broadcast("bid.created", {
+                "bid_id": bid.id,
+                "order_id": order.id,
+                "bid_amount": str(amount),
+                "delivery_person_id": delivery_person.id,
+                "delivery_person_name": user.username,
+                "batch_id": batch.id,
+            })
+
+    return Response({
+        "batch_id": batch.id,
+        "bids": [{"bid_id": b.id, "order_id": b.order_id, "bid_amount": str(b.bid_amount)} for b in bids],
+    }, status=201)
+
+
 @api_view(["GET"])
 def get_my_deliveries(request):
     """Get delivery person's assigned deliveries."""
@@ -953,22 +1302,17 @@ def confirm_deposit(request):
     if Transaction.objects.filter(stripe_payment_intent_id=payment_intent_id).exists():
         return Response({"error": "Payment already processed"}, status=400)
 
-    customer = user.userprofile.customerprofile
     amount = Decimal(intent.amount) / Decimal(100)  # Convert cents to dollars
 
-    # Credit the balance
-    customer.deposit_balance += amount
-    customer.save()
-
-    # Record transaction
-    Transaction.objects.create(
-        user=user,
-        transaction_type="deposit",
-        amount=amount,
-        stripe_payment_intent_id=payment_intent_id,
-        payment_status="succeeded",
-        balance_after=customer.deposit_balance
-    )
+    # Credit the balance; the unique payment intent id stops a concurrent duplicate
+    try:
+        with transaction.atomic():
+            customer = CustomerProfile.objects.select_for_update().select_related("user_profile").get(
+                user_profile__user=user
+            )
+            ledger.record(customer, "deposit", amount, stripe_payment_intent_id=payment_intent_id)
+    except IntegrityError:
+        return Response({"error": "Payment already processed"}, status=400)
 
     return Response({
         "message": "Deposit successful",
@@ -976,6 +1320,125 @@ def confirm_deposit(request):
         "new_balance": str(customer.deposit_balance)
     })
 
+
+def _ledger_customer(request):
+    """(customer, None) for the ledger asked for, or (None, error Response). Managers pick any customer."""
+    user = request.user
+    if not user.is_authenticated:
+        return None, Response({"error": "Authentication required"}, status=401)
+    profile = user.userprofile
+    if profile.user_type == "manager":
+        customer_id = request.GET.get("customer_id", "")
+        if not customer_id.isdigit():
+            return None, Response({"error": "customer_id is required"}, status=400)
+        customer = CustomerProfile.objects.filter(id=customer_id).first()
+    elif profile.user_type in ["registered", "vip"]:
+        customer = getattr(profile, "customerprofile", None)
+    else:
+        return None, Response({"error": "Only customers and managers can view balances"}, status=403)
+    if customer is None:
+        return None, Response({"error": "Customer not found"}, status=404)
+    return customer, None
+
+
+@api_view(["GET"])
+def ledger_balance(request):
+    """Deposit balance from the ledger, now or just before ?at= (ISO date or datetime)."""
+    customer, error = _ledger_customer(request)
+    if error:
+        return error
+    at = None
+    if request.GET.get("at"):
+        at = ledger.parse_when(request.GET["at"])
+        if at is None:
+            return Response({"error": "at must be an ISO date or datetime"}, status=400)
+
+    return Response({
+        "customer_id": customer.id,
+        "balance": str(ledger.balance_as_of(customer, at)),
+        "at": at.isoformat() if at else None,
+    })
+
+
+@api_view(["GET"])
+def ledger_statement(request):
+    """
+    Ledger entries with running balances for ?since= to ?until= (default: the
+    last 30 days), one page per request: ?limit= (max 500), ?cursor=<next_cursor>.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+
+    customer, error = _ledger_customer(request)
+    if error:
+        return error
+    until = ledger.parse_when(request.GET["until"]) if request.GET.get("until") else timezone.now()
+    since = ledger.parse_when(request.GET["since"]) if request.GET.get("since") else until - timedelta(days=30)
+    if since is None or until is None:
+        return Response({"error": "since and until must be ISO dates or datetimes"}, status=400)
+    try:
+        limit = min(max(int(request.GET.get("limit", 100)), 1), 500)
+    except ValueError:
+        return Response({"error": "limit must be an integer"}, status=400)
+
+    try:
+        page = ledger.statement(customer, since, until, request.GET.get("cursor"), limit)
+    except InvalidCursor as e:
+        return Response({"error": str(e)}, status=400)
+
+    return Response({
+        "customer_id": customer.id,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "opening_balance": str(page["opening_balance"]),
+        "closing_balance": str(page["closing_balance"]),
+        "entries": [{
+            "id": line["entry"].id,
+            "kind": line["entry"].kind,
+            "amount": str(line["entry"].amount),
+            "balance": str(line["balance"]),
+            "order_id": line["entry"].order_id,
+            "transaction_id": line["entry"].transaction_id,
+            "created_at": line["entry"].created_at.strftime("%Y-%m-%d %H:%M"),
+        } for line in page["lines"]],
+        "next_cursor": page["next_cursor"],
+    })
+
+
+@api_view(["POST"])
+@csrf_exempt
+def refund_order(request):
+    """Manager refunds an order, in full or ?amount= of it, to the customer's deposit."""
+    if not request.user.is_authenticated:
+        return Response({"error": "Authentication required"}, status=401)
+    if request.user.userprofile.user_type != "manager":
+        return Response({"error": "Manager access required"}, status=403)
+
+    try:
+        order = Order.objects.get(id=int(request.data.get("order_id")))
+    except (Order.DoesNotExist, TypeError, ValueError):
+        return Response({"error": "Order not found"}, status=404)
+    amount = request.data.get("amount")
+    if amount is not None:
+        try:
+            amount = Decimal(str(amount))
+        except InvalidOperation:
+            return Response({"error": "amount must be a number"}, status=400)
+
+    try:
+        refund = ledger.refund_order(order, amount)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    return Response({
+        "message": "Refunded",
+        "order_id": order.id,
+        "amount": str(refund.amount),
+        "new_balance": str(refund.balance_after),
+        "transaction_id": refund.id,
+    }, status=200)
+
+
 @api_view(["GET"])
 def order_history(request):
     # 1. Get the logged-in user
@@ -1128,6 +1591,9 @@ def file_complaint(request):
         status="pending"
     )
 
+    # Link near-duplicates of earlier complaints against the same user
+    duplicate_of = index_complaint(complaint)
+
     return Response({
         "message": "Complaint filed successfully",
         "complaint": {
@@ -1135,7 +1601,8 @@ def file_complaint(request):
             "target_type": complaint.target_type,
             "target_user": complaint.target_user.username,
             "description": complaint.description,
-            "status": complaint.status
+            "status": complaint.status,
+            "duplicate_of": duplicate_of
         }
     }, status=201)
 
@@ -1150,7 +1617,16 @@ def get_complaints(request):
         return Response({"error": "Only managers can view complaints"}, status=403)
 
     # Return all complaints (pending, disputed, upheld, dismissed) for manager to filter
-    all_complaints = Complaint.objects.all().order_by('-created_at')
+    all_complaints = Complaint.objects.select_related('complainant', 'target_user').order_by('-created_at')
+
+    # ?collapse=true: one row per near-duplicate cluster (root complaint + duplicate ids)
+    if request.GET.get("collapse") in ["1", "true"]:
+        clusters = all_complaints.filter(duplicate_of__isnull=True).annotate(
+            duplicate_count=Count('duplicates')
+        ).prefetch_related('duplicates')
+        serializer = ComplaintClusterSerializer(clusters, many=True)
+        return Response({"complaints": serializer.data})
+
     serializer = ComplaintSerializer(all_complaints, many=True)
     return Response({"complaints": serializer.data})
 
@@ -1499,12 +1975,94 @@ def get_profile(request):
     return Response(serializer.data, status=200)
 
 
+CHAT_MODES = ["auto", "keyword", "semantic"]
+
+
+def lookup_chat_answer(user_message, mode="auto", follow_up=False):
+    """
+    Answer a chat message without the LLM if possible; returns the response
+    payload or None.
+
+    Step 1: employee-authored KB entries. mode: "keyword" (BM25, kb_search.py),
+    "semantic" (local vectors, kb_vectors.py) or "auto": keyword first, then
+    semantic to catch paraphrases.
+    Step 2: a recent LLM answer to the same (or a very similar) question.
+
+    A follow_up (the conversation has earlier turns) may lean on them, as in
+    "and is it spicy?", so it only takes a strong KB match and never a cached
+    answer, which was given without that context.
+    """
+    kb_match, match_type = None, None
+    if mode in ["auto", "keyword"]:
+        kb_match, match_type = find_answer(user_message, strict=follow_up), "keyword"
+    if kb_match is None and mode in ["auto", "semantic"]:
+        threshold = FOLLOW_UP_THRESHOLD if follow_up else SIMILARITY_THRESHOLD
+        kb_match, match_type = find_semantic_answer(user_message, threshold), "semantic"
+
+    if kb_match:
+        return {
+            "response": kb_match.answer,
+            "entry_id": kb_match.id,
+            "source": "knowledge_base",
+            "match_type": match_type,
+            "message": "Please rate this answer"
+        }
+
+    if follow_up:
+        return None
+    cached = answer_cache.get(user_message)
+    if cached and KnowledgeBaseEntry.objects.filter(id=cached.entry_id, is_removed=False, is_flagged=False).exists():
+        return {
+            "response": cached.answer,
+            "entry_id": cached.entry_id,
+            "source": "llm",
+            "cached": True
+        }
+    return None
+
+
+def build_llm_messages(user_message, memory_key):
+    """
+    System prompt, the session's recent turns (chat_memory.py, trimmed to its
+    token budget) and the new message. Returns (messages, had_history).
+    """
+    history = chat_memory.history_messages(memory_key)
+    # Retrieve context for the previous question too, so a follow-up such as
+    # "and for VIPs?" still gets the KB entries about its topic
+    previous = chat_memory.last_user_message(memory_key) if history else None
+    system_prompt = build_chat_prompt(f"{previous} {user_message}" if previous else user_message).text
+    messages = [{'role': 'system', 'content': system_prompt}, *history, {'role': 'user', 'content': user_message}]
+    return messages, bool(history)
+
+
+def save_llm_answer(user, user_message, bot_response, cache_answer=True):
+    """
+    Store an LLM answer as a KB entry (for rating) and in the answer cache.
+    Answers that depended on earlier turns are not cached: the same words
+    may mean something else in another conversation.
+    """
+    kb_entry = KnowledgeBaseEntry.objects.create(
+        author=user,  # None for visitors
+        author_type="customer" if user else "visitor",
+        question=user_message,
+        answer=bot_response,
+        rating_sum=0,
+        rating_count=0,
+        is_generated=True
+    )
+    if cache_answer:
+        answer_cache.put(user_message, bot_response, kb_entry.id)
+    return kb_entry
+
+
 @api_view(["POST"])
 def chat_with_ai(request):
     """
-    First searches local KB for similar questions using keyword matching.
+    First searches local KB for similar questions (see lookup_chat_answer).
     If found, returns KB answer. If not, delegates to LLM.
     Visitors (unauthenticated users) can also use this endpoint.
+    Send the same "session_id" with every message of a conversation so the
+    LLM sees the recent turns (see chat_memory.py).
     """
     user = request.user if request.user.is_authenticated else None
 
@@ -1512,162 +2070,183 @@ def chat_with_ai(request):
     if not user_message:
         return Response({"error": "Message is required"}, status=400)
 
-    # Step 1: Search KB using keyword-based matching
-    # Common stop words to filter out
-    stop_words = {
-        'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', 'your',
-        'yours', 'yourself', 'yourselves', 'he', 'him', 'his', 'himself', 'she',
-        'her', 'hers', 'herself', 'it', 'its', 'itself', 'they', 'them', 'their',
-        'theirs', 'themselves', 'what', 'which', 'who', 'whom', 'this', 'that',
-        'these', 'those', 'am', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
-        'have', 'has', 'had', 'having', 'do', 'does', 'did', 'doing', 'a', 'an',
-        'the', 'and', 'but', 'if', 'or', 'because', 'as', 'until', 'while', 'of',
-        'at', 'by', 'for', 'with', 'about', 'against', 'between', 'into', 'through',
-        'during', 'before', 'after', 'above', 'below', 'to', 'from', 'up', 'down',
-        'in', 'out', 'on', 'off', 'over', 'under', 'again', 'further', 'then',
-        'once', 'here', 'there', 'when', 'where', 'why', 'how', 'all', 'each',
-        'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only',
-        'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just',
-        'don', 'should', 'now', 'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren',
-        'couldn', 'didn', 'doesn', 'hadn', 'hasn', 'haven', 'isn', 'ma', 'mightn',
-        'mustn', 'needn', 'shan', 'shouldn', 'wasn', 'weren', 'won', 'wouldn',
-        'could', 'would', 'please', 'tell', 'know', 'want', 'like', 'get', 'make'
-    }
-
-    # Extract keywords from user message (remove punctuation, lowercase, filter stop words)
-    import re
-    words = re.findall(r'\b[a-zA-Z]+\b', user_message.lower())
-    keywords = [w for w in words if w not in stop_words and len(w) > 2]
-
-    kb_match = None
-    if keywords:
-        # Build query to find entries matching any keyword in question OR answer
-        from django.db.models import Q, Case, When, IntegerField, Value
-
-        # Create Q objects for each keyword
-        q_filter = Q()
-        for keyword in keywords:
-            q_filter |= Q(question__icontains=keyword) | Q(answer__icontains=keyword)
-
-        # Get all matching entries that aren't removed (prioritize employee-authored entries)
-        matching_entries = KnowledgeBaseEntry.objects.filter(
-            q_filter,
-            is_removed=False,
-            author_type='employee'  # Only match employee-authored KB entries, not cached LLM responses
-        )
-
-        # Score each entry by how many keywords it matches
-        best_match = None
-        best_score = 0
+    mode = request.data.get("mode", "auto")
+    if mode not in CHAT_MODES:
+        return Response({"error": "mode must be auto, keyword or semantic"}, status=400)
 
-        for entry in matching_entries:
-            score = 0
-            entry_text = (entry.question + " " + entry.answer).lower()
-            for keyword in keywords:
-                if keyword in entry_text:
-                    score += 1
+    # Conversation memory for follow-up questions (optional "session_id" from the client)
+    memory_key = chat_memory.session_key(user, request.data.get("session_id"))
 
-            # Prefer entries with higher ratings
-            if entry.rating_count > 0:
-                avg_rating = entry.rating_sum / entry.rating_count
-                score += avg_rating * 0.5  # Boost by rating
+    # Steps 1-2: KB match or a cached LLM answer
+    follow_up = bool(chat_memory.history_messages(memory_key))
+    answer = lookup_chat_answer(user_message, mode, follow_up)
+    if answer:
+        chat_memory.append(memory_key, user_message, answer["response"])
+        return Response(answer)
 
-            if score > best_score:
-                best_score = score
-                best_match = entry
+    # Step 3: No KB match - delegate to LLM with KB context (RAG)
+    try:
+        # Cached base plus the KB entries and menu items relevant to this
+        # message (see prompt_context.py), then the recent conversation
+        messages, had_history = build_llm_messages(user_message, memory_key)
+
+        def generate():
+            # Goes through the shared gateway (pooled client, concurrency limits, timeouts)
+            response = gateway.chat(messages, user_key=user_key_for(request, user))
+            bot_response = response['message']['content']
+            if not bot_response.strip():
+                raise LLMCallFailed("The AI assistant returned an empty answer. Please try again.")
+            kb_entry = save_llm_answer(user, user_message, bot_response, cache_answer=not had_history)
+            return {"response": bot_response, "entry_id": kb_entry.id}
+
+        if had_history:
+            result, shared = generate(), False
+        else:
+            # Identical questions already being answered wait for that answer (see single_flight.py)
+            result, shared = llm_flight.do(flight_key(user_message), generate)
 
-        # Only use KB match if at least 2 keywords match (or 1 if only 1 keyword)
-        min_matches = 1 if len(keywords) == 1 else 2
-        if best_score >= min_matches:
-            kb_match = best_match
+        chat_memory.append(memory_key, user_message, result["response"])
 
-    if kb_match:
         return Response({
-            "response": kb_match.answer,
-            "entry_id": kb_match.id,
-            "source": "knowledge_base",
-            "message": "Please rate this answer"
+            **result,
+            "source": "llm",
+            **({"coalesced": True} if shared else {}),
         })
 
-    # Step 2: No KB match - delegate to LLM with KB context (RAG)
-    ollama_host = os.getenv("OLLAMA_HOST")
-    ollama_key = os.getenv("OLLAMA_API_KEY")
+    except LLMGatewayError as e:
+        return Response({"error": str(e)}, status=e.status)
+    except Exception as e:
+        return Response({"error": f"AI Error: {str(e)}. Is Ollama running?"}, status=503)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 
+@csrf_exempt
+async def chat_with_ai_stream(request):
+    """
+    Streaming variant of chat_with_ai (Server-Sent Events, serve under ASGI).
+    Same request body. Events:
+        answer  a KB or cached answer, sent whole ({"response", "entry_id", "source", ...})
+        token   a piece of the LLM answer ({"content"})
+        done    the LLM answer is complete and saved ({"entry_id", "source"})
+        error   the LLM call failed ({"error"})
+    The KB entry for an LLM answer is only created once the stream completes.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
     try:
-        client = Client(
-            host=ollama_host,
-            headers={'Authorization': f'Bearer {ollama_key}'}
-        )
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
 
-        # Build knowledge context from all KB entries
-        kb_entries = KnowledgeBaseEntry.objects.filter(is_removed=False).order_by('-rating_sum')[:50]
-        kb_context = ""
-        if kb_entries:
-            kb_context = "\n\nKnowledge Base (use this information to answer questions):\n"
-            for entry in kb_entries:
-                kb_context += f"Q: {entry.question}\nA: {entry.answer}\n\n"
-
-        # Get menu items for context
-        menu_items = MenuItem.objects.all()[:20]
-        menu_context = ""
-        if menu_items:
-            menu_context = "\n\nOur Menu Items:\n"
-            for item in menu_items:
-                vip_tag = " (VIP Exclusive)" if item.is_vip_exclusive else ""
-                menu_context += f"- {item.name}: ${item.price}{vip_tag} - {item.description[:100] if item.description else 'No description'}\n"
-
-        # Get chef info
-        chefs = Chef.objects.all()
-        chef_context = ""
-        if chefs:
-            chef_context = "\n\nOur Chefs:\n"
-            for chef in chefs:
-                chef_context += f"- {chef.user_profile.user.username} (Rating: {chef.average_rating or 'N/A'})\n"
-
-        system_prompt = f"""You are a helpful customer service assistant for Mashallah Eats, an online Middle Eastern restaurant ordering and delivery system.
-
-About Mashallah Eats:
-- We offer authentic Middle Eastern dishes prepared by our talented chefs
-- Customers can browse menus, place orders, and get food delivered
-- Registered customers can rate food and delivery quality (1-5 stars)
-- VIP status is earned after spending $100 or making 3 orders
-- VIP members get 5% discount, access to exclusive dishes, and 1 free delivery per 3 orders
-- Customers can file complaints or compliments about chefs and delivery personnel
-- We have a discussion forum where customers can discuss chefs, dishes, and delivery experiences
-
-Our Menu:
-- Beef Shawarma Wrap - $9.49: Thin-sliced spiced beef wrapped in warm pita with tahini sauce.
-- Mixed Grill Platter - $18.99 (VIP Only): Skewers of chicken, kofta, and lamb served with rice and grilled vegetables.
-- Lamb Kabsa - $15.99: Traditional Gulf rice dish cooked with tender lamb, tomatoes, and warm spices.
-- Maqluba - $14.99 (VIP Only): Layered rice dish with chicken, eggplant, and cauliflower flipped before serving.
-- Chicken Shawarma Plate - $12.99: Marinated chicken roasted on a vertical spit, served with rice, garlic sauce, and salad.
-{kb_context}{menu_context}{chef_context}
-Use the above information to answer questions accurately. Keep responses helpful, concise, and friendly. If you don't know specific details, suggest the customer contact the manager."""
-
-        response = client.chat(model='gpt-oss:20b', messages=[
-            {'role': 'system', 'content': system_prompt},
-            {'role': 'user', 'content': user_message}
-        ])
-
-        bot_response = response['message']['content']
-
-        kb_entry = KnowledgeBaseEntry.objects.create(
-            author=user,  # None for visitors
-            author_type="customer" if user else "visitor",
-            question=user_message,
-            answer=bot_response,
-            rating_sum=0,
-            rating_count=0
-        )
+    user = await request.auser()
+    user = user if user.is_authenticated else None
 
-        return Response({
-            "response": bot_response,
-            "entry_id": kb_entry.id,
-            "source": "llm"
-        })
+    user_message = data.get("message")
+    if not user_message:
+        return JsonResponse({"error": "Message is required"}, status=400)
+    mode = data.get("mode", "auto")
+    if mode not in CHAT_MODES:
+        return JsonResponse({"error": "mode must be auto, keyword or semantic"}, status=400)
+
+    memory_key = chat_memory.session_key(user, data.get("session_id"))
+
+    follow_up = bool(await sync_to_async(chat_memory.history_messages)(memory_key))
+    answer = await sync_to_async(lookup_chat_answer)(user_message, mode, follow_up)
+
+    call = key = None
+    if not answer:
+        messages, had_history = await sync_to_async(build_llm_messages)(user_message, memory_key)
+        if not had_history:
+            # Identical questions already being answered wait for that answer,
+            # which is then sent whole (see single_flight.py)
+            key = flight_key(user_message)
+            call, leader = llm_flight.join(key)
+            if not leader:
+                try:
+                    result = await sync_to_async(llm_flight.wait, thread_sensitive=False)(call)
+                    answer = {**result, "source": "llm", "coalesced": True}
+                except LLMGatewayError as e:
+                    return JsonResponse({"error": str(e)}, status=e.status)
+                except LeaderGone:
+                    pass  # Generate it ourselves
+                call = None
+
+    if answer:
+        await sync_to_async(chat_memory.append)(memory_key, user_message, answer["response"])
+
+        async def events():
+            yield sse_event("answer", answer)
+    else:
+        stream = gateway.astream(messages, user_key=user_key_for(request, user))
+
+        # Wait for the first chunk before answering, so a busy gateway or an
+        # open circuit is still a proper 429/503 rather than an event
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except LLMGatewayError as e:
+            if call is not None:
+                llm_flight.finish(key, call, error=e)
+            return JsonResponse({"error": str(e)}, status=e.status)
+
+        async def events():
+            nonlocal call
+            parts = []
+            try:
+                try:
+                    chunk = first
+                    while chunk is not None:
+                        token = chunk['message']['content']
+                        if token:
+                            parts.append(token)
+                            yield sse_event("token", {"content": token})
+                        chunk = await anext(stream, None)
+                except LLMGatewayError as e:
+                    if call is not None:
+                        llm_flight.finish(key, call, error=e)
+                        call = None
+                    yield sse_event("error", {"error": str(e)})
+                    return
+                finally:
+                    await stream.aclose()
+
+                # Client disconnects cancel the generator before this point, so
+                # partial answers are never stored
+                bot_response = "".join(parts)
+                if not bot_response.strip():
+                    # Nothing to show, and a blank KB entry would be served to later askers
+                    error = LLMCallFailed("The AI assistant returned an empty answer. Please try again.")
+                    if call is not None:
+                        llm_flight.finish(key, call, error=error)
+                        call = None
+                    yield sse_event("error", {"error": str(error)})
+                    return
+                kb_entry = await sync_to_async(save_llm_answer)(user, user_message, bot_response, not had_history)
+                if call is not None:
+                    llm_flight.finish(key, call, result={"response": bot_response, "entry_id": kb_entry.id})
+                    call = None
+                await sync_to_async(chat_memory.append)(memory_key, user_message, bot_response)
+                yield sse_event("done", {"entry_id": kb_entry.id, "source": "llm"})
+            finally:
+                if call is not None:
+                    llm_flight.finish(key, call)  # Disconnected: waiters generate their own
+
+    return StreamingHttpResponse(events(), content_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Don't let a reverse proxy buffer the stream
+    })
 
-    except Exception as e:
-        return Response({"error": f"AI Error: {str(e)}. Is Ollama running?"}, status=503)
+
+@api_view(["POST"])
+def reset_chat(request):
+    """Forget the conversation for this session_id (e.g. when the chat is reopened)."""
+    user = request.user if request.user.is_authenticated else None
+    chat_memory.clear(chat_memory.session_key(user, request.data.get("session_id")))
+    return Response({"message": "Conversation cleared"})
 
 
 @api_view(["POST"])
@@ -1743,6 +2322,7 @@ def my_kb_entries(request):
 def rate_kb_entry(request):
     """
     Rate an answer. If rating is 0, flag it for manager review.
+    Each user can rate an entry once (see kb_ratings.py).
     """
     user = request.user
     if not user.is_authenticated:
@@ -1754,34 +2334,50 @@ def rate_kb_entry(request):
     if entry_id is None or rating is None:
         return Response({"error": "entry_id and rating are required"}, status=400)
 
-    try:
-        entry = KnowledgeBaseEntry.objects.get(id=entry_id)
-        
-        # Security: Decide who can rate. For now, anyone logged in can rate.
-        
-        rating = int(rating)
-        if rating < 0 or rating > 5:
-            return Response({"error": "Rating must be 0-5"}, status=400)
-
-        # 1. Update Rating Stats
-        entry.rating_sum += rating
-        entry.rating_count += 1
-
-        # 2. Flagging Logic (Requirement: Flag if rating = 0)
-        if rating == 0:
-            entry.is_flagged = True
-            entry.flagged_count += 1
-        
-        entry.save()
-
-        return Response({
-            "message": "Rating submitted",
-            "new_average": entry.average_rating,
-            "is_flagged": entry.is_flagged
-        })
+    parsed = parse_rating(entry_id, rating)
+    if parsed is None:
+        return Response({"error": "Rating must be 0-5"}, status=400)
 
-    except KnowledgeBaseEntry.DoesNotExist:
+    result = rate_entry(user, *parsed)
+    if result["status"] == "not_found":
         return Response({"error": "Entry not found"}, status=404)
+    if result["status"] == "duplicate":
+        return Response({"error": "You have already rated this answer"}, status=409)
+
+    return Response({
+        "message": "Rating submitted",
+        "new_average": result["new_average"],
+        "is_flagged": result["is_flagged"]
+    })
+
+
+@api_view(["POST"])
+def rate_kb_entries_bulk(request):
+    """
+    Rate several answers at once: {"ratings": [{"entry_id": 1, "rating": 5}, ...]}.
+    Returns one result per rating with status rated, duplicate, not_found or invalid.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return Response({"error": "Authentication required"}, status=401)
+
+    items = request.data.get("ratings")
+    if not isinstance(items, list) or not items:
+        return Response({"error": "ratings must be a non-empty list"}, status=400)
+    if len(items) > MAX_BULK_RATINGS:
+        return Response({"error": f"At most {MAX_BULK_RATINGS} ratings per request"}, status=400)
+
+    parsed = [
+        parse_rating(item.get("entry_id"), item.get("rating")) if isinstance(item, dict) else None
+        for item in items
+    ]
+    results = iter(rate_entries(user, [p for p in parsed if p is not None]))
+    return Response({
+        "results": [
+            next(results) if p is not None else {"entry_id": item.get("entry_id") if isinstance(item, dict) else None, "status": "invalid"}
+            for item, p in zip(items, parsed)
+        ]
+    })
 
 
 @api_view(["GET", "POST", "DELETE"])
@@ -1829,6 +2425,7 @@ def manage_kb(request):
                 author.userprofile.can_contribute_knowledge = False
                 author.userprofile.save()
 
+            answer_cache.discard(entry.id)
             entry.delete()
             return Response({
                 "message": "Entry deleted successfully",
@@ -1836,11 +2433,33 @@ def manage_kb(request):
             })
         except KnowledgeBaseEntry.DoesNotExist:
             return Response({"error": "Entry not found"}, status=404)
+
+
+@api_view(["GET"])
+def chat_cache_stats(request):
+    """Manager only: this process's LLM answer cache, gateway and prompt size metrics."""
+    user = request.user
+    if not user.is_authenticated:
+        return Response({"error": "Authentication required"}, status=401)
+    if not hasattr(user, 'userprofile') or user.userprofile.user_type != 'manager':
+        return Response({"error": "Managers only"}, status=403)
+
+    return Response({
+        "answer_cache": answer_cache.metrics(),
+        "llm_gateway": gateway.metrics(),
+        "prompt": prompt_stats.metrics(),
+        "single_flight": llm_flight.metrics(),
+    })
+
         
 @api_view(["GET"])       
 def AIDiscussionReview(request):
+    """
+    Stored AI summaries, newest topics first. A topic is re-summarized in the
+    background when its posts change; python manage.py refresh_discussion_summaries
+    fills in the rest (see discussion_summaries.py).
+    """
     user = request.user
-    ai_summaries = []
 
     if not user.is_authenticated:
         return Response({"error": "Authentication required"}, status=401)
@@ -1849,64 +2468,24 @@ def AIDiscussionReview(request):
     if profile.user_type != "manager":
         return Response({"error": "Only managers can see AI Summaries"}, status=403)
 
-    # Get all discussion topics
-    discussions = DiscussionTopic.objects.all().order_by('-created_at')
+    summaries = DiscussionSummary.objects.select_related(
+        'topic__author', 'topic__related_dish'
+    ).order_by('-topic__created_at')
 
-    for discussion in discussions:
-        posts = discussion.posts.all()
-        if not posts:
-            continue
-
-        post_contents = [post.content for post in posts]
-
-        topic_data = {
-            "topic_id": discussion.id,
-            "topic_title": discussion.title,
-            "author": discussion.author.username if discussion.author else "Unknown",
-            "related_dish": discussion.related_dish.name if discussion.related_dish else None,
-            "comments": post_contents
-        }
-
-        ai_response = call_ai_api_topics(topic_data)
-
-        ai_summaries.append({
-            "topic_id": discussion.id,
-            "topic_title": discussion.title,
-            "author": topic_data["author"],
-            "related_dish": topic_data["related_dish"],
-            "post_count": len(post_contents),
-            "AI_summary": ai_response['message']['content']
-        })
+    ai_summaries = [{
+        "topic_id": s.topic_id,
+        "topic_title": s.topic.title,
+        "author": s.topic.author.username if s.topic.author else "Unknown",
+        "related_dish": s.topic.related_dish.name if s.topic.related_dish else None,
+        "post_count": s.post_count,
+        "AI_summary": s.summary,
+        "updated_at": s.updated_at,
+    } for s in summaries]
 
     return Response({
         "ai_summaries": ai_summaries
     })
 
-def call_ai_api_topics(data):
-    ollama_host = os.getenv("OLLAMA_HOST")
-    ollama_key = os.getenv("OLLAMA_API_KEY")
-
-    client = Client(
-        host=ollama_host,
-        headers={'Authorization': f'Bearer {ollama_key}'}
-    )
-
-    # Make comment bullets
-    comments_text = "\n".join([f"- {c}" for c in data.get("comments", [])])
-
-    dish_info = f"Related Dish: {data['related_dish']}\n" if data.get('related_dish') else ""
-
-    note = "Provide a brief summary of this discussion topic. What are the main points being discussed? What is the overall sentiment? Keep it concise (2-3 sentences max)."
-
-    content = f"{note}\n\nTopic: {data['topic_title']}\nStarted by: {data['author']}\n{dish_info}\nComments:\n{comments_text}"
-
-    response = client.chat(
-        model='gpt-oss:20b',
-        messages=[{'role': 'user', 'content': content}]
-    )
-
-    return response       
-
 @api_view(["POST"])
 @csrf_exempt
 def dispute_complaint(request):
@@ -2136,8 +2715,8 @@ def list_employees(request):
         return Response({"error": "Manager access required"}, status=403)
 
     return Response({
-        "chefs": ChefListSerializer(Chef.objects.all(), many=True).data,
-        "delivery_persons": DeliveryPersonListSerializer(DeliveryPerson.objects.all(), many=True).data
+        "chefs": ChefListSerializer(chef_roster(), many=True).data,
+        "delivery_persons": DeliveryPersonListSerializer(delivery_roster(), many=True).data
     })
 
 
@@ -2344,16 +2923,19 @@ def close_customer_account(request):
         return Response(serializer.errors, status=400)
 
     data = serializer.validated_data
-    try:
-        customer = CustomerProfile.objects.get(id=data["customer_id"])
-    except CustomerProfile.DoesNotExist:
-        return Response({"error": "Customer not found"}, status=404)
+    with transaction.atomic():
+        try:
+            customer = CustomerProfile.objects.select_for_update().select_related("user_profile").get(id=data["customer_id"])
+        except CustomerProfile.DoesNotExist:
+            return Response({"error": "Customer not found"}, status=404)
 
-    cleared = customer.deposit_balance
-    customer.deposit_balance = Decimal("0")
-    if data.get("reason") == "kicked":
-        customer.is_blacklisted = True
-    customer.save()
+        # Pay out what is left of the deposit
+        cleared = customer.deposit_balance
+        if cleared > 0:
+            ledger.record(customer, "withdrawal", cleared)
+        if data.get("reason") == "kicked":
+            customer.is_blacklisted = True
+        customer.save()
 
     customer.user_profile.user.is_active = False
     customer.user_profile.user.save()
@@ -173,3 +173,88 @@ REST_FRAMEWORK = {
         'api.authentication.CsrfExemptSessionAuthentication',
     ],
 }
+
+# Live bidding WebSocket events (see api/realtime.py). The in-memory layer
+# only reaches sockets served by the same process: an event published by one
+# worker (or by a management command such as close_bid_windows) is not seen by
+# clients connected to another. Swap for a shared (e.g. Redis-backed) layer
+# when running more than one ASGI process.
+REALTIME_CHANNEL_LAYER = "api.realtime.InMemoryChannelLayer"
+
+# Pending orders with bids are assigned to the lowest bidder after this many
+# minutes (python manage.py close_bid_windows --loop)
+BID_WINDOW_MINUTES = 15
+BID_WINDOW_BATCH_SIZE = 200
+
+# Offline geocoding and multi-drop batching (see api/geocoding.py).
+# Gazetteer CSV columns: address,lat,lng
+GAZETTEER_PATH = BASE_DIR / "data" / "gazetteer.csv"
+BATCH_GEOHASH_PRECISION = 7  # ~150m x 150m cells
+BATCH_WINDOW_MINUTES = 10
+
+# Keyword KB matching for the chat (see api/kb_search.py): BM25 score an entry
+# matching only one of a message's keywords needs. None turns that off.
+KB_SINGLE_TERM_MIN_SCORE = 2.5
+
+# Semantic KB matching for the chat (see api/kb_vectors.py). Rebuild with
+# python manage.py rebuild_kb_vectors
+KB_VECTOR_DIR = BASE_DIR / "data" / "kb_vectors"
+KB_SEMANTIC_THRESHOLD = 0.12
+KB_SEMANTIC_FOLLOW_UP_THRESHOLD = 0.35  # Messages with conversation history
+
+# LLM answer cache for the chat (see api/llm_cache.py). Set
+# LLM_CACHE_SIMILARITY = None to only reuse answers to identical questions.
+LLM_CACHE_SIZE = 1000
+LLM_CACHE_TTL = 3600  # seconds
+LLM_CACHE_SIMILARITY = 0.8
+
+# Chat system prompt (see api/prompt_context.py). The base prompt is cached
+# until the chefs change or this many seconds pass.
+PROMPT_CONTEXT_TTL = 300
+# Estimated-token budget for the KB entries and menu items picked per message,
+# and how many of each are considered
+PROMPT_CONTEXT_TOKENS = 800
+PROMPT_CONTEXT_KB_K = 5
+PROMPT_CONTEXT_MENU_K = 5
+# How long Ollama keeps the model loaded after a chat request
+OLLAMA_KEEP_ALIVE = "30m"
+
+# Shared LLM gateway (see api/llm_gateway.py). Calls beyond the concurrency
+# limits wait in a queue of LLM_MAX_QUEUE; when it is full callers get a 429.
+LLM_MODEL = "gpt-oss:20b"
+LLM_MAX_CONCURRENCY = 8
+LLM_PER_USER_CONCURRENCY = 2
+LLM_MAX_QUEUE = 32
+LLM_QUEUE_TIMEOUT = 10  # seconds
+LLM_TIMEOUT = 120  # seconds per call
+LLM_BREAKER_FAILURES = 5
+LLM_BREAKER_COOLDOWN = 30  # seconds
+# Visitors share a per-user limit by address. Behind a reverse proxy every
+# request comes from the proxy, so set this to the number of proxies that
+# append to X-Forwarded-For (e.g. 1 for nginx in front of gunicorn).
+LLM_TRUSTED_PROXY_COUNT = 0
+
+# AI summaries of discussion topics (see api/discussion_summaries.py). A topic
+# is re-summarized in the background when a post is added or deleted; fill in
+# or catch up with: python manage.py refresh_discussion_summaries
+DISCUSSION_SUMMARY_WORKERS = 2  # threads for both
+DISCUSSION_SUMMARY_AUTO_REFRESH = True
+
+# Chat conversation memory (see api/chat_memory.py)
+CHAT_MEMORY_TURNS = 12  # messages kept per session
+CHAT_MEMORY_MAX_CHARS = 1000  # per message
+CHAT_MEMORY_TOKENS = 400  # history budget per LLM call
+CHAT_MEMORY_TTL = 30 * 60  # seconds idle before a session is forgotten
+
+# Coalesce identical in-flight chat questions across processes too, through a
+# lock in the cache (see api/single_flight.py). Needs a shared cache backend.
+CHAT_SINGLE_FLIGHT_SHARED = False
+
+# Retention for LLM answers stored in the KB (see api/kb_retention.py)
+KB_GENERATED_TTL_DAYS = 30
+KB_RETENTION_MIN_RATING = 3  # average stars an entry needs to outlive the TTL
+KB_RETENTION_CHUNK = 500  # rows per delete transaction
+
+# Customer deposit ledger (see api/ledger.py): snapshot a customer's balance
+# every this many entries, so historical balances never sum more than that
+LEDGER_SNAPSHOT_EVERY = 50